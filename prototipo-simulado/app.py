@@ -3,17 +3,29 @@
 Versão 4.0 - Google Sheets + WhatsApp + TTS
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response
 from flask_cors import CORS
 from datetime import datetime
 import os
 from threading import Thread
 import time
+import io
 import google.generativeai as genai
 from gtts import gTTS
 import uuid
-from whatsapp_integration import whatsapp_client, MensagensSUS
-from google_sheets import sheets_client
+from whatsapp_integration import whatsapp_client, MensagensSUS, TTS
+from armazenamento import agenda, espelho
+import importador_agenda
+from fila_jobs import fila
+from retencao_audios import retencao
+from deduplicacao import deduplicador
+from fila_webhook import FilaPorTelefone
+from processos import Lideranca, trava_entre_processos, trava_por_chave
+from cache_orientacoes import CacheOrientacoes
+from disparador_lembretes import DisparadorLembretes
+from eventos import eventos, EVENTOS_INTERVALO_VERSAO
+from respostas_versionadas import RespostasVersionadas
+from modelo_agenda import Status, parse_data, sufixo_telefone
 import requests
 import atexit
 
@@ -26,6 +38,9 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 AUDIO_PATH = os.path.join(BASE_DIR, 'static', 'audios')
 os.makedirs(AUDIO_PATH, exist_ok=True)
 
+# Pacientes aceitos por chamada de /api/agendar/lote
+AGENDAR_LOTE_MAX = int(os.environ.get('AGENDAR_LOTE_MAX', '5000'))
+
 # Gemini API
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
 if GEMINI_API_KEY:
@@ -34,8 +49,50 @@ if GEMINI_API_KEY:
 else:
     modelo_gemini = None
 
-# Controle de mensagens processadas
-mensagens_processadas = set()
+# ==================== EVENTOS DO PAINEL (SSE) ====================
+
+def resumo_painel():
+    """Métricas e status da agenda (o que os cards do painel mostram)"""
+    return {"metricas": agenda.contar_metricas(), "status": agenda.status_planilha()}
+
+# Última versão da agenda que os painéis deste processo já receberam
+versao_publicada = {"valor": None}
+
+def notificar_mudanca(tipo, dados):
+    """Chamado pelo backend a cada escrita: avisa os painéis conectados"""
+    versao_publicada["valor"] = agenda.versao_dados()
+    eventos.publicar('agenda', {"tipo": tipo, **dados})
+    # Uma rajada de escritas (importação, lote de lembretes) vira um único evento de métricas
+    eventos.publicar_agrupado('metricas', resumo_painel)
+
+agenda.ao_mudar = notificar_mudanca
+
+def iniciar_observador_versao():
+    """Escritas feitas por outro processo não passam por notificar_mudanca deste:
+    enquanto houver painel conectado, a versão da agenda é conferida periodicamente"""
+    def loop_observador():
+        while True:
+            time.sleep(EVENTOS_INTERVALO_VERSAO)
+            if not eventos.assinantes:
+                continue
+            try:
+                versao = agenda.versao_dados()
+            except Exception as e:
+                print(f"❌ Erro ao conferir versão da agenda: {e}")
+                continue
+            if versao_publicada["valor"] is None:
+                versao_publicada["valor"] = versao
+            elif versao != versao_publicada["valor"]:
+                versao_publicada["valor"] = versao
+                eventos.publicar('agenda', {"tipo": "sincronizacao"})
+                eventos.publicar_agrupado('metricas', resumo_painel)
+    
+    thread = Thread(target=loop_observador, daemon=True)
+    thread.start()
+    return thread
+
+# Rotas de leitura com ETag pela versão da agenda (304 sem consultar o armazenamento)
+respostas = RespostasVersionadas(agenda.versao_dados, origem=agenda.origem_versao)
 
 # ==================== SISTEMA DE LEMBRETES ====================
 
@@ -46,63 +103,76 @@ LEMBRETES_CONFIG = [
     {"dias": 1, "template": "lembrete_24h"},  # 24 horas = 1 dia
 ]
 
+def planejar_lembretes():
+    """Plano de lembretes devidos agora, para todos os intervalos numa só leitura da agenda"""
+    inicio = time.perf_counter()
+    por_dias = agenda.planejar_lembretes([config["dias"] for config in LEMBRETES_CONFIG])
+    
+    itens = []
+    for config in LEMBRETES_CONFIG:
+        dias = config["dias"]
+        for ag in por_dias.get(dias, []):
+            ag["template"] = config["template"]
+            ag["tipo_lembrete"] = f"{dias} dia(s)"
+            itens.append(ag)
+    
+    return {
+        "itens": itens,
+        "total": len(itens),
+        "por_intervalo": {f"{dias}d": len(lista) for dias, lista in por_dias.items()},
+        "tempo_ms": round((time.perf_counter() - inicio) * 1000, 1),
+        "gerado_em": datetime.now().isoformat(timespec='seconds')
+    }
+
+def enviar_lembrete(ag):
+    """Envia um lembrete do plano (texto + áudio composto); True se entregue"""
+    mensagem, segmentos = MensagensSUS.montar(
+        ag["template"],
+        nome=ag["paciente"],
+        exame=ag["exame"],
+        data=ag["data"],
+        horario=ag["horario"],
+        clinica=ag["clinica"]
+    )
+    resultado = whatsapp_client.enviar_mensagem_completa(
+        ag["telefone"], mensagem, com_audio=True, segmentos=segmentos
+    )
+    if resultado.get("sucesso"):
+        print(f"✅ Lembrete {ag['dias_restantes']}d enviado: {ag['paciente']} - {ag['exame']}")
+        return True
+    print(f"❌ Falha ao enviar lembrete: {ag['paciente']}")
+    return False
+
+# Workers + token bucket na taxa da Evolution API; marcações gravadas num lote só
+disparador = DisparadorLembretes(enviar_lembrete, lambda enviados: agenda.marcar_lembretes_enviados(enviados))
+
 def enviar_lembretes():
-    """Verifica e envia lembretes para todos os períodos configurados"""
+    """Verifica e envia lembretes (um disparo por vez, mesmo com vários processos)"""
+    with trava_entre_processos('lembretes', bloquear=False) as livre:
+        if not livre:
+            print("⏳ Disparo de lembretes em andamento em outro processo, pulando")
+            return
+        _enviar_lembretes()
+
+def _enviar_lembretes():
     print(f"\n🔔 [{datetime.now().strftime('%H:%M')}] Verificando lembretes...")
     
-    if not sheets_client.conectado:
-        print("⚠️ Google Sheets não conectado")
+    if not agenda.conectado:
+        print("⚠️ Agenda não conectada")
         return
     
-    total_enviados = 0
+    plano = planejar_lembretes()
+    if not plano["itens"]:
+        print("📭 Nenhum lembrete para enviar agora")
+        return
     
-    for config in LEMBRETES_CONFIG:
-        dias = config["dias"]
-        template_name = config["template"]
-        
-        # Buscar agendamentos que precisam de lembrete
-        agendamentos = sheets_client.buscar_agendamentos_para_lembrete(dias)
-        
-        if agendamentos:
-            print(f"📋 {len(agendamentos)} lembretes de {dias} dia(s) para enviar")
-        
-        for ag in agendamentos:
-            try:
-                # Selecionar template correto
-                template_func = getattr(MensagensSUS, template_name)
-                mensagem = template_func(
-                    ag["paciente"],
-                    ag["exame"],
-                    ag["data"],
-                    ag["horario"],
-                    ag["clinica"]
-                )
-                
-                # Enviar mensagem com áudio
-                resultado = whatsapp_client.enviar_mensagem_completa(
-                    ag["telefone"], 
-                    mensagem, 
-                    com_audio=True
-                )
-                
-                if resultado.get("sucesso"):
-                    # Marcar lembrete como enviado
-                    sheets_client.marcar_lembrete_enviado(ag["linha"], dias)
-                    total_enviados += 1
-                    print(f"✅ Lembrete {dias}d enviado: {ag['paciente']} - {ag['exame']}")
-                else:
-                    print(f"❌ Falha ao enviar lembrete: {ag['paciente']}")
-                
-                # Pequena pausa entre envios
-                time.sleep(2)
-                
-            except Exception as e:
-                print(f"❌ Erro ao enviar lembrete: {e}")
+    print(f"📋 {plano['total']} lembretes para enviar {plano['por_intervalo']} "
+          f"(planejado em {plano['tempo_ms']} ms)")
     
-    if total_enviados > 0:
-        print(f"✅ Total: {total_enviados} lembretes enviados")
-    else:
-        print("📭 Nenhum lembrete para enviar agora")
+    relatorio = disparador.executar(plano["itens"])
+    if relatorio:
+        print(f"✅ Total: {relatorio['enviados']}/{relatorio['total']} lembretes enviados "
+              f"em {relatorio['segundos']}s ({relatorio['falhas']} falhas)")
 
 def iniciar_scheduler_lembretes():
     """Inicia thread que verifica lembretes periodicamente"""
@@ -122,24 +192,80 @@ def iniciar_scheduler_lembretes():
 
 # ==================== IA GEMINI ====================
 
-def gerar_orientacoes(exame):
-    """Gera orientações educativas com IA"""
-    if not modelo_gemini:
-        return ""
-    
-    try:
-        prompt = f"""Você é um médico do SUS. Crie orientações CURTAS para consulta de {exame}.
+def consultar_gemini(exame):
+    """Pede ao Gemini orientações educativas para o exame"""
+    prompt = f"""Você é um médico do SUS. Crie orientações CURTAS para consulta de {exame}.
 Formato:
 📋 O que levar: [3 itens]
 ⚠️ Jejum: [Sim/Não]
 💡 Dica preventiva específica de {exame}
 
 Máximo 50 palavras."""
-        
-        resposta = modelo_gemini.generate_content(prompt)
-        return resposta.text.strip()
-    except:
+    
+    resposta = modelo_gemini.generate_content(prompt)
+    return resposta.text.strip()
+
+# Uma geração por especialidade, reaproveitada entre agendamentos e restarts
+orientacoes = CacheOrientacoes(consultar_gemini)
+
+def gerar_orientacoes(exame):
+    """Orientações educativas da IA (do cache, com tempo máximo de espera)"""
+    if not modelo_gemini:
         return ""
+    return orientacoes.obter(exame)
+
+def aquecer_orientacoes():
+    """Gera em segundo plano as orientações de todas as especialidades da agenda"""
+    if not modelo_gemini or not agenda.conectado:
+        return 0
+    try:
+        return orientacoes.aquecer(agenda.listar_exames())
+    except Exception as e:
+        print(f"⚠️ Erro ao aquecer orientações: {e}")
+        return 0
+
+# ==================== JOBS DE NOTIFICAÇÃO ====================
+
+def job_notificar_agendamento(payload, progresso):
+    """Gera orientações, envia texto e áudio do agendamento (roda na fila)
+    
+    Cada etapa concluída fica em `progresso`, então um retry não reenvia
+    o texto quando só o áudio falhou.
+    """
+    telefone = payload["telefone"]
+    
+    if "mensagem" not in progresso:
+        mensagem, segmentos = MensagensSUS.montar(
+            'agendamento_confirmado', nome=payload["nome"], exame=payload["exame"],
+            data=payload["data"], horario=payload["horario"], clinica=payload["clinica"], prioridade=""
+        )
+        orientacoes = gerar_orientacoes(payload["exame"])
+        if orientacoes:
+            mensagem += f"\n\n{orientacoes}"
+            segmentos.append(f"\n\n{orientacoes}")
+        progresso["mensagem"] = mensagem
+        progresso["segmentos"] = segmentos
+    mensagem = progresso["mensagem"]
+    
+    if not progresso.get("texto_enviado"):
+        res = whatsapp_client.enviar_texto(telefone, mensagem)
+        if not res.get("sucesso"):
+            raise RuntimeError(f"falha ao enviar texto: {res.get('erro') or res.get('status')}")
+        progresso["texto_enviado"] = True
+    
+    if not progresso.get("audio_enviado"):
+        segmentos = progresso.get("segmentos")
+        audio = TTS.gerar_composto(segmentos) if segmentos else TTS.gerar(mensagem)
+        if not audio.get("sucesso"):
+            raise RuntimeError(f"falha no TTS: {audio.get('erro')}")
+        res = whatsapp_client.enviar_audio(telefone, audio["url"])
+        if not res.get("sucesso"):
+            raise RuntimeError("falha ao enviar áudio")
+        progresso["audio_enviado"] = True
+    
+    return {"texto_enviado": True, "audio_enviado": True}
+
+fila.registrar("notificar_agendamento", job_notificar_agendamento)
 
 # ==================== ÁUDIO IDOSOS ====================
 
@@ -163,74 +289,293 @@ Leve RG, Cartão SUS e exames anteriores. Chegue 15 minutos antes."""
 def index():
     return render_template('index.html')
 
+def montar_agendamento(linha, info, nome, telefone, exame):
+    """Agendamento como as rotas devolvem (info é o registro da vaga reservada)"""
+    return {
+        "id": linha,
+        "paciente": nome,
+        "telefone": telefone,
+        "exame": exame,
+        "clinica": info.get("clinica", ""),
+        "data": info.get("data", ""),
+        "horario": info.get("horario", ""),
+        "status": "pendente"
+    }
+
+def payload_notificacao(agendamento):
+    """Dados do job notificar_agendamento"""
+    return {
+        "nome": agendamento["paciente"],
+        "telefone": agendamento["telefone"],
+        "exame": agendamento["exame"],
+        "clinica": agendamento["clinica"],
+        "data": agendamento["data"],
+        "horario": agendamento["horario"]
+    }
+
 @app.route('/api/agendar', methods=['POST'])
 def agendar():
-    """Cadastra paciente e envia WhatsApp + Áudio"""
+    """Cadastra paciente e enfileira WhatsApp + Áudio (responde sem esperar o envio)"""
     data = request.json
     nome = data.get("nome", "").strip()
     telefone = data.get("telefone", "").strip()
     exame = data.get("exame", "").strip()
+    clinica = (data.get("clinica") or "").strip() or None
     
     if not all([nome, telefone, exame]):
         return jsonify({"erro": "Preencha todos os campos"}), 400
     
-    # Verificar conexão com Google Sheets
-    if not sheets_client.conectado:
-        return jsonify({"erro": "Google Sheets não conectado. Configure as credenciais."}), 400
+    # Verificar conexão com a agenda
+    if not agenda.conectado:
+        return jsonify({"erro": "Agenda não conectada. Configure o armazenamento."}), 400
     
-    # Buscar vaga no Google Sheets
-    linha, info = sheets_client.buscar_vaga(exame)
-    if linha is None:
+    # Buscar e reservar a vaga numa operação só (dois guichês não pegam a mesma)
+    linha, info = agenda.reservar_proxima_vaga(exame, nome, telefone, clinica)
+    if info == 'sem_vaga':
         return jsonify({"erro": f"Sem vagas para {exame}"}), 404
-    
-    # Reservar vaga
-    sucesso = sheets_client.reservar_vaga(linha, nome, telefone)
-    if not sucesso:
+    if info == 'disputa':
+        return jsonify({"erro": "Vagas disputadas por outros atendimentos, tente novamente"}), 409
+    if linha is None:
         return jsonify({"erro": "Erro ao reservar vaga"}), 500
     
     # Criar resposta
-    agendamento = {
-        "id": linha,
-        "paciente": nome, 
-        "telefone": telefone, 
-        "exame": exame, 
-        "clinica": info.get("clinica", ""),
-        "data": info.get("data", ""), 
-        "horario": info.get("horario", ""),
-        "status": "pendente"
-    }
+    agendamento = montar_agendamento(linha, info, nome, telefone, exame)
     
-    # Criar mensagem
-    orientacoes = gerar_orientacoes(exame)
+    # Mensagem base (as orientações da IA entram no job)
     mensagem = MensagensSUS.agendamento_confirmado(
         nome, exame, info.get('data', ''), info.get('horario', ''), info.get('clinica', '')
     )
-    if orientacoes:
-        mensagem += f"\n\n{orientacoes}"
     
-    # Enviar WhatsApp + TTS
-    whatsapp_client.enviar_mensagem_completa(telefone, mensagem, com_audio=True)
+    # Enfileirar WhatsApp + TTS
+    job_id = fila.enfileirar("notificar_agendamento", payload_notificacao(agendamento))
     
     return jsonify({
         "sucesso": True, 
         "agendamento": agendamento,
-        "mensagem": mensagem
+        "mensagem": mensagem,
+        "job_id": job_id
+    })
+
+def ler_pacientes_lote():
+    """Pacientes do pedido: arquivo .csv (campo file), corpo text/csv ou JSON
+    (lista, ou {"pacientes": [...]})"""
+    arquivo = request.files.get('file')
+    if arquivo and arquivo.filename:
+        return list(importador_agenda.ler_arquivo(arquivo.filename, arquivo.stream))
+    if request.mimetype == 'text/csv':
+        return list(importador_agenda.ler_csv(io.BytesIO(request.get_data())))
+    dados = request.get_json(silent=True)
+    if isinstance(dados, dict):
+        dados = dados.get("pacientes")
+    if not isinstance(dados, list):
+        raise ValueError('Envie uma lista de pacientes (JSON) ou um arquivo .csv')
+    return dados
+
+@app.route('/api/agendar/lote', methods=['POST'])
+def agendar_lote():
+    """Agenda vários pacientes de uma vez (campanhas): uma passada, uma escrita,
+    notificações enfileiradas juntas. Responde o resultado de cada paciente."""
+    if not agenda.conectado:
+        return jsonify({"erro": "Agenda não conectada. Configure o armazenamento."}), 400
+    
+    try:
+        pacientes = ler_pacientes_lote()
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+    if not pacientes:
+        return jsonify({"erro": "Nenhum paciente enviado"}), 400
+    if len(pacientes) > AGENDAR_LOTE_MAX:
+        return jsonify({"erro": f"Máximo de {AGENDAR_LOTE_MAX} pacientes por lote"}), 413
+    
+    resultados = []
+    pedidos = []  # (resultado, pedido) dos pacientes com todos os campos
+    for indice, paciente in enumerate(pacientes):
+        if not isinstance(paciente, dict):
+            paciente = {}
+        pedido = {campo: str(paciente.get(campo) or "").strip() for campo in ("nome", "telefone", "exame", "clinica")}
+        pedido["clinica"] = pedido["clinica"] or None
+        resultado = {"indice": indice, "nome": pedido["nome"], "telefone": pedido["telefone"],
+                     "exame": pedido["exame"], "sucesso": False}
+        resultados.append(resultado)
+        if not all([pedido["nome"], pedido["telefone"], pedido["exame"]]):
+            resultado["erro"] = "Preencha nome, telefone e exame"
+        else:
+            pedidos.append((resultado, pedido))
+    
+    reservas = agenda.reservar_em_lote([pedido for _, pedido in pedidos]) if pedidos else []
+    
+    agendados = []
+    for (resultado, pedido), (linha, info) in zip(pedidos, reservas):
+        if linha is None:
+            resultado["erro"] = (f"Sem vagas para {pedido['exame']}" if info == 'sem_vaga'
+                                 else "Erro ao reservar vaga")
+            continue
+        resultado["sucesso"] = True
+        resultado["agendamento"] = montar_agendamento(linha, info, pedido["nome"], pedido["telefone"], pedido["exame"])
+        agendados.append(resultado)
+    
+    # Todas as notificações numa transação da fila
+    job_ids = fila.enfileirar_lote(
+        "notificar_agendamento", [payload_notificacao(r["agendamento"]) for r in agendados]
+    ) if agendados else []
+    for resultado, job_id in zip(agendados, job_ids):
+        resultado["job_id"] = job_id
+    
+    print(f"📋 Lote: {len(agendados)} de {len(pacientes)} paciente(s) agendados")
+    return jsonify({
+        "sucesso": True,
+        "total": len(pacientes),
+        "agendados": len(agendados),
+        "nao_agendados": len(pacientes) - len(agendados),
+        "resultados": resultados
     })
 
 @app.route('/api/status-excel')
+@respostas.versionada()
 def status_excel():
-    """Status da planilha Google Sheets"""
-    return jsonify(sheets_client.status_planilha())
+    """Status da agenda (Google Sheets ou SQLite)"""
+    return agenda.status_planilha()
+
+@app.route('/api/upload-excel', methods=['POST'])
+def upload_excel():
+    """Importa uma agenda (.xlsx ou .csv) para o armazenamento ativo"""
+    arquivo = request.files.get('file')
+    if not arquivo or not arquivo.filename:
+        return jsonify({"sucesso": False, "erro": "Nenhum arquivo enviado"}), 400
+    
+    if not agenda.conectado:
+        return jsonify({"sucesso": False, "erro": "Agenda não conectada"}), 400
+    
+    try:
+        registros = importador_agenda.ler_arquivo(arquivo.filename, arquivo.stream)
+        relatorio = importador_agenda.importar(agenda, registros)
+    except ValueError as e:
+        return jsonify({"sucesso": False, "erro": str(e)}), 400
+    except Exception as e:
+        print(f"❌ Erro ao importar planilha: {e}")
+        return jsonify({"sucesso": False, "erro": "Erro ao ler a planilha"}), 500
+    
+    print(f"📥 Importação: {relatorio['horarios_adicionados']} novos, "
+          f"{relatorio['horarios_duplicados']} duplicados, "
+          f"{relatorio['linhas_invalidas']} inválidos ({relatorio['linhas_por_segundo']} linhas/s)")
+    
+    aquecer_orientacoes()  # especialidades novas da planilha
+    
+    status = agenda.status_planilha()
+    return jsonify({
+        "sucesso": True,
+        "mensagem": f"Planilha {arquivo.filename} importada",
+        "total_horarios": status.get("total_horarios", 0),
+        "vagas_disponiveis": status.get("vagas_disponiveis", 0),
+        **relatorio
+    })
+
+@app.route('/api/limpar-excel', methods=['POST'])
+def limpar_excel():
+    """Remove os horários livres carregados (agendamentos são mantidos)"""
+    if not agenda.conectado:
+        return jsonify({"sucesso": False, "erro": "Agenda não conectada"}), 400
+    
+    if agenda.linhas_estaveis:
+        return _limpar_horarios()
+    
+    # Na planilha a limpeza renumera as linhas: um disparo de lembretes em curso
+    # (que marca os enviados pela linha) não pode estar pela metade. Respostas do
+    # webhook esperam pela própria agenda (linhas_fixas); envios da fila não usam linha
+    with trava_entre_processos('lembretes', bloquear=False) as livre:
+        if not livre:
+            return jsonify({"sucesso": False, "erro": "Disparo de lembretes em andamento; tente de novo depois"}), 409
+        return _limpar_horarios()
+
+def _limpar_horarios():
+    try:
+        removidos = agenda.limpar_horarios()
+        return jsonify({"sucesso": True, "mensagem": f"{removidos} horários livres removidos"})
+    except Exception as e:
+        print(f"❌ Erro ao limpar horários: {e}")
+        return jsonify({"sucesso": False, "erro": str(e)}), 500
+
+@app.route('/api/eventos')
+def eventos_painel():
+    """Stream SSE com as mudanças da agenda (substitui o polling do painel)"""
+    ultimo_id = request.headers.get('Last-Event-ID', type=int)
+    assinatura = eventos.assinar(ultimo_id)
+    if assinatura is None:
+        # Streams demais prendendo threads: o painel fica no polling e tenta de novo depois
+        resposta = Response("retry: 60000\n\n", status=503, mimetype='text/event-stream')
+        resposta.headers['Retry-After'] = '60'
+        return resposta
+    # Sem stream_with_context: o stream não usa a requisição, e o close() da resposta libera a vaga
+    resposta = Response(assinatura, mimetype='text/event-stream')
+    resposta.headers['Cache-Control'] = 'no-cache'
+    resposta.headers['X-Accel-Buffering'] = 'no'  # proxy não pode segurar o stream
+    return resposta
 
 @app.route('/api/metricas')
+@respostas.versionada()
 def metricas():
-    """Retorna métricas do Google Sheets"""
-    return jsonify(sheets_client.contar_metricas())
+    """Retorna métricas da agenda"""
+    return agenda.contar_metricas()
 
 @app.route('/api/agendamentos')
+@respostas.versionada()
 def agendamentos():
-    """Retorna lista de agendamentos"""
-    return jsonify(sheets_client.listar_agendamentos()[-20:])
+    """Página de agendamentos (mais novos primeiro) com filtros e cursor
+
+    Parâmetros: status (PENDENTE, CONFIRMADO ou CANCELADO), exame, clinica,
+    telefone, data_inicio, data_fim (dd/mm/aaaa ou aaaa-mm-dd), limite (até
+    100) e cursor (o proximo_cursor da página anterior).
+    """
+    filtros = {campo: request.args[campo].strip()
+               for campo in ('status', 'exame', 'clinica', 'telefone') if request.args.get(campo, '').strip()}
+    if 'status' in filtros:
+        # Texto desconhecido seria OUTRO na planilha e comparação literal no SQLite: recusa nos dois
+        status = Status.de_texto(filtros['status'])
+        if status is Status.OUTRO:
+            return jsonify({"erro": f"Status inválido: {filtros['status']}"}), 400
+        filtros['status'] = status.texto
+    for campo in ('data_inicio', 'data_fim'):
+        if request.args.get(campo):
+            data = parse_data(request.args[campo])
+            if data is None:
+                return jsonify({"erro": f"Data inválida em {campo}"}), 400
+            filtros[campo] = data
+    limite = max(1, min(request.args.get('limite', 20, type=int), 100))
+    cursor = request.args.get('cursor', type=int)
+    
+    itens, proximo_cursor = agenda.buscar_agendamentos(filtros, limite, cursor)
+    return {"itens": itens, "proximo_cursor": proximo_cursor}
+
+@app.route('/api/jobs')
+def listar_jobs():
+    """Jobs de envio mais recentes + resumo por status"""
+    limite = request.args.get('limite', 20, type=int)
+    return jsonify({"resumo": fila.resumo(), "jobs": fila.listar(min(limite, 200))})
+
+@app.route('/api/jobs/<job_id>')
+def consultar_job(job_id):
+    """Status de entrega de um job"""
+    job = fila.consultar(job_id)
+    if job is None:
+        return jsonify({"erro": "Job não encontrado"}), 404
+    return jsonify(job)
+
+@app.route('/api/estatisticas')
+def estatisticas():
+    """Contadores internos (armazenamento, fila de jobs, WhatsApp, TTS, áudios, orientações, lembretes, eventos, respostas, webhook, processo)"""
+    return jsonify({
+        "armazenamento": {"backend": agenda.nome, **agenda.estatisticas(), "reservas": agenda.estatisticas_reserva()},
+        "fila_jobs": fila.resumo(),
+        "whatsapp": whatsapp_client.estatisticas(),
+        "tts": TTS.estatisticas(),
+        "audios": retencao.estatisticas(),
+        "orientacoes": orientacoes.estatisticas(),
+        "lembretes": disparador.estatisticas(),
+        "eventos": eventos.estatisticas(),
+        "respostas": respostas.estatisticas(),
+        "webhook": {"deduplicacao": deduplicador.estatisticas(), "fila": fila_webhook.estatisticas()},
+        "processo": lideranca.estatisticas()
+    })
 
 # ==================== WHATSAPP ====================
 
@@ -248,16 +593,10 @@ def enviar_lembretes_manual():
         return jsonify({"sucesso": False, "erro": str(e)}), 500
 
 @app.route('/api/lembretes/pendentes')
+@respostas.versionada(extra=lambda: datetime.now().strftime('%Y%m%d'))  # o plano muda com o dia
 def lembretes_pendentes():
-    """Lista lembretes pendentes para os próximos dias"""
-    pendentes = []
-    for config in LEMBRETES_CONFIG:
-        dias = config["dias"]
-        agendamentos = sheets_client.buscar_agendamentos_para_lembrete(dias)
-        for ag in agendamentos:
-            ag["tipo_lembrete"] = f"{dias} dia(s)"
-        pendentes.extend(agendamentos)
-    return jsonify(pendentes)
+    """Plano de lembretes pendentes (itens, contagem por intervalo e tempo de planejamento)"""
+    return planejar_lembretes()
 
 @app.route('/api/whatsapp/qrcode')
 def whatsapp_qrcode():
@@ -269,9 +608,39 @@ def whatsapp_config():
 
 # ==================== WEBHOOK EVOLUTION API ====================
 
+def processar_mensagem(numero, texto):
+    """Processa uma mensagem recebida (roda nos workers da fila do webhook)"""
+    if texto in ['1', '2']:
+        print(f"✅ Processando resposta {texto} de {numero}")
+        # A fila ordena o telefone neste processo; a trava, entre os workers do gunicorn
+        with trava_por_chave('telefone', sufixo_telefone(numero)):
+            processar_resposta(numero, texto)
+        return
+    
+    # Resposta inválida
+    print(f"⚠️ Resposta inválida de {numero}: '{texto}'")
+    msg = """⚠️ Desculpe, não conseguimos processar sua mensagem.
+
+Por favor, responda apenas com:
+1️⃣ - Para CONFIRMAR
+2️⃣ - Para CANCELAR
+
+Para outras dúvidas, entre em contato:
+📞 (53) 3000-0000
+
+Sistema SUS - Hackapel 2025"""
+    whatsapp_client.enviar_mensagem_completa(numero, msg, com_audio=True)
+
+# Mensagens do mesmo telefone em ordem, num pool fixo de workers
+fila_webhook = FilaPorTelefone(processar_mensagem)
+
 @app.route('/webhook/evolution', methods=['POST'])
 def webhook_evolution():
-    """Recebe mensagens da Evolution API via Webhook"""
+    """Recebe mensagens da Evolution API via Webhook
+
+    Só registra e enfileira: responde na hora, sem esperar agenda nem
+    WhatsApp/TTS. Com a fila cheia devolve 503 para a Evolution reenviar.
+    """
     try:
         data = request.json
         print(f"📩 Webhook recebido: {data}")
@@ -289,12 +658,11 @@ def webhook_evolution():
                 if key.get('fromMe'):
                     continue
                 
+                # Reentregas da Evolution API (mesmo id) são ignoradas
                 msg_id = key.get('id', '')
-                if msg_id in mensagens_processadas:
+                if not deduplicador.registrar(msg_id):
                     continue
                 
-                mensagens_processadas.add(msg_id)
-                
                 numero = key.get('remoteJid', '').replace('@s.whatsapp.net', '')
                 
                 message_content = msg.get('message', {})
@@ -306,23 +674,11 @@ def webhook_evolution():
                 
                 print(f"📱 Mensagem de {numero}: '{texto}'")
                 
-                if texto in ['1', '2']:
-                    print(f"✅ Processando resposta {texto} de {numero}")
-                    Thread(target=processar_resposta, args=(numero, texto)).start()
-                else:
-                    # Resposta inválida
-                    print(f"⚠️ Resposta inválida de {numero}: '{texto}'")
-                    msg = """⚠️ Desculpe, não conseguimos processar sua mensagem.
-
-Por favor, responda apenas com:
-1️⃣ - Para CONFIRMAR
-2️⃣ - Para CANCELAR
-
-Para outras dúvidas, entre em contato:
-📞 (53) 3000-0000
-
-Sistema SUS - Hackapel 2025"""
-                    whatsapp_client.enviar_mensagem_completa(numero, msg, com_audio=True)
+                if not fila_webhook.enfileirar(numero, numero, texto):
+                    # Não aceita: a reentrega tem de ser processada, não tratada como repetida
+                    deduplicador.esquecer(msg_id)
+                    print(f"⏳ Fila do webhook cheia, pedindo reenvio da mensagem de {numero}")
+                    return jsonify({"erro": "Fila cheia, tente novamente"}), 503
         
         return jsonify({"status": "ok"}), 200
         
@@ -350,16 +706,21 @@ def processar_resposta(telefone, resposta):
     print(f"🔄 Processando resposta: telefone={telefone}, resposta={resposta}")
     
     try:
-        if not sheets_client.conectado:
-            print("❌ Google Sheets não conectado")
+        if not agenda.conectado:
+            print("❌ Agenda não conectada")
             return
         
-        # Buscar paciente por telefone
-        linha, dados = sheets_client.buscar_por_telefone(telefone)
-        
-        if linha is None:
-            print(f"❌ Telefone {telefone} não encontrado")
-            return
+        # Buscar paciente por telefone e gravar sem a limpeza renumerar a linha no meio
+        with agenda.linhas_fixas():
+            linha, dados = agenda.buscar_por_telefone(telefone)
+            if linha is None:
+                print(f"❌ Telefone {telefone} não encontrado")
+                return
+            if resposta == '1':
+                agenda.atualizar_status(linha, 'CONFIRMADO')
+            elif resposta == '2':
+                # Cancelar e liberar vaga
+                agenda.liberar_vaga(linha)
         
         paciente = dados.get('paciente', '')
         telefone_original = dados.get('telefone', telefone)
@@ -367,20 +728,15 @@ def processar_resposta(telefone, resposta):
         
         if resposta == '1':
             # Confirmar
-            sheets_client.atualizar_status(linha, 'CONFIRMADO')
-            
-            msg = MensagensSUS.consulta_confirmada(paciente)
+            msg, segmentos = MensagensSUS.montar('consulta_confirmada', nome=paciente)
             print(f"📤 Enviando confirmação para {telefone_original}")
-            whatsapp_client.enviar_mensagem_completa(telefone_original, msg, com_audio=True)
+            whatsapp_client.enviar_mensagem_completa(telefone_original, msg, com_audio=True, segmentos=segmentos)
             print(f"✅ CONFIRMADO: {paciente}")
             
         elif resposta == '2':
-            # Cancelar e liberar vaga
-            sheets_client.liberar_vaga(linha)
-            
-            msg = MensagensSUS.consulta_cancelada(paciente)
+            msg, segmentos = MensagensSUS.montar('consulta_cancelada', nome=paciente)
             print(f"📤 Enviando cancelamento para {telefone_original}")
-            whatsapp_client.enviar_mensagem_completa(telefone_original, msg, com_audio=True)
+            whatsapp_client.enviar_mensagem_completa(telefone_original, msg, com_audio=True, segmentos=segmentos)
             print(f"❌ CANCELADO: {paciente}")
             
     except Exception as e:
@@ -390,6 +746,45 @@ def processar_resposta(telefone, resposta):
 
 # ==================== INICIALIZAÇÃO ====================
 
+# Um processo só roda o que não pode ser duplicado (com gunicorn há vários)
+lideranca = Lideranca()
+
+def iniciar_tarefas_do_lider():
+    """Tarefas de um único processo: lembretes, espelho da planilha, limpeza de áudios"""
+    if agenda.conectado:
+        if espelho:
+            espelho.iniciar()
+        
+        # Orientações da IA prontas antes do primeiro agendamento
+        aquecer_orientacoes()
+        
+        # Iniciar sistema de lembretes
+        iniciar_scheduler_lembretes()
+        print("🔔 Sistema de lembretes: ATIVO (verifica a cada 1h)")
+    else:
+        print("⚠️ Sistema de lembretes: DESATIVADO")
+    
+    # Limpeza periódica de static/audios
+    retencao.iniciar()
+
+def iniciar_servicos():
+    """Threads de fundo deste processo + disputa da liderança
+    
+    Chamado uma vez por processo: por `python app.py` e, no gunicorn, por
+    cada worker (post_worker_init em gunicorn.conf.py).
+    """
+    # Envios em segundo plano (retoma jobs pendentes de antes do restart);
+    # a fila fica no SQLite, então todos os workers a consomem juntos
+    fila.iniciar()
+    
+    # Respostas dos pacientes recebidas pelo webhook
+    fila_webhook.iniciar()
+    
+    # Painéis deste processo também veem escritas feitas nos outros
+    iniciar_observador_versao()
+    
+    lideranca.iniciar(iniciar_tarefas_do_lider)
+
 if __name__ == '__main__':
     print("\n" + "="*60)
     print("🏥 SISTEMA SUS - Hackapel 2025 v5.0")
@@ -399,25 +794,22 @@ if __name__ == '__main__':
     # Detectar Railway
     railway = os.environ.get('RAILWAY_PUBLIC_DOMAIN', '')
     if railway:
-        os.environ['PUBLIC_URL'] = railway
         print(f"🌐 URL: https://{railway}")
     
-    # Status Google Sheets
-    if sheets_client.conectado:
-        status = sheets_client.status_planilha()
-        print(f"✅ Google Sheets: {status.get('total_horarios', 0)} horários")
-        
-        # Iniciar sistema de lembretes
-        iniciar_scheduler_lembretes()
-        print("🔔 Sistema de lembretes: ATIVO (verifica a cada 1h)")
+    # Status da agenda
+    if agenda.conectado:
+        status = agenda.status_planilha()
+        print(f"✅ Agenda ({agenda.nome}): {status.get('total_horarios', 0)} horários")
     else:
-        print("⚠️ Google Sheets: Não conectado")
-        print("⚠️ Sistema de lembretes: DESATIVADO")
+        print(f"⚠️ Agenda ({agenda.nome}): Não conectada")
     
     print("🔊 TTS ativo em todas mensagens")
     
+    iniciar_servicos()
+    
     port = int(os.environ.get('PORT', 5000))
     print(f"📱 http://localhost:{port}")
+    print("   (produção: gunicorn -c gunicorn.conf.py app:app)")
     print("="*60 + "\n")
     
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,95 @@
+"""
+🗄️ Seleção do backend da agenda
+Sistema SUS - Hackapel 2025
+
+AGENDA_BACKEND=sheets (padrão) usa o Google Sheets direto.
+AGENDA_BACKEND=sqlite usa um arquivo SQLite local; com AGENDA_ESPELHO_SHEETS=1
+a planilha vira um espelho (somente leitura) atualizado periodicamente.
+"""
+
+import os
+import time
+from threading import Thread
+
+from backend_agenda import COLUNAS_AGENDA
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+AGENDA_BACKEND = os.environ.get('AGENDA_BACKEND', 'sheets').strip().lower()
+AGENDA_SQLITE_PATH = os.environ.get('AGENDA_SQLITE_PATH', os.path.join(BASE_DIR, 'agenda.db'))
+AGENDA_ESPELHO_SHEETS = os.environ.get('AGENDA_ESPELHO_SHEETS', '') in ('1', 'true', 'sim')
+AGENDA_ESPELHO_INTERVALO = int(os.environ.get('AGENDA_ESPELHO_INTERVALO', '60'))
+
+
+class EspelhoSheets:
+    """Copia a agenda do SQLite para a planilha, para os operadores acompanharem"""
+
+    def __init__(self, backend, sheets, intervalo=AGENDA_ESPELHO_INTERVALO):
+        self.backend = backend
+        self.sheets = sheets
+        self.intervalo = intervalo
+        self._ultimo = None
+        self.exportacoes = 0
+
+    def importar_se_vazio(self):
+        """Na primeira execução, carrega no SQLite o que já está na planilha"""
+        if self.backend.total_horarios() > 0:
+            return
+        registros = self.sheets.carregar_dados() or []
+        if registros:
+            inseridos, _ = self.backend.importar_registros(registros)
+            print(f"📥 {inseridos} horários importados da planilha para o SQLite")
+
+    def exportar(self):
+        """Sobrescreve a planilha com a agenda atual (uma única chamada de escrita)"""
+        dados = self.backend.carregar_dados() or []
+        assinatura = hash(tuple(tuple(r.values()) for r in dados))
+        if assinatura == self._ultimo:
+            return False
+
+        valores = [COLUNAS_AGENDA] + [[r[c] for c in COLUNAS_AGENDA] for r in dados]
+        ws = self.sheets.worksheet
+        ws.update(values=valores, range_name='A1', value_input_option='RAW')
+        if ws.row_count > len(valores):
+            ws.resize(rows=len(valores))
+        self._ultimo = assinatura
+        self.exportacoes += 1
+        return True
+
+    def iniciar(self):
+        def loop_espelho():
+            print(f"🪞 Espelho Google Sheets ativo (a cada {self.intervalo}s)")
+            while True:
+                try:
+                    if self.exportar():
+                        print("🪞 Planilha espelho atualizada")
+                except Exception as e:
+                    print(f"❌ Erro ao atualizar espelho: {e}")
+                time.sleep(self.intervalo)
+
+        thread = Thread(target=loop_espelho, daemon=True)
+        thread.start()
+        return thread
+
+
+def criar_backend():
+    """Instancia o backend escolhido em AGENDA_BACKEND; retorna (backend, espelho)"""
+    if AGENDA_BACKEND == 'sqlite':
+        from sqlite_agenda import SQLiteAgenda
+        backend = SQLiteAgenda(AGENDA_SQLITE_PATH)
+        espelho = None
+        if AGENDA_ESPELHO_SHEETS:
+            from google_sheets import sheets_client
+            if sheets_client.conectado:
+                espelho = EspelhoSheets(backend, sheets_client)
+                espelho.importar_se_vazio()
+        return backend, espelho
+
+    if AGENDA_BACKEND != 'sheets':
+        print(f"⚠️ AGENDA_BACKEND desconhecido: {AGENDA_BACKEND} (usando sheets)")
+    from google_sheets import sheets_client
+    return sheets_client, None
+
+
+# Instância global
+agenda, espelho = criar_backend()
@@ -0,0 +1,204 @@
+"""
+🗄️ Interface de armazenamento da agenda
+Sistema SUS - Hackapel 2025
+"""
+
+import threading
+import zlib
+from contextlib import ExitStack, contextmanager
+
+# Colunas da agenda (mesmo layout da planilha gerada por criar_planilha_exemplo.py)
+COLUNAS_AGENDA = [
+    'clinica', 'exame', 'data', 'horario', 'disponivel',
+    'paciente', 'telefone', 'status_confirmacao', 'lembretes_enviados'
+]
+
+RESERVA_LISTRAS = 32  # travas de reserva; cada exame cai sempre na mesma
+RESERVA_TENTATIVAS = 5  # vagas tentadas quando a escolhida já foi pega por outro processo
+
+
+class BackendAgenda:
+    """Contrato comum dos backends da agenda (Google Sheets, SQLite)
+
+    Cada horário é identificado por `linha` (na planilha, o número da linha;
+    no SQLite, o id do registro). Os registros devolvidos são dicts com as
+    colunas de COLUNAS_AGENDA, com 'data' no formato dd/mm/aaaa.
+    """
+
+    nome = 'base'
+    conectado = False
+    ao_mudar = None  # callback(tipo, dados) depois de cada escrita; deve só agendar, sem bloquear
+    _versao = 0
+    _trava_versao = threading.Lock()
+    origem_versao = None  # None: a versão só vale neste processo (recomeça a cada boot)
+    linhas_estaveis = True  # False: limpar_horarios renumera as linhas (quem guardou uma linha erra)
+    _travas_reserva = [threading.Lock() for _ in range(RESERVA_LISTRAS)]
+    _reservas = _conflitos = 0
+
+    def versao_dados(self):
+        """Número que aumenta a cada escrita (ETag das rotas de leitura)"""
+        return self._versao
+
+    def _registrar_mudanca(self, tipo, **dados):
+        """Nova versão dos dados; avisa quem acompanha a agenda (painéis)"""
+        with self._trava_versao:
+            self._versao += 1
+        if self.ao_mudar is not None:
+            try:
+                self.ao_mudar(tipo, dados)
+            except Exception as e:
+                print(f"⚠️ Erro ao notificar mudança na agenda ({tipo}): {e}")
+
+    def carregar_dados(self):
+        """Todos os horários como lista de dicts (None se desconectado)"""
+        raise NotImplementedError
+
+    def buscar_vaga(self, exame, clinica=None):
+        """(linha, registro) da vaga livre mais cedo, ou (None, None)"""
+        raise NotImplementedError
+
+    def reservar_vaga(self, linha, nome, telefone):
+        """Reserva o horário para o paciente (status PENDENTE)"""
+        raise NotImplementedError
+
+    def _reservar_se_livre(self, linha, nome, telefone):
+        """Reserva só se o horário ainda estiver livre no armazenamento
+
+        True reservou; False a vaga já tinha sido pega (a busca viu dados
+        antigos); None erro.
+        """
+        raise NotImplementedError
+
+    @contextmanager
+    def linhas_fixas(self):
+        """Enquanto aberto, as linhas devolvidas pela agenda não mudam de número
+
+        Quem busca uma linha e depois grava nela (resposta do paciente) fica
+        dentro; no SQLite os ids não mudam e não há o que esperar.
+        """
+        yield
+
+    @contextmanager
+    def _trava_reserva(self, exames):
+        """Reservas do mesmo exame em fila; exames em listras diferentes reservam em paralelo
+
+        Um lote pega as listras de todos os seus exames, em ordem crescente
+        (dois lotes com exames em comum não se travam um esperando o outro).
+        """
+        with ExitStack() as pilha:
+            for listra in sorted({zlib.crc32(exame.encode('utf-8')) % RESERVA_LISTRAS for exame in exames}):
+                pilha.enter_context(self._travas_reserva[listra])
+            yield
+
+    def reservar_proxima_vaga(self, exame, nome, telefone, clinica=None):
+        """Busca e reserva a vaga mais cedo numa operação só
+
+        A trava é por exame (com ou sem clínica, os pedidos disputam as
+        mesmas linhas). A escrita ainda confere que a vaga está livre, o
+        que cobre outro processo reservando ao mesmo tempo; se perdeu a
+        disputa, tenta a próxima vaga. Retorna (linha, registro) ou
+        (None, motivo) com motivo 'sem_vaga', 'disputa' ou 'erro'.
+        """
+        with self._trava_reserva([exame]):
+            for _ in range(RESERVA_TENTATIVAS):
+                linha, info = self.buscar_vaga(exame, clinica)
+                if linha is None:
+                    return None, 'sem_vaga'
+                reservou = self._reservar_se_livre(linha, nome, telefone)
+                if reservou is None:
+                    return None, 'erro'
+                if reservou:
+                    self._reservas += 1
+                    print(f"✅ Vaga reservada: linha {linha} para {nome}")
+                    self._registrar_mudanca('reserva', linha=linha)
+                    return linha, info
+                self._conflitos += 1
+                print(f"⚠️ Vaga da linha {linha} já estava ocupada, buscando a próxima")
+        return None, 'disputa'
+
+    def reservar_em_lote(self, pedidos):
+        """Reserva vagas para vários pacientes (campanhas)
+
+        `pedidos` é uma lista de dicts com nome, telefone, exame e clinica
+        (opcional). Cada paciente recebe a vaga livre mais cedo que os
+        anteriores do lote ainda não pegaram. Retorna, na ordem dos pedidos,
+        (linha, registro) ou (None, motivo) como reservar_proxima_vaga.
+        Os backends fazem tudo numa passada e numa escrita; este padrão
+        reserva um por um.
+        """
+        return [self.reservar_proxima_vaga(p['exame'], p['nome'], p['telefone'], p.get('clinica'))
+                for p in pedidos]
+
+    def estatisticas_reserva(self):
+        """Reservas feitas por reservar_proxima_vaga e vagas perdidas na conferência"""
+        return {"reservas": self._reservas, "conflitos": self._conflitos, "listras": RESERVA_LISTRAS}
+
+    def buscar_por_telefone(self, telefone):
+        """(linha, registro) da reserva PENDENTE mais recente do telefone"""
+        raise NotImplementedError
+
+    def atualizar_status(self, linha, status):
+        """Atualiza status de confirmação"""
+        raise NotImplementedError
+
+    def liberar_vaga(self, linha):
+        """Libera o horário (cancelamento)"""
+        raise NotImplementedError
+
+    def contar_metricas(self):
+        """{"agendados", "confirmados", "cancelados", "lembretes"}"""
+        raise NotImplementedError
+
+    def listar_agendamentos(self):
+        """Horários com paciente, na ordem da agenda"""
+        raise NotImplementedError
+
+    def buscar_agendamentos(self, filtros=None, limite=20, cursor=None):
+        """Uma página de agendamentos, do id maior para o menor
+
+        `filtros` aceita status, exame, clinica, telefone e data_inicio /
+        data_fim (date). `cursor` é o id do último item da página anterior.
+        Retorna (itens, proximo_cursor); proximo_cursor é None na última página.
+        """
+        raise NotImplementedError
+
+    def status_planilha(self):
+        """{"carregado", "total_horarios", "vagas_disponiveis", "vagas_ocupadas"}"""
+        raise NotImplementedError
+
+    def listar_exames(self):
+        """Especialidades distintas da agenda, em ordem alfabética"""
+        raise NotImplementedError
+
+    def planejar_lembretes(self, dias_lista):
+        """Lembretes devidos para vários intervalos numa só leitura da agenda
+
+        Retorna {dias: [agendamentos daqui a `dias` dias que ainda não
+        receberam esse lembrete]} com uma chave para cada intervalo pedido.
+        """
+        raise NotImplementedError
+
+    def buscar_agendamentos_para_lembrete(self, dias_antecedencia):
+        """Agendamentos daqui a X dias que ainda não receberam esse lembrete"""
+        return self.planejar_lembretes([dias_antecedencia])[dias_antecedencia]
+
+    def marcar_lembrete_enviado(self, linha, dias_antecedencia):
+        """Registra que o lembrete de X dias foi enviado"""
+        raise NotImplementedError
+
+    def marcar_lembretes_enviados(self, enviados):
+        """Registra vários lembretes [(linha, dias), ...] de uma vez"""
+        return all([self.marcar_lembrete_enviado(linha, dias) for linha, dias in enviados])
+
+    def importar_registros(self, registros):
+        """Grava um lote de horários; repetidos (clínica, exame, data, horário)
+        são ignorados. Retorna (inseridos, duplicados)"""
+        raise NotImplementedError
+
+    def limpar_horarios(self):
+        """Remove os horários livres (agendamentos são mantidos); retorna quantos"""
+        raise NotImplementedError
+
+    def estatisticas(self):
+        """Contadores internos do backend"""
+        return {}
@@ -0,0 +1,131 @@
+"""
+📏 Benchmark: lista de dicts (get_all_records) x modelo tipado (Horario)
+Sistema SUS - Hackapel 2025
+
+Mede memória do snapshot e tempo da varredura de lembretes nas duas
+representações, com uma agenda sintética.
+
+Uso: python benchmarks/bench_modelo_agenda.py [linhas]
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gspread.utils import numericise_all, to_records  # noqa: E402
+
+from backend_agenda import COLUNAS_AGENDA  # noqa: E402
+from modelo_agenda import Horario, Status  # noqa: E402
+
+DIAS_LEMBRETE = [7, 5, 3, 1]
+
+
+def gerar_valores(n):
+    """Linhas cruas como get_all_values() devolve (cabeçalho + strings)"""
+    rnd = random.Random(42)
+    clinicas = [f"UBS {nome}" for nome in ("Centro", "Norte", "Sul", "Leste", "Oeste", "Fragata", "Areal")]
+    exames = ["Cardiologista", "Ortopedista", "Pediatra", "Dermatologista", "Ginecologista", "Oftalmologista"]
+    hoje = date.today()
+    linhas = [list(COLUNAS_AGENDA)]
+    for i in range(n):
+        data = (hoje + timedelta(days=rnd.randrange(0, 60))).strftime('%d/%m/%Y')
+        horario = f"{rnd.randrange(7, 18):02d}:{rnd.choice((0, 30)):02d}"
+        if rnd.random() < 0.4:
+            linhas.append([rnd.choice(clinicas), rnd.choice(exames), data, horario, 'NAO',
+                           f"Paciente {i}", f"55539{rnd.randrange(10**7, 10**8)}",
+                           rnd.choice(('PENDENTE', 'CONFIRMADO', 'CANCELADO')), rnd.choice(('', '7d', '7d,5d'))])
+        else:
+            linhas.append([rnd.choice(clinicas), rnd.choice(exames), data, horario, 'SIM', '', '', '', ''])
+    return linhas
+
+
+def medir(construir):
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    dados = construir()
+    segundos = time.perf_counter() - inicio
+    _, pico = tracemalloc.get_traced_memory()
+    atual = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return dados, atual, pico, segundos
+
+
+def lembretes_dicts(dados, dias_antecedencia):
+    """Varredura antiga: strptime em até três formatos por linha, por intervalo"""
+    data_alvo = datetime.now().date() + timedelta(days=dias_antecedencia)
+    encontrados = 0
+    for row in dados:
+        paciente = row.get('paciente', '')
+        status = str(row.get('status_confirmacao', '')).upper()
+        if not paciente or status not in ['CONFIRMADO', 'PENDENTE']:
+            continue
+        data_str = str(row.get('data', ''))
+        for fmt in ['%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y']:
+            try:
+                data_agendamento = datetime.strptime(data_str, fmt).date()
+                break
+            except ValueError:
+                continue
+        else:
+            continue
+        if data_agendamento == data_alvo and f"{dias_antecedencia}d" not in str(row.get('lembretes_enviados', '')):
+            encontrados += 1
+    return encontrados
+
+
+def lembretes_modelo(dados):
+    """Varredura nova: uma passada, datas já convertidas"""
+    hoje = date.today()
+    por_data = {hoje + timedelta(days=d): d for d in DIAS_LEMBRETE}
+    encontrados = 0
+    for h in dados:
+        dias = por_data.get(h.data)
+        if dias is None or not h.paciente or h.status not in (Status.CONFIRMADO, Status.PENDENTE):
+            continue
+        if f"{dias}d" not in h.lembretes:
+            encontrados += 1
+    return encontrados
+
+
+def cronometrar(funcao, repeticoes=3):
+    melhor = float('inf')
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return resultado, melhor
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    valores = gerar_valores(n)
+    cabecalho = valores[0]
+
+    dicts, mem_dicts, pico_dicts, carga_dicts = medir(
+        # o que get_all_records() faz com os mesmos valores
+        lambda: to_records(cabecalho, [numericise_all(linha) for linha in valores[1:]])
+    )
+    modelo, mem_modelo, pico_modelo, carga_modelo = medir(
+        lambda: [Horario.de_valores(cabecalho, linha) for linha in valores[1:]]
+    )
+
+    total_dicts, t_dicts = cronometrar(lambda: sum(lembretes_dicts(dicts, d) for d in DIAS_LEMBRETE))
+    total_modelo, t_modelo = cronometrar(lambda: lembretes_modelo(modelo))
+    assert total_dicts == total_modelo, (total_dicts, total_modelo)
+
+    mb = 1024 * 1024
+    print(f"📏 {n} linhas, {total_modelo} lembretes devidos")
+    print(f"{'':24}{'dicts':>12}{'Horario':>12}")
+    print(f"{'memória retida (MB)':24}{mem_dicts / mb:12.1f}{mem_modelo / mb:12.1f}")
+    print(f"{'pico na carga (MB)':24}{pico_dicts / mb:12.1f}{pico_modelo / mb:12.1f}")
+    print(f"{'carga (ms)':24}{carga_dicts * 1000:12.0f}{carga_modelo * 1000:12.0f}")
+    print(f"{'varredura lembretes (ms)':24}{t_dicts * 1000:12.1f}{t_modelo * 1000:12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+🎟️ Benchmark: reservas concorrentes (vários guichês ao mesmo tempo)
+Sistema SUS - Hackapel 2025
+
+Cada guichê é uma thread reservando vagas de exames sorteados. Compara
+três jeitos de reservar:
+
+- separado: buscar_vaga() e depois reservar_vaga(), como o /api/agendar
+  fazia (duas etapas sem trava: dois guichês podem pegar a mesma linha)
+- global:   as duas etapas sob uma trava única (correto, mas em fila)
+- listras:  reservar_proxima_vaga() (trava por exame + conferência na escrita)
+
+Roda no SQLite (arquivo temporário) e numa planilha simulada em memória
+com latência de API, onde a trava global pesa mais.
+
+Uso: python benchmarks/bench_reserva_concorrente.py [reservas_por_guiche] [latencia_ms]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+PASTA = tempfile.mkdtemp(prefix='bench_reserva_')
+os.environ.setdefault('TRAVAS_DIR', os.path.join(PASTA, 'travas'))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend_agenda import COLUNAS_AGENDA  # noqa: E402
+from google_sheets import GoogleSheetsClient  # noqa: E402
+from sqlite_agenda import SQLiteAgenda  # noqa: E402
+
+EXAMES = ["Cardiologista", "Ortopedista", "Pediatra", "Dermatologista", "Ginecologista", "Oftalmologista"]
+CLINICAS = ["UBS Centro", "UBS Norte", "UBS Sul", "UBS Fragata"]
+GUICHES = [1, 2, 4, 8, 16]
+REPETICOES = 3  # vale a melhor taxa (checkpoint do WAL e o disco oscilam entre rodadas)
+
+
+def gerar_registros(n):
+    """Horários livres suficientes para todas as reservas (nenhum exame esgota)"""
+    hoje = date.today()
+    registros = []
+    for i in range(n):
+        dia, resto = divmod(i, len(EXAMES) * len(CLINICAS) * 20)
+        exame = EXAMES[resto % len(EXAMES)]
+        clinica = CLINICAS[(resto // len(EXAMES)) % len(CLINICAS)]
+        minutos = 7 * 60 + (resto // (len(EXAMES) * len(CLINICAS))) * 30
+        registros.append({
+            'clinica': clinica, 'exame': exame,
+            'data': (hoje + timedelta(days=1 + dia)).strftime('%d/%m/%Y'),
+            'horario': f"{minutos // 60:02d}:{minutos % 60:02d}", 'disponivel': 'SIM',
+            'paciente': '', 'telefone': '', 'status_confirmacao': '', 'lembretes_enviados': ''
+        })
+    return registros
+
+
+class PlanilhaSimulada:
+    """O pedaço da API do gspread que a agenda usa, em memória e com latência"""
+
+    def __init__(self, registros, latencia):
+        self.latencia = latencia
+        self.valores = [list(COLUNAS_AGENDA)] + [[r[c] for c in COLUNAS_AGENDA] for r in registros]
+        self._trava = threading.Lock()
+
+    def _esperar(self):
+        time.sleep(self.latencia)
+
+    def get_all_values(self):
+        self._esperar()
+        with self._trava:
+            return [list(linha) for linha in self.valores]
+
+    def row_values(self, linha):
+        self._esperar()
+        with self._trava:
+            return list(self.valores[linha - 1])
+
+    def batch_update(self, dados, **kwargs):
+        from gspread.utils import a1_to_rowcol
+        self._esperar()
+        with self._trava:
+            for item in dados:
+                linha, coluna = a1_to_rowcol(item['range'].split(':')[0])
+                for i, valor in enumerate(item['values'][0]):
+                    self.valores[linha - 1][coluna - 1 + i] = valor
+
+
+class SheetsSimulado(GoogleSheetsClient):
+    def __init__(self, planilha):
+        self._planilha = planilha
+        super().__init__()
+
+    def _conectar(self):
+        self.worksheet = self._planilha
+        self._carregar_colunas()
+        self.conectado = True
+
+
+def reservar_separado(agenda, exame, nome, telefone):
+    linha, _ = agenda.buscar_vaga(exame)
+    if linha is not None and agenda.reservar_vaga(linha, nome, telefone):
+        return linha
+    return None
+
+
+def reservar_global(trava):
+    def reservar(agenda, exame, nome, telefone):
+        with trava:
+            return reservar_separado(agenda, exame, nome, telefone)
+    return reservar
+
+
+def reservar_listras(agenda, exame, nome, telefone):
+    linha, _ = agenda.reservar_proxima_vaga(exame, nome, telefone)
+    return linha
+
+
+def pacientes_gravados(agenda):
+    """{linha: paciente} lido do armazenamento"""
+    if isinstance(agenda, SQLiteAgenda):
+        with agenda._conexao() as con:
+            return {r['id']: r['paciente'] for r in con.execute("SELECT id, paciente FROM horarios WHERE paciente != ''")}
+    valores = agenda.worksheet.get_all_values()
+    coluna = valores[0].index('paciente')
+    return {linha: v[coluna] for linha, v in enumerate(valores[1:], start=2) if v[coluna]}
+
+
+def rodar(agenda, reservar, guiches, por_guiche):
+    """Reservas/s, linhas entregues a mais de um guichê e reservas sobrescritas"""
+    entregues = []  # (linha, nome) que cada guichê acredita ter reservado
+    trava = threading.Lock()
+    largada = threading.Barrier(guiches + 1)
+
+    def guiche(g):
+        rnd = random.Random(g)
+        meus = []
+        largada.wait()
+        for i in range(por_guiche):
+            nome = f"Guiche {g} Paciente {i}"
+            linha = reservar(agenda, rnd.choice(EXAMES), nome, f"5553{g:03d}{i:05d}")
+            if linha is not None:
+                meus.append((linha, nome))
+        with trava:
+            entregues.extend(meus)
+
+    threads = [threading.Thread(target=guiche, args=(g,)) for g in range(guiches)]
+    for t in threads:
+        t.start()
+    largada.wait()
+    inicio = time.perf_counter()
+    for t in threads:
+        t.join()
+    segundos = time.perf_counter() - inicio
+
+    repetidas = sum(n - 1 for n in Counter(linha for linha, _ in entregues).values() if n > 1)
+    # Cada linha guarda um paciente só (o último a escrever): os outros perderam a vaga
+    pacientes = pacientes_gravados(agenda)
+    perdidas = sum(1 for linha, nome in entregues if pacientes.get(linha) != nome)
+    return len(entregues) / segundos, repetidas, perdidas
+
+
+def novo_sqlite(registros, _latencia):
+    caminho = os.path.join(PASTA, f"agenda_{time.monotonic_ns()}.db")
+    agenda = SQLiteAgenda(caminho)
+    agenda.importar_registros(registros)
+    return agenda
+
+
+def novo_sheets(registros, latencia):
+    agenda = SheetsSimulado(PlanilhaSimulada(registros, latencia))
+    agenda.carregar_dados()
+    return agenda
+
+
+def main():
+    por_guiche = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    latencia = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+    cenarios = [
+        ("SQLite", novo_sqlite, por_guiche),
+        (f"Planilha simulada ({latencia * 1000:.0f} ms por chamada)", novo_sheets, max(por_guiche // 8, 1)),
+    ]
+
+    for titulo, criar, n in cenarios:
+        print(f"\n🎟️ {titulo}: {n} reservas por guichê")
+        print(f"{'guichês':>8}{'modo':>10}{'reservas/s':>12}{'repetidas':>11}{'perdidas':>10}")
+        for guiches in GUICHES:
+            registros = gerar_registros(guiches * n * len(EXAMES))
+            for modo, reservar in (("separado", reservar_separado),
+                                   ("global", reservar_global(threading.Lock())),
+                                   ("listras", reservar_listras)):
+                rodadas = []
+                for _ in range(REPETICOES):
+                    agenda = criar(registros, latencia)
+                    agenda.ao_mudar = None
+                    rodadas.append(rodar(agenda, reservar, guiches, n))
+                taxa = max(r[0] for r in rodadas)
+                repetidas = max(r[1] for r in rodadas)
+                perdidas = max(r[2] for r in rodadas)
+                print(f"{guiches:>8}{modo:>10}{taxa:>12.0f}{repetidas:>11}{perdidas:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+💡 Cache das orientações da IA por especialidade
+Sistema SUS - Hackapel 2025
+
+As orientações do Gemini dependem só do exame, então ficam guardadas por
+especialidade num JSON (sobrevivem a um restart) e valem por um TTL. Uma
+entrada vencida continua sendo usada enquanto é renovada em segundo
+plano. A espera por uma geração tem limite: se o modelo demorar, o
+agendamento segue sem orientações e a resposta entra no cache quando
+chegar.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ORIENTACOES_CACHE_PATH = os.environ.get('ORIENTACOES_CACHE_PATH', os.path.join(BASE_DIR, 'orientacoes_cache.json'))
+ORIENTACOES_TTL_HORAS = float(os.environ.get('ORIENTACOES_TTL_HORAS', '168'))
+ORIENTACOES_TIMEOUT = float(os.environ.get('ORIENTACOES_TIMEOUT', '8'))
+ORIENTACOES_WORKERS = int(os.environ.get('ORIENTACOES_WORKERS', '2'))
+
+
+class CacheOrientacoes:
+    """Orientações por exame com TTL, persistência em JSON e timeout
+
+    `gerador(exame)` devolve o texto ou levanta exceção; falhas e textos
+    vazios não são guardados, então o próximo pedido tenta de novo.
+    """
+
+    def __init__(self, gerador, caminho=ORIENTACOES_CACHE_PATH, ttl=ORIENTACOES_TTL_HORAS * 3600,
+                 timeout=ORIENTACOES_TIMEOUT, workers=ORIENTACOES_WORKERS):
+        self.gerador = gerador
+        self.caminho = caminho
+        self.ttl = ttl
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='orientacoes')
+        self._trava = threading.Lock()
+        self._em_andamento = {}  # chave -> Future da geração em curso
+        self._lido_em = None  # mtime do arquivo na última leitura
+        self._entradas = self._carregar()
+        self.hits = 0
+        self.vencidos = 0
+        self.misses = 0
+        self.timeouts = 0
+        self.erros = 0
+
+    @staticmethod
+    def chave(exame):
+        return ' '.join(str(exame).split()).lower()
+
+    # ==================== PERSISTÊNCIA ====================
+
+    def _carregar(self):
+        try:
+            self._lido_em = os.stat(self.caminho).st_mtime
+            with open(self.caminho, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Cache de orientações ilegível, começando vazio: {e}")
+            return {}
+
+    def _mesclar(self, entradas):
+        """Junta entradas lidas do arquivo, ficando com a mais nova de cada exame; chamar com a trava"""
+        for chave, entrada in entradas.items():
+            atual = self._entradas.get(chave)
+            if atual is None or entrada.get("gerado_em", 0) > atual["gerado_em"]:
+                self._entradas[chave] = entrada
+
+    def _recarregar_se_mudou(self):
+        """Outro processo (worker do gunicorn) gravou o arquivo? Traz as entradas dele"""
+        try:
+            mtime = os.stat(self.caminho).st_mtime
+        except OSError:
+            return
+        if mtime != self._lido_em:
+            entradas = self._carregar()
+            with self._trava:
+                self._mesclar(entradas)
+
+    def _salvar(self):
+        """Grava o JSON inteiro (tmp + replace: nunca fica pela metade)
+
+        Mescla antes com o que está no arquivo, para não apagar o que outro
+        processo gerou.
+        """
+        entradas = self._carregar()
+        with self._trava:
+            self._mesclar(entradas)
+            conteudo = json.dumps(self._entradas, ensure_ascii=False, indent=1)
+        temporario = f"{self.caminho}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            f.write(conteudo)
+        os.replace(temporario, self.caminho)
+        try:
+            self._lido_em = os.stat(self.caminho).st_mtime
+        except OSError:
+            pass
+
+    # ==================== GERAÇÃO ====================
+
+    def _gerar(self, chave, exame):
+        try:
+            texto = (self.gerador(exame) or '').strip()
+            if texto:
+                with self._trava:
+                    self._entradas[chave] = {"exame": exame, "texto": texto, "gerado_em": time.time()}
+                self._salvar()
+            return texto
+        except Exception as e:
+            with self._trava:
+                self.erros += 1
+            print(f"⚠️ Falha ao gerar orientações de {exame}: {e}")
+            return ''
+        finally:
+            with self._trava:
+                self._em_andamento.pop(chave, None)
+
+    def _disparar(self, chave, exame):
+        """Future da geração do exame (reaproveita uma já em curso); chamar com a trava"""
+        futuro = self._em_andamento.get(chave)
+        if futuro is None:
+            futuro = self._em_andamento[chave] = self._executor.submit(self._gerar, chave, exame)
+        return futuro
+
+    def obter(self, exame, timeout=None):
+        """Orientações do exame; '' se não houver e o modelo não responder a tempo"""
+        chave = self.chave(exame)
+        if not chave:
+            return ''
+        self._recarregar_se_mudou()
+        with self._trava:
+            entrada = self._entradas.get(chave)
+            if entrada:
+                if time.time() - entrada["gerado_em"] < self.ttl:
+                    self.hits += 1
+                else:
+                    self.vencidos += 1
+                    self._disparar(chave, exame)  # renova sem segurar o agendamento
+                return entrada["texto"]
+            self.misses += 1
+            futuro = self._disparar(chave, exame)
+
+        try:
+            return futuro.result(timeout=self.timeout if timeout is None else timeout)
+        except FuturesTimeout:
+            with self._trava:
+                self.timeouts += 1
+            print(f"⏱️ Orientações de {exame} demoraram demais, seguindo sem elas")
+            return ''
+
+    def aquecer(self, exames):
+        """Gera em segundo plano as orientações ausentes ou vencidas; retorna quantas"""
+        agora = time.time()
+        disparados = 0
+        with self._trava:
+            for exame in exames:
+                chave = self.chave(exame)
+                entrada = self._entradas.get(chave)
+                if chave and (not entrada or agora - entrada["gerado_em"] >= self.ttl):
+                    self._disparar(chave, exame)
+                    disparados += 1
+        if disparados:
+            print(f"💡 Aquecendo orientações de {disparados} especialidade(s)")
+        return disparados
+
+    def estatisticas(self):
+        with self._trava:
+            return {
+                "entradas": len(self._entradas),
+                "em_andamento": len(self._em_andamento),
+                "hits": self.hits,
+                "vencidos": self.vencidos,
+                "misses": self.misses,
+                "timeouts": self.timeouts,
+                "erros": self.erros,
+                "ttl_horas": round(self.ttl / 3600, 1),
+                "timeout_segundos": self.timeout
+            }
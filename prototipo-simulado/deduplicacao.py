@@ -0,0 +1,162 @@
+"""
+🔁 Deduplicação das mensagens recebidas pelo webhook
+Sistema SUS - Hackapel 2025
+
+A Evolution API reentrega mensagens (timeout, deploy, restart). Cada id
+visto fica registrado por um TTL: em memória (LRU com limite de tamanho)
+e, se DEDUP_DB_PATH não estiver vazio, num SQLite que sobrevive ao
+restart e é compartilhado entre processos. O INSERT no SQLite decide
+quem viu a mensagem primeiro, então dois workers nunca processam a
+mesma reentrega.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEDUP_DB_PATH = os.environ.get('DEDUP_DB_PATH', os.path.join(BASE_DIR, 'deduplicacao.db'))  # vazio: só memória
+DEDUP_TTL_HORAS = float(os.environ.get('DEDUP_TTL_HORAS', '48'))
+DEDUP_MAX_MEMORIA = int(os.environ.get('DEDUP_MAX_MEMORIA', '50000'))
+DEDUP_LIMPEZA_A_CADA = 1000  # registros novos entre limpezas dos vencidos no disco
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS mensagens (
+    id TEXT PRIMARY KEY,
+    recebida_em REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_mensagens_recebida ON mensagens (recebida_em);
+"""
+
+
+class Deduplicador:
+    """Ids de mensagens já vistos, com TTL e memória limitada"""
+
+    def __init__(self, caminho=DEDUP_DB_PATH, ttl=DEDUP_TTL_HORAS * 3600, max_memoria=DEDUP_MAX_MEMORIA):
+        self.caminho = caminho or None
+        self.ttl = ttl
+        self.max_memoria = max_memoria
+        self._memoria = OrderedDict()  # id -> recebida_em (time.time), mais antigo primeiro
+        self._trava = threading.Lock()
+        self.novas = 0
+        self.duplicadas = 0
+        self.duplicadas_disco = 0  # reconhecidas só pelo SQLite (outro processo ou antes do restart)
+        self.removidas_lru = 0
+        self._desde_limpeza = 0
+        self._con = None
+        self._trava_disco = threading.Lock()
+        if self.caminho:
+            with self._conexao() as con:
+                con.executescript(ESQUEMA)
+
+    @contextmanager
+    def _conexao(self):
+        """Conexão única do processo (aberta uma vez: fechar a última conexão
+        de um WAL força checkpoint e fsync, caro demais por mensagem)"""
+        with self._trava_disco:
+            if self._con is None:
+                self._con = sqlite3.connect(self.caminho, timeout=30, isolation_level=None,
+                                            check_same_thread=False)
+                self._con.execute('PRAGMA journal_mode=WAL')
+                # Sem fsync por commit: numa queda de energia perde-se no máximo o
+                # registro das últimas mensagens (a memória e o TTL cobrem o resto)
+                self._con.execute('PRAGMA synchronous=NORMAL')
+            yield self._con
+
+    def _lembrar(self, msg_id, recebida_em):
+        """Guarda na memória (chamar com a trava); descarta o menos recente se passou do limite"""
+        self._memoria[msg_id] = recebida_em
+        self._memoria.move_to_end(msg_id)
+        while len(self._memoria) > self.max_memoria:
+            self._memoria.popitem(last=False)
+            self.removidas_lru += 1
+
+    def registrar(self, msg_id):
+        """True se a mensagem é nova (e passa a ser conhecida); False se é repetida"""
+        if not msg_id:
+            return True  # sem id não dá para deduplicar
+        agora = time.time()
+        with self._trava:
+            recebida_em = self._memoria.get(msg_id)
+            if recebida_em is not None and agora - recebida_em < self.ttl:
+                self._memoria.move_to_end(msg_id)
+                self.duplicadas += 1
+                return False
+
+        if self.caminho:
+            try:
+                nova = self._registrar_disco(msg_id, agora)
+            except sqlite3.Error as e:
+                # Sem disco, a memória ainda segura as reentregas deste processo
+                print(f"⚠️ Deduplicação no disco indisponível: {e}")
+                nova = True
+        else:
+            nova = True
+
+        with self._trava:
+            self._lembrar(msg_id, agora)
+            if nova:
+                self.novas += 1
+            else:
+                self.duplicadas += 1
+                self.duplicadas_disco += 1
+        return nova
+
+    def _registrar_disco(self, msg_id, agora):
+        with self._conexao() as con:
+            con.execute('BEGIN IMMEDIATE')
+            try:
+                # Quem conseguir inserir (ou renovar um registro vencido) processa a mensagem
+                nova = con.execute(
+                    'INSERT OR IGNORE INTO mensagens (id, recebida_em) VALUES (?, ?)', (msg_id, agora)
+                ).rowcount == 1 or con.execute(
+                    'UPDATE mensagens SET recebida_em = ? WHERE id = ? AND recebida_em < ?',
+                    (agora, msg_id, agora - self.ttl)
+                ).rowcount == 1
+                if nova:
+                    self._desde_limpeza += 1
+                    if self._desde_limpeza >= DEDUP_LIMPEZA_A_CADA:
+                        self._desde_limpeza = 0
+                        con.execute('DELETE FROM mensagens WHERE recebida_em < ?', (agora - self.ttl,))
+                con.execute('COMMIT')
+            except Exception:
+                # A conexão é reaproveitada: sem o ROLLBACK, o próximo BEGIN falharia para sempre
+                con.execute('ROLLBACK')
+                raise
+        return nova
+
+    def esquecer(self, msg_id):
+        """Desfaz o registro (a mensagem não foi aceita; a reentrega deve ser processada)"""
+        if not msg_id:
+            return
+        with self._trava:
+            self._memoria.pop(msg_id, None)
+        if self.caminho:
+            try:
+                with self._conexao() as con:
+                    con.execute('DELETE FROM mensagens WHERE id = ?', (msg_id,))
+            except sqlite3.Error as e:
+                print(f"⚠️ Erro ao esquecer mensagem {msg_id}: {e}")
+
+    def estatisticas(self):
+        with self._trava:
+            vistas = self.novas + self.duplicadas
+            return {
+                "persistente": bool(self.caminho),
+                "em_memoria": len(self._memoria),
+                "max_memoria": self.max_memoria,
+                "novas": self.novas,
+                "duplicadas": self.duplicadas,
+                "duplicadas_disco": self.duplicadas_disco,
+                "taxa_duplicadas": round(self.duplicadas / vistas, 3) if vistas else 0.0,
+                "removidas_lru": self.removidas_lru,
+                "ttl_horas": round(self.ttl / 3600, 1)
+            }
+
+
+# Instância global
+deduplicador = Deduplicador()
@@ -0,0 +1,181 @@
+"""
+🚀 Disparo de lembretes em paralelo com limite de taxa
+Sistema SUS - Hackapel 2025
+
+Um pool de workers envia os lembretes do plano, limitado por um token
+bucket na taxa que a Evolution API aceita. Quem falha volta para a fila
+com backoff próprio do destinatário, sem segurar os outros envios. As
+marcações de "lembrete enviado" são gravadas num único lote no fim.
+"""
+
+import heapq
+import os
+import random
+import threading
+import time
+
+LEMBRETES_WORKERS = int(os.environ.get('LEMBRETES_WORKERS', '4'))
+LEMBRETES_TAXA = float(os.environ.get('LEMBRETES_TAXA', '5'))  # envios por segundo
+LEMBRETES_RAJADA = int(os.environ.get('LEMBRETES_RAJADA', '10'))
+LEMBRETES_MAX_TENTATIVAS = int(os.environ.get('LEMBRETES_MAX_TENTATIVAS', '3'))
+LEMBRETES_BACKOFF_BASE = float(os.environ.get('LEMBRETES_BACKOFF_BASE', '30'))
+
+
+class TokenBucket:
+    """Libera até `rajada` envios de uma vez e depois `taxa` por segundo"""
+
+    def __init__(self, taxa, rajada):
+        self.taxa = taxa
+        self.rajada = max(1, rajada)
+        self._tokens = float(self.rajada)
+        self._atualizado = time.monotonic()
+        self._trava = threading.Lock()
+
+    def aguardar(self):
+        """Bloqueia até haver um token e o consome"""
+        while True:
+            with self._trava:
+                agora = time.monotonic()
+                self._tokens = min(self.rajada, self._tokens + (agora - self._atualizado) * self.taxa)
+                self._atualizado = agora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.taxa
+            time.sleep(espera)
+
+
+class DisparadorLembretes:
+    """Envia um plano de lembretes com N workers, limite de taxa e retry por destinatário
+
+    `enviar(item)` devolve True se o lembrete foi entregue.
+    `marcar_lote([(linha, dias), ...])` grava as marcações no fim da execução.
+    """
+
+    def __init__(self, enviar, marcar_lote, workers=LEMBRETES_WORKERS, taxa=LEMBRETES_TAXA,
+                 rajada=LEMBRETES_RAJADA, max_tentativas=LEMBRETES_MAX_TENTATIVAS,
+                 backoff_base=LEMBRETES_BACKOFF_BASE):
+        self.enviar = enviar
+        self.marcar_lote = marcar_lote
+        self.workers = workers
+        self.bucket = TokenBucket(taxa, rajada)
+        self.max_tentativas = max_tentativas
+        self.backoff_base = backoff_base
+        self._execucao = threading.Lock()  # uma execução por vez
+        self.ultima_execucao = None
+
+    def _espera(self, tentativa):
+        """Backoff exponencial com jitter"""
+        teto = self.backoff_base * 2 ** (tentativa - 1)
+        return random.uniform(teto / 2, teto)
+
+    def executar(self, itens):
+        """Dispara os itens e retorna o relatório (None se já há uma execução em curso)"""
+        if not self._execucao.acquire(blocking=False):
+            print("⏳ Disparo de lembretes anterior ainda em andamento, pulando")
+            return None
+        try:
+            return self._executar(itens)
+        finally:
+            self._execucao.release()
+
+    def _executar(self, itens):
+        inicio = time.perf_counter()
+        cond = threading.Condition()
+        # fila de (pronto_em, ordem, tentativa, item): retries vão para o fim da espera
+        fila = [(0.0, i, 1, item) for i, item in enumerate(itens)]
+        heapq.heapify(fila)
+        bloqueado_ate = {}  # telefone -> monotonic até quando não tentar de novo
+        pendentes = len(itens)
+        ordem = len(itens)
+        enviados = []
+        falhas = []
+        contadores = {"tentativas": 0, "retentativas": 0}
+
+        def proximo():
+            """Próximo item pronto; None quando não há mais nada a enviar"""
+            nonlocal pendentes
+            with cond:
+                while True:
+                    if pendentes == 0:
+                        return None
+                    if fila:
+                        pronto_em, posicao, tentativa, item = fila[0]
+                        bloqueio = bloqueado_ate.get(item["telefone"], 0.0)
+                        if bloqueio > pronto_em:
+                            # destinatário em backoff: adia o item sem travar os demais
+                            heapq.heapreplace(fila, (bloqueio, posicao, tentativa, item))
+                            continue
+                        espera = pronto_em - time.monotonic()
+                        if espera <= 0:
+                            heapq.heappop(fila)
+                            return tentativa, item
+                        cond.wait(timeout=espera)
+                    else:
+                        cond.wait()  # itens em envio ainda podem voltar para a fila
+
+        def concluir(tentativa, item, ok):
+            nonlocal pendentes, ordem
+            with cond:
+                contadores["tentativas"] += 1
+                if ok:
+                    enviados.append(item)
+                    pendentes -= 1
+                elif tentativa >= self.max_tentativas:
+                    falhas.append(item)
+                    pendentes -= 1
+                else:
+                    contadores["retentativas"] += 1
+                    pronto_em = time.monotonic() + self._espera(tentativa)
+                    bloqueado_ate[item["telefone"]] = pronto_em
+                    ordem += 1
+                    heapq.heappush(fila, (pronto_em, ordem, tentativa + 1, item))
+                cond.notify_all()
+
+        def worker():
+            while True:
+                proximo_item = proximo()
+                if proximo_item is None:
+                    return
+                tentativa, item = proximo_item
+                self.bucket.aguardar()
+                try:
+                    ok = bool(self.enviar(item))
+                except Exception as e:
+                    print(f"❌ Erro ao enviar lembrete para {item.get('paciente')}: {e}")
+                    ok = False
+                concluir(tentativa, item, ok)
+
+        threads = [threading.Thread(target=worker, name=f"lembretes-{i}", daemon=True)
+                   for i in range(min(self.workers, len(itens)))]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            # Mesmo se algo der errado, o que foi entregue fica marcado
+            if enviados:
+                self.marcar_lote([(item["linha"], item["dias_restantes"]) for item in enviados])
+
+        segundos = time.perf_counter() - inicio
+        relatorio = {
+            "total": len(itens),
+            "enviados": len(enviados),
+            "falhas": len(falhas),
+            "tentativas": contadores["tentativas"],
+            "retentativas": contadores["retentativas"],
+            "segundos": round(segundos, 2),
+            "envios_por_segundo": round(len(enviados) / segundos, 2) if segundos > 0 else 0.0
+        }
+        self.ultima_execucao = relatorio
+        return relatorio
+
+    def estatisticas(self):
+        return {
+            "workers": self.workers,
+            "taxa_por_segundo": self.bucket.taxa,
+            "rajada": self.bucket.rajada,
+            "em_execucao": self._execucao.locked(),
+            "ultima_execucao": self.ultima_execucao
+        }
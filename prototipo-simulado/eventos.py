@@ -0,0 +1,155 @@
+"""
+📡 Canal de eventos do painel (Server-Sent Events)
+Sistema SUS - Hackapel 2025
+
+Os painéis abertos assinam /api/eventos e só recebem algo quando a agenda
+muda (reserva, confirmação, cancelamento, lembretes, importação). Parado,
+o tráfego é um comentário de keep-alive a cada EVENTOS_KEEPALIVE segundos.
+Eventos recentes ficam num buffer, então quem reconecta com Last-Event-ID
+recebe o que perdeu.
+
+Escritas de outros processos chegam pela versão da agenda, conferida a
+cada EVENTOS_INTERVALO_VERSAO segundos; só o SQLite guarda essa versão
+num lugar que todos os processos veem. Com a planilha, a edição feita
+fora do sistema só aparece quando o snapshot vence (SHEETS_CACHE_TTL),
+por isso o backend sheets roda com um worker só (gunicorn.conf.py).
+
+Cada stream aberto prende uma thread do gunicorn (gthread). Para sobrar
+thread para agendamentos e webhook, o canal aceita no máximo
+EVENTOS_MAX_ASSINANTES conexões (a outra conta é do /api/eventos, que
+responde 503 e o painel volta ao polling) e fecha cada stream depois de
+EVENTOS_DURACAO_MAX segundos: o navegador reconecta com Last-Event-ID e
+a vaga fica disponível, nesse meio-tempo, para quem estava no polling.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+EVENTOS_KEEPALIVE = float(os.environ.get('EVENTOS_KEEPALIVE', '15'))
+EVENTOS_INTERVALO_VERSAO = float(os.environ.get('EVENTOS_INTERVALO_VERSAO', '1'))  # conferência entre processos
+EVENTOS_HISTORICO = 200  # eventos guardados para reconexão
+EVENTOS_FILA_ASSINANTE = 100  # assinante que acumula mais que isso é desconectado
+# Metade das threads de um worker, no máximo, fica presa em streams
+EVENTOS_MAX_ASSINANTES = int(os.environ.get(
+    'EVENTOS_MAX_ASSINANTES', max(int(os.environ.get('GUNICORN_THREADS', '64')) // 2, 1)))
+EVENTOS_DURACAO_MAX = float(os.environ.get('EVENTOS_DURACAO_MAX', '300'))  # segundos por stream
+
+
+class CanalEventos:
+    """Distribui eventos para os assinantes conectados (uma fila por conexão)"""
+
+    def __init__(self, keepalive=EVENTOS_KEEPALIVE, max_assinantes=EVENTOS_MAX_ASSINANTES,
+                 duracao_max=EVENTOS_DURACAO_MAX):
+        self.keepalive = keepalive
+        self.max_assinantes = max_assinantes
+        self.duracao_max = duracao_max
+        self._trava = threading.Lock()
+        self._assinantes = set()
+        self._historico = deque(maxlen=EVENTOS_HISTORICO)
+        self._ultimo_id = 0
+        self._agendados = {}  # tipo -> Timer de um publicar_agrupado pendente
+        self.publicados = 0
+        self.descartados = 0
+        self.recusados = 0
+
+    @property
+    def assinantes(self):
+        return len(self._assinantes)
+
+    @staticmethod
+    def _formatar(evento_id, tipo, dados):
+        return f"id: {evento_id}\nevent: {tipo}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+    def publicar(self, tipo, dados=None):
+        """Envia o evento para todos os assinantes; retorna o id"""
+        with self._trava:
+            self._ultimo_id += 1
+            mensagem = self._formatar(self._ultimo_id, tipo, dados or {})
+            self._historico.append((self._ultimo_id, mensagem))
+            self.publicados += 1
+            for fila in list(self._assinantes):
+                try:
+                    fila.put_nowait(mensagem)
+                except queue.Full:
+                    # Conexão travada: derruba, o navegador reconecta com Last-Event-ID
+                    self._assinantes.discard(fila)
+                    self.descartados += 1
+            return self._ultimo_id
+
+    def publicar_agrupado(self, tipo, gerar_dados, intervalo=0.3):
+        """Publica uma vez só uma rajada de mudanças (dados gerados no fim da janela)"""
+        with self._trava:
+            if tipo in self._agendados:
+                return
+
+            def disparar():
+                with self._trava:
+                    self._agendados.pop(tipo, None)
+                try:
+                    self.publicar(tipo, gerar_dados())
+                except Exception as e:
+                    print(f"❌ Erro ao publicar evento {tipo}: {e}")
+
+            timer = self._agendados[tipo] = threading.Timer(intervalo, disparar)
+            timer.daemon = True
+            timer.start()
+
+    def assinar(self, ultimo_id=None):
+        """Stream SSE de uma conexão, ou None se o canal já está cheio"""
+        fila = queue.Queue(maxsize=EVENTOS_FILA_ASSINANTE)
+        with self._trava:
+            if len(self._assinantes) >= self.max_assinantes:
+                self.recusados += 1
+                return None
+            perdidos = [m for i, m in self._historico if ultimo_id is not None and i > ultimo_id]
+            self._assinantes.add(fila)
+        return Assinatura(self, fila, perdidos)
+
+    def _cancelar(self, fila):
+        with self._trava:
+            self._assinantes.discard(fila)
+
+    def estatisticas(self):
+        with self._trava:
+            return {
+                "assinantes": len(self._assinantes),
+                "publicados": self.publicados,
+                "descartados": self.descartados,
+                "recusados": self.recusados,
+                "max_assinantes": self.max_assinantes,
+                "ultimo_id": self._ultimo_id
+            }
+
+
+class Assinatura:
+    """Stream de uma conexão; o servidor chama close() ao fim da resposta, mesmo sem ter lido nada"""
+
+    def __init__(self, canal, fila, perdidos):
+        self._canal = canal
+        self._fila = fila
+        self._perdidos = perdidos
+
+    def __iter__(self):
+        canal, fila = self._canal, self._fila
+        fim = time.monotonic() + canal.duracao_max
+        yield "retry: 3000\n\n"
+        yield from self._perdidos
+        while time.monotonic() < fim:
+            try:
+                yield fila.get(timeout=min(canal.keepalive, max(fim - time.monotonic(), 0)))
+            except queue.Empty:
+                with canal._trava:
+                    if fila not in canal._assinantes:
+                        return  # descartado por lentidão
+                yield ": keep-alive\n\n"
+
+    def close(self):
+        self._canal._cancelar(self._fila)
+
+
+# Instância global
+eventos = CanalEventos()
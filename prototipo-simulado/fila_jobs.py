@@ -0,0 +1,280 @@
+"""
+📬 Fila persistente de jobs (envios em segundo plano)
+Sistema SUS - Hackapel 2025
+
+Os jobs ficam num arquivo SQLite, então sobrevivem a um restart: um job
+que estava executando quando o processo caiu volta para a fila quando a
+reserva (lease) dele expira. Enquanto o job roda, a reserva é renovada;
+cada reserva tem um token, e só quem tem o token atual grava o resultado
+(um worker atrasado não sobrescreve o job que outro já pegou).
+"""
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FILA_JOBS_PATH = os.environ.get('FILA_JOBS_PATH', os.path.join(BASE_DIR, 'fila_jobs.db'))
+FILA_WORKERS = int(os.environ.get('FILA_WORKERS', '4'))
+FILA_MAX_TENTATIVAS = int(os.environ.get('FILA_MAX_TENTATIVAS', '5'))
+FILA_BACKOFF_BASE = float(os.environ.get('FILA_BACKOFF_BASE', '5'))
+FILA_BACKOFF_MAX = 600
+FILA_LEASE = 300  # segundos até um job "executando" ser considerado abandonado
+FILA_RENOVACAO = FILA_LEASE / 3  # intervalo de renovação da reserva dos jobs em execução
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    tipo TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    progresso TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL,               -- pendente | executando | concluido | falhou
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    max_tentativas INTEGER NOT NULL,
+    proxima_execucao REAL NOT NULL,
+    reservado_ate REAL,
+    reserva TEXT,                       -- token da reserva atual (só o dono finaliza)
+    erro TEXT,
+    resultado TEXT,
+    criado_em REAL NOT NULL,
+    atualizado_em REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_fila ON jobs (status, proxima_execucao);
+CREATE INDEX IF NOT EXISTS idx_jobs_criado ON jobs (criado_em);
+"""
+
+
+class FilaJobs:
+    """Fila de jobs com pool de workers, retry com backoff e status consultável
+
+    Cada tipo de job tem um handler `funcao(payload, progresso)`. O dict
+    `progresso` é salvo a cada tentativa, então um retry pode pular as
+    etapas que já deram certo (ex: texto enviado, falta o áudio).
+    Se o handler levantar exceção, o job é reagendado com backoff.
+    """
+
+    def __init__(self, caminho=FILA_JOBS_PATH, workers=FILA_WORKERS):
+        self.caminho = caminho
+        self.workers = workers
+        self._handlers = {}
+        self._acordar = threading.Event()
+        self._threads = []
+        self._em_execucao = {}  # id -> token da reserva dos jobs rodando neste processo
+        self._trava = threading.Lock()
+        with self._conexao() as con:
+            con.executescript(ESQUEMA)
+            self._migrar(con)
+
+    @staticmethod
+    def _migrar(con):
+        """Arquivos criados antes do token de reserva ganham a coluna"""
+        colunas = [r[1] for r in con.execute('PRAGMA table_info(jobs)')]
+        if 'reserva' not in colunas:
+            con.execute('ALTER TABLE jobs ADD COLUMN reserva TEXT')
+
+    @contextmanager
+    def _conexao(self):
+        con = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        con.execute('PRAGMA journal_mode=WAL')
+        try:
+            yield con
+        finally:
+            con.close()
+
+    def registrar(self, tipo, funcao):
+        """Associa um handler a um tipo de job"""
+        self._handlers[tipo] = funcao
+
+    # ==================== ENFILEIRAR / CONSULTAR ====================
+
+    def enfileirar(self, tipo, payload, max_tentativas=FILA_MAX_TENTATIVAS):
+        """Grava o job e acorda um worker; retorna o id"""
+        return self.enfileirar_lote(tipo, [payload], max_tentativas)[0]
+
+    def enfileirar_lote(self, tipo, payloads, max_tentativas=FILA_MAX_TENTATIVAS):
+        """Grava vários jobs do mesmo tipo numa única transação"""
+        agora = time.time()
+        ids = [uuid.uuid4().hex for _ in payloads]
+        with self._conexao() as con:
+            con.execute('BEGIN IMMEDIATE')
+            con.executemany(
+                """INSERT INTO jobs (id, tipo, payload, status, max_tentativas,
+                                     proxima_execucao, criado_em, atualizado_em)
+                   VALUES (?, ?, ?, 'pendente', ?, ?, ?, ?)""",
+                [(i, tipo, json.dumps(p, ensure_ascii=False), max_tentativas, agora, agora, agora)
+                 for i, p in zip(ids, payloads)]
+            )
+            con.execute('COMMIT')
+        self._acordar.set()
+        return ids
+
+    @staticmethod
+    def _job(row):
+        return {
+            "id": row['id'],
+            "tipo": row['tipo'],
+            "status": row['status'],
+            "tentativas": row['tentativas'],
+            "max_tentativas": row['max_tentativas'],
+            "progresso": json.loads(row['progresso']),
+            "resultado": json.loads(row['resultado']) if row['resultado'] else None,
+            "erro": row['erro'],
+            "criado_em": row['criado_em'],
+            "atualizado_em": row['atualizado_em'],
+            "proxima_execucao": row['proxima_execucao'] if row['status'] == 'pendente' else None
+        }
+
+    def consultar(self, job_id):
+        """Status de um job (None se não existir)"""
+        with self._conexao() as con:
+            row = con.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def listar(self, limite=20):
+        """Jobs mais recentes"""
+        with self._conexao() as con:
+            rows = con.execute('SELECT * FROM jobs ORDER BY criado_em DESC LIMIT ?', (limite,)).fetchall()
+        return [self._job(r) for r in rows]
+
+    def resumo(self):
+        """Quantidade de jobs por status"""
+        with self._conexao() as con:
+            rows = con.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        resumo = {"pendente": 0, "executando": 0, "concluido": 0, "falhou": 0}
+        resumo.update({status: n for status, n in rows})
+        return resumo
+
+    # ==================== WORKERS ====================
+
+    def _pegar_proximo(self):
+        """Reserva atomicamente o próximo job vencido (ou abandonado por um processo morto)"""
+        agora = time.time()
+        reserva = uuid.uuid4().hex
+        with self._conexao() as con:
+            con.execute('BEGIN IMMEDIATE')
+            row = con.execute(
+                """SELECT * FROM jobs
+                   WHERE (status = 'pendente' AND proxima_execucao <= ?)
+                      OR (status = 'executando' AND reservado_ate < ?)
+                   ORDER BY proxima_execucao LIMIT 1""",
+                (agora, agora)
+            ).fetchone()
+            if row is None:
+                con.execute('COMMIT')
+                return None
+            con.execute(
+                """UPDATE jobs SET status = 'executando', tentativas = tentativas + 1,
+                                  reservado_ate = ?, reserva = ?, atualizado_em = ?
+                   WHERE id = ?""",
+                (agora + FILA_LEASE, reserva, agora, row['id'])
+            )
+            con.execute('COMMIT')
+        job = self._job(row)
+        job['tentativas'] += 1
+        job['payload'] = json.loads(row['payload'])
+        job['reserva'] = reserva
+        return job
+
+    def _renovar_reservas(self):
+        """Estende a reserva dos jobs rodando neste processo (handler lento não perde o job)"""
+        with self._trava:
+            em_execucao = list(self._em_execucao.items())
+        if not em_execucao:
+            return
+        with self._conexao() as con:
+            con.executemany(
+                "UPDATE jobs SET reservado_ate = ? WHERE id = ? AND reserva = ?",
+                [(time.time() + FILA_LEASE, job_id, reserva) for job_id, reserva in em_execucao]
+            )
+
+    def _finalizar(self, job, status, progresso, resultado=None, erro=None, proxima=None):
+        agora = time.time()
+        with self._conexao() as con:
+            gravou = con.execute(
+                """UPDATE jobs SET status = ?, progresso = ?, resultado = ?, erro = ?,
+                                  proxima_execucao = COALESCE(?, proxima_execucao),
+                                  reservado_ate = NULL, reserva = NULL, atualizado_em = ?
+                   WHERE id = ? AND reserva = ?""",
+                (status, json.dumps(progresso, ensure_ascii=False),
+                 json.dumps(resultado, ensure_ascii=False) if resultado is not None else None,
+                 erro, proxima, agora, job['id'], job['reserva'])
+            ).rowcount == 1
+        if not gravou:
+            # A reserva venceu e outro worker pegou o job: o resultado é dele
+            print(f"⚠️ Job {job['tipo']} {job['id'][:8]} perdeu a reserva; resultado descartado")
+
+    def _executar(self, job):
+        handler = self._handlers.get(job['tipo'])
+        progresso = job['progresso']
+        if handler is None:
+            self._finalizar(job, 'falhou', progresso, erro=f"tipo de job desconhecido: {job['tipo']}")
+            return
+
+        try:
+            resultado = handler(job['payload'], progresso)
+            self._finalizar(job, 'concluido', progresso, resultado=resultado)
+        except Exception as e:
+            if job['tentativas'] >= job['max_tentativas']:
+                print(f"❌ Job {job['tipo']} {job['id'][:8]} falhou de vez: {e}")
+                self._finalizar(job, 'falhou', progresso, erro=str(e))
+                return
+            espera = min(FILA_BACKOFF_BASE * 2 ** (job['tentativas'] - 1), FILA_BACKOFF_MAX)
+            espera *= random.uniform(0.5, 1.0)  # jitter
+            print(f"⚠️ Job {job['tipo']} {job['id'][:8]} falhou ({e}), nova tentativa em {espera:.0f}s")
+            self._finalizar(job, 'pendente', progresso, erro=str(e), proxima=time.time() + espera)
+
+    def _loop_worker(self):
+        while True:
+            try:
+                job = self._pegar_proximo()
+            except Exception as e:
+                print(f"❌ Erro ao ler fila de jobs: {e}")
+                job = None
+            if job is None:
+                self._acordar.wait(timeout=1.0)
+                self._acordar.clear()
+                continue
+            with self._trava:
+                self._em_execucao[job['id']] = job['reserva']
+            try:
+                self._executar(job)
+            except Exception as e:
+                # Ex.: "database is locked" ao finalizar: o job continua 'executando'
+                # e volta para a fila quando a reserva (FILA_LEASE) vencer
+                print(f"❌ Erro ao executar job {job['tipo']} {job['id'][:8]}: {e}")
+            finally:
+                with self._trava:
+                    self._em_execucao.pop(job['id'], None)
+
+    def _loop_renovacao(self):
+        while True:
+            time.sleep(FILA_RENOVACAO)
+            try:
+                self._renovar_reservas()
+            except Exception as e:
+                # Nova tentativa no próximo ciclo; a reserva ainda tem FILA_LEASE de folga
+                print(f"⚠️ Erro ao renovar reservas da fila de jobs: {e}")
+
+    def iniciar(self):
+        """Sobe o pool de workers (threads daemon)"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop_worker, name=f"fila-jobs-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._loop_renovacao, name="fila-jobs-renovacao", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        print(f"📬 Fila de jobs iniciada ({self.workers} workers)")
+
+
+# Instância global
+fila = FilaJobs()
@@ -0,0 +1,130 @@
+"""
+📨 Fila do webhook: ordem por telefone e pool de workers de tamanho fixo
+Sistema SUS - Hackapel 2025
+
+O webhook só registra a mensagem aqui e responde 200 na hora; o
+processamento (atualizar a agenda, mandar texto + áudio) roda num pool
+fixo de workers. Mensagens do mesmo telefone são processadas uma de cada
+vez, na ordem de chegada (um "1" seguido de "2" não corre em paralelo);
+telefones diferentes andam em paralelo. A fila tem capacidade máxima:
+cheia, o webhook devolve 503 e a Evolution API reentrega depois.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '4'))
+WEBHOOK_FILA_MAX = int(os.environ.get('WEBHOOK_FILA_MAX', '1000'))
+
+
+class FilaPorTelefone:
+    """Pool de workers com uma fila por chave (telefone)
+
+    `processar(*args)` é chamado para cada evento. Um telefone com
+    eventos pendentes entra na fila de prontos; o worker que o pega
+    processa um evento e, se sobrar outro, devolve o telefone para o fim
+    da fila de prontos (revezamento justo entre telefones).
+    """
+
+    def __init__(self, processar, workers=WEBHOOK_WORKERS, capacidade=WEBHOOK_FILA_MAX):
+        self.processar = processar
+        self.workers = workers
+        self.capacidade = capacidade
+        self._cond = threading.Condition()
+        self._pendentes = {}  # chave -> deque de (enfileirado_em, args)
+        self._prontas = deque()  # chaves com evento pendente e nenhum worker nelas
+        self._profundidade = 0
+        self._threads = []
+        self.aceitos = 0
+        self.rejeitados = 0
+        self.processados = 0
+        self.erros = 0
+        self.em_processamento = 0
+        self.profundidade_maxima = 0
+        self.atraso_maximo = 0.0
+        self._atraso_total = 0.0
+        self._ultimo_atraso = 0.0
+
+    def enfileirar(self, chave, *args):
+        """Aceita o evento; False se a fila está cheia (quem chamou deve pedir reenvio)"""
+        with self._cond:
+            if self._profundidade >= self.capacidade:
+                self.rejeitados += 1
+                return False
+            fila = self._pendentes.get(chave)
+            if fila is None:
+                # Telefone sem nada pendente nem em processamento: já fica pronto
+                fila = self._pendentes[chave] = deque()
+                self._prontas.append(chave)
+            fila.append((time.monotonic(), args))
+            self._profundidade += 1
+            self.aceitos += 1
+            self.profundidade_maxima = max(self.profundidade_maxima, self._profundidade)
+            self._cond.notify()
+            return True
+
+    def _loop_worker(self):
+        while True:
+            with self._cond:
+                while not self._prontas:
+                    self._cond.wait()
+                chave = self._prontas.popleft()
+                enfileirado_em, args = self._pendentes[chave].popleft()
+                self._profundidade -= 1
+                self.em_processamento += 1
+                atraso = time.monotonic() - enfileirado_em
+                self._ultimo_atraso = atraso
+                self._atraso_total += atraso
+                self.atraso_maximo = max(self.atraso_maximo, atraso)
+
+            ok = True
+            try:
+                self.processar(*args)
+            except Exception as e:
+                ok = False
+                print(f"❌ Erro ao processar mensagem de {chave}: {e}")
+
+            with self._cond:
+                self.em_processamento -= 1
+                self.processados += 1
+                self.erros += not ok
+                # Só agora o próximo evento do mesmo telefone pode ser pego
+                if self._pendentes[chave]:
+                    self._prontas.append(chave)
+                    self._cond.notify()
+                else:
+                    del self._pendentes[chave]
+
+    def iniciar(self):
+        """Sobe o pool de workers (threads daemon)"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop_worker, name=f"webhook-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"📨 Fila do webhook iniciada ({self.workers} workers)")
+
+    def estatisticas(self):
+        with self._cond:
+            mais_antigo = min((fila[0][0] for fila in self._pendentes.values() if fila), default=None)
+            iniciados = self.processados + self.em_processamento
+            return {
+                "workers": self.workers,
+                "capacidade": self.capacidade,
+                "profundidade": self._profundidade,
+                "profundidade_maxima": self.profundidade_maxima,
+                "telefones_pendentes": len(self._pendentes),
+                "em_processamento": self.em_processamento,
+                "aceitos": self.aceitos,
+                "rejeitados": self.rejeitados,
+                "processados": self.processados,
+                "erros": self.erros,
+                # atraso = tempo entre o webhook aceitar e um worker começar
+                "atraso_atual_s": round(time.monotonic() - mais_antigo, 3) if mais_antigo else 0.0,
+                "atraso_ultimo_s": round(self._ultimo_atraso, 3),
+                "atraso_medio_s": round(self._atraso_total / iniciados, 3) if iniciados else 0.0,
+                "atraso_maximo_s": round(self.atraso_maximo, 3)
+            }
@@ -5,8 +5,18 @@ Sistema SUS - Hackapel 2025
 
 import os
 import json
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
 import gspread
+from gspread.utils import rowcol_to_a1
 from google.oauth2.service_account import Credentials
+from datetime import date, timedelta
+from backend_agenda import BackendAgenda
+from indices_agenda import IndiceVagas, IndiceTelefones, IndiceAgendados
+from modelo_agenda import Horario, Status, sufixo_telefone
+from processos import travas_por_chaves
 
 # Escopo necessário para ler/escrever
 SCOPES = [
@@ -14,14 +24,53 @@ SCOPES = [
     'https://www.googleapis.com/auth/drive'
 ]
 
-class GoogleSheetsClient:
+# Tempo (segundos) que o snapshot da planilha é reaproveitado entre leituras
+SHEETS_CACHE_TTL = float(os.environ.get('SHEETS_CACHE_TTL', '30'))
+
+class GoogleSheetsClient(BackendAgenda):
     """Cliente para Google Sheets"""
     
+    nome = 'sheets'
+    linhas_estaveis = False  # a limpeza reescreve a planilha só com os ocupados
+    
     def __init__(self):
         self.client = None
         self.sheet = None
         self.worksheet = None
         self.conectado = False
+        
+        # Snapshot compartilhado da planilha (evita baixar tudo a cada leitura),
+        # uma lista de Horario já convertidos (modelo_agenda)
+        self.cache_ttl = SHEETS_CACHE_TTL
+        self._snapshot = None
+        self._snapshot_em = 0.0
+        self._assinatura = None  # hash dos valores do último download (detecta edição externa)
+        self._trava = threading.RLock()
+        # Quem está usando números de linha (linhas_fixas) e a limpeza, que os muda
+        self._linhas = threading.Condition()
+        self._usando_linhas = 0
+        self._limpando = False
+        self.cache_hits = 0
+        self.cache_misses = 0
+        
+        # Índices em memória (reconstruídos a cada snapshot novo)
+        self._vagas = IndiceVagas()
+        self._telefones = IndiceTelefones()
+        self._agendados = IndiceAgendados()
+        
+        # Contadores do painel: recontados a cada snapshot novo e ajustados
+        # a cada escrita, então métricas e status não varrem a planilha
+        self._metricas = self._recontar([])
+        self._renovacao = threading.Lock()
+        
+        # Chamadas à API do Google por operação (para acompanhar a cota)
+        self.operacoes = Counter()
+        self.chamadas_api = Counter()
+        
+        # Mapa de colunas (lido uma vez na conexão)
+        self._cabecalho = []
+        self._colunas = {}
+        
         self._conectar()
     
     def _conectar(self):
@@ -44,6 +93,7 @@ class GoogleSheetsClient:
             self.client = gspread.authorize(creds)
             self.sheet = self.client.open_by_key(sheet_id)
             self.worksheet = self.sheet.sheet1  # Primeira aba
+            self._carregar_colunas()
             
             self.conectado = True
             print(f"✅ Google Sheets conectado: {self.sheet.title}")
@@ -52,32 +102,363 @@ class GoogleSheetsClient:
             print(f"❌ Erro ao conectar Google Sheets: {e}")
             self.conectado = False
     
+    # ==================== MAPA DE COLUNAS ====================
+    
+    def _carregar_colunas(self):
+        """Lê o cabeçalho (linha 1) e guarda a posição de cada coluna"""
+        self._iniciar_operacao('carregar_colunas')
+        self._contar_chamada('carregar_colunas')
+        cabecalho = self.worksheet.row_values(1)
+        with self._trava:
+            self._cabecalho = cabecalho
+            self._colunas = {nome: idx + 1 for idx, nome in enumerate(cabecalho) if nome}
+    
+    def _adicionar_coluna(self, nome):
+        """Registra no mapa uma coluna criada por nós no fim do cabeçalho"""
+        with self._trava:
+            self._cabecalho = self._cabecalho + [nome]
+            self._colunas[nome] = len(self._cabecalho)
+            return self._colunas[nome]
+    
+    # ==================== SNAPSHOT (CACHE) ====================
+    
+    def _obter_dados(self):
+        """Retorna o snapshot da planilha, baixando de novo só se expirou o TTL"""
+        with self._trava:
+            if self._snapshot is not None and time.monotonic() - self._snapshot_em < self.cache_ttl:
+                self.cache_hits += 1
+                return self._snapshot
+            
+            # Valores crus (sem montar um dict por linha); cada linha vira um Horario
+            self.cache_misses += 1
+            self._iniciar_operacao('carregar_snapshot')
+            self._contar_chamada('carregar_snapshot')
+            valores = self.worksheet.get_all_values()
+            cabecalho = valores[0] if valores else []
+            self._snapshot = [Horario.de_valores(cabecalho, linha) for linha in valores[1:]]
+            self._snapshot_em = time.monotonic()
+            self._vagas.reconstruir(self._snapshot)
+            self._telefones.reconstruir(self._snapshot)
+            self._agendados.reconstruir(self._snapshot)
+            self._metricas = self._recontar(self._snapshot)
+            assinatura, self._assinatura = self._assinatura, hash(tuple(map(tuple, valores)))
+            if assinatura is not None and assinatura != self._assinatura:
+                # Alguém editou a planilha direto (fora do sistema)
+                self._registrar_mudanca('recarga')
+            
+            # Operador mexeu no cabeçalho? Atualiza o mapa de colunas (já veio junto)
+            if cabecalho and cabecalho != self._cabecalho:
+                print("🔄 Cabeçalho da planilha mudou, recarregando colunas")
+                self._cabecalho = cabecalho
+                self._colunas = {nome: idx + 1 for idx, nome in enumerate(cabecalho) if nome}
+            return self._snapshot
+    
+    def _atualizar_snapshot(self, linha, valores):
+        """Aplica no snapshot uma escrita já feita na planilha (write-through)"""
+        with self._trava:
+            if self._snapshot is None:
+                return
+            idx = linha - 2  # linha 1 é cabeçalho
+            if 0 <= idx < len(self._snapshot):
+                row = self._snapshot[idx]
+                self._metricas.subtract(self._contagem(row))
+                row.atualizar(valores)
+                self._metricas.update(self._contagem(row))
+                if 'disponivel' in valores:
+                    if row.disponivel:
+                        self._vagas.adicionar(linha, row)
+                    else:
+                        self._vagas.remover(linha)
+                if 'telefone' in valores or 'paciente' in valores:
+                    self._telefones.atualizar(linha, row)
+                self._agendados.atualizar(linha, row)
+            else:
+                self.invalidar_cache()
+    
+    # ==================== CONTADORES DO PAINEL ====================
+    
+    @staticmethod
+    def _contagem(horario):
+        """Quanto uma linha soma em cada contador"""
+        return {
+            'total': 1,
+            'disponiveis': int(horario.disponivel),
+            'agendados': int(bool(horario.paciente)),
+            'confirmados': int(horario.status is Status.CONFIRMADO),
+            'cancelados': int(horario.status is Status.CANCELADO),
+            'lembretes': int(bool(horario.lembretes))
+        }
+    
+    @staticmethod
+    def _recontar(dados):
+        """Contadores do zero (uma passada); reconcilia o que foi ajustado por escrita"""
+        disponiveis = agendados = confirmados = cancelados = lembretes = 0
+        for horario in dados:
+            disponiveis += horario.disponivel
+            agendados += bool(horario.paciente)
+            confirmados += horario.status is Status.CONFIRMADO
+            cancelados += horario.status is Status.CANCELADO
+            lembretes += bool(horario.lembretes)
+        return Counter(total=len(dados), disponiveis=disponiveis, agendados=agendados,
+                       confirmados=confirmados, cancelados=cancelados, lembretes=lembretes)
+    
+    def _metricas_atuais(self):
+        """Contadores sem esperar download: snapshot vencido é renovado em segundo plano"""
+        if self._snapshot is None:
+            self._obter_dados()
+        elif time.monotonic() - self._snapshot_em >= self.cache_ttl:
+            self._renovar_em_segundo_plano()
+        return dict(self._metricas)
+    
+    def versao_dados(self):
+        """Versão atual; snapshot vencido é renovado em segundo plano (edição externa muda a versão)"""
+        if self._snapshot is not None and time.monotonic() - self._snapshot_em >= self.cache_ttl:
+            self._renovar_em_segundo_plano()
+        return self._versao
+    
+    def _renovar_em_segundo_plano(self):
+        if not self._renovacao.acquire(blocking=False):
+            return  # já tem uma renovação em andamento
+        
+        def renovar():
+            try:
+                self._obter_dados()
+            except Exception as e:
+                print(f"❌ Erro ao renovar snapshot: {e}")
+            finally:
+                self._renovacao.release()
+        
+        threading.Thread(target=renovar, daemon=True).start()
+    
+    def invalidar_cache(self):
+        """Descarta o snapshot; a próxima leitura baixa a planilha de novo"""
+        with self._trava:
+            self._snapshot = None
+            self._snapshot_em = 0.0
+    
+    # ==================== ESCRITA EM LOTE ====================
+    
+    def _contar_chamada(self, operacao, n=1):
+        """Registra chamadas feitas à API do Google"""
+        with self._trava:
+            self.chamadas_api[operacao] += n
+    
+    def _iniciar_operacao(self, operacao):
+        """Conta uma execução da operação (base da média de chamadas)"""
+        with self._trava:
+            self.operacoes[operacao] += 1
+    
+    def _gravar_celulas(self, celulas, operacao):
+        """Grava células (linha, coluna, valor) em UMA requisição batch
+        
+        Colunas vizinhas da mesma linha viram um único intervalo (ex: E2:H2).
+        """
+        por_linha = {}
+        for linha, coluna, valor in celulas:
+            por_linha.setdefault(linha, {})[coluna] = valor
+        
+        dados = []
+        for linha, colunas in por_linha.items():
+            ordenadas = sorted(colunas)
+            inicio = anterior = ordenadas[0]
+            valores = [colunas[inicio]]
+            for coluna in ordenadas[1:]:
+                if coluna == anterior + 1:
+                    valores.append(colunas[coluna])
+                else:
+                    dados.append(self._intervalo(linha, inicio, anterior, valores))
+                    inicio, valores = coluna, [colunas[coluna]]
+                anterior = coluna
+            dados.append(self._intervalo(linha, inicio, anterior, valores))
+        
+        if dados:
+            self._contar_chamada(operacao)
+            self.worksheet.batch_update(dados, value_input_option='USER_ENTERED')
+    
+    @staticmethod
+    def _intervalo(linha, col_inicio, col_fim, valores):
+        faixa = rowcol_to_a1(linha, col_inicio)
+        if col_fim != col_inicio:
+            faixa += ':' + rowcol_to_a1(linha, col_fim)
+        return {'range': faixa, 'values': [valores]}
+    
+    def atualizar_linhas(self, alteracoes, operacao='atualizar_linhas'):
+        """Grava várias linhas de uma vez: alteracoes = [(linha, {coluna: valor}), ...]
+        
+        Colunas que não existem na planilha são ignoradas. Tudo vai numa
+        única requisição batch e o snapshot é atualizado em seguida. Se a
+        escrita for recusada por esquema diferente, o mapa de colunas é
+        relido e a escrita é repetida uma vez.
+        """
+        try:
+            self._escrever_linhas(alteracoes, operacao)
+        except (gspread.exceptions.APIError, ValueError) as e:
+            if isinstance(e, gspread.exceptions.APIError) and e.response.status_code != 400:
+                raise
+            print(f"🔄 Escrita recusada ({e}), recarregando colunas")
+            self._carregar_colunas()
+            self._escrever_linhas(alteracoes, operacao)
+    
+    def _escrever_linhas(self, alteracoes, operacao):
+        colunas = self._colunas
+        celulas = []
+        for linha, valores in alteracoes:
+            for coluna, valor in valores.items():
+                if coluna in colunas:
+                    celulas.append((linha, colunas[coluna], valor))
+        
+        if alteracoes and not celulas:
+            raise ValueError(f"Nenhuma coluna encontrada na planilha: {list(alteracoes[0][1])}")
+        
+        self._gravar_celulas(celulas, operacao)
+        
+        for linha, valores in alteracoes:
+            self._atualizar_snapshot(linha, {c: v for c, v in valores.items() if c in colunas})
+    
+    def atualizar_linha(self, linha, valores, operacao='atualizar_linha'):
+        """Grava as colunas alteradas de uma linha numa única requisição"""
+        self.atualizar_linhas([(linha, valores)], operacao)
+    
+    # ==================== IMPORTAÇÃO ====================
+    
+    def importar_registros(self, registros):
+        """Anexa um lote de horários no fim da planilha (uma chamada por lote)
+        
+        Repetidos são detectados pelo snapshot, que recebe as linhas novas
+        sem precisar baixar a planilha de novo.
+        """
+        self._iniciar_operacao('importar_registros')
+        with self._trava:
+            dados = self._obter_dados()
+            existentes = {h.chave() for h in dados}
+            
+            novos = []
+            for registro in registros:
+                horario = Horario.de_dict(registro)
+                chave = horario.chave()
+                if chave not in existentes:
+                    existentes.add(chave)
+                    novos.append((registro, horario))
+            
+            if novos:
+                largura = len(self._cabecalho)
+                valores = []
+                for registro, _ in novos:
+                    linha = [''] * largura
+                    for coluna, valor in registro.items():
+                        if coluna in self._colunas:
+                            linha[self._colunas[coluna] - 1] = valor
+                    valores.append(linha)
+                
+                self._contar_chamada('importar_registros')
+                self.worksheet.append_rows(valores, value_input_option='RAW')
+                
+                # Linhas novas entram no snapshot e nos índices
+                for _, horario in novos:
+                    dados.append(horario)
+                    self._metricas.update(self._contagem(horario))
+                    linha = len(dados) + 1  # linha 1 é cabeçalho
+                    if horario.disponivel:
+                        self._vagas.adicionar(linha, horario)
+                    self._telefones.atualizar(linha, horario)
+                    self._agendados.atualizar(linha, horario)
+        
+        if novos:
+            self._registrar_mudanca('importacao', inseridos=len(novos))
+        return len(novos), len(registros) - len(novos)
+    
+    def limpar_horarios(self):
+        """Remove os horários livres reescrevendo a planilha só com os ocupados
+        
+        As linhas mudam de número: reservas em andamento (que já escolheram
+        uma linha) terminam antes, pelas travas de reserva de todos os exames,
+        e respostas em andamento (linhas_fixas) também; novas esperam o fim.
+        """
+        self._iniciar_operacao('limpar_horarios')
+        with self._linhas:
+            self._linhas.wait_for(lambda: not self._limpando)
+            self._limpando = True
+            self._linhas.wait_for(lambda: not self._usando_linhas)
+        try:
+            return self._limpar_horarios()
+        finally:
+            with self._linhas:
+                self._limpando = False
+                self._linhas.notify_all()
+    
+    def _limpar_horarios(self):
+        exames = {h.exame for h in self._obter_dados()}
+        with self._trava_reserva(exames), self._trava:
+            self.invalidar_cache()
+            dados = self._obter_dados()
+            mantidos = [h for h in dados if not h.disponivel]
+            
+            valores = [self._cabecalho] + [[h.texto(c) for c in self._cabecalho] for h in mantidos]
+            self._contar_chamada('limpar_horarios', 3)
+            self.worksheet.clear()
+            self.worksheet.update(values=valores, range_name='A1', value_input_option='RAW')
+            self.worksheet.resize(rows=max(len(valores), 2))
+            self.invalidar_cache()
+        
+        removidos = len(dados) - len(mantidos)
+        print(f"🧹 {removidos} horários livres removidos")
+        if removidos:
+            self._registrar_mudanca('limpeza', removidos=removidos)
+        return removidos
+    
+    def estatisticas(self):
+        """Contadores do cache de leitura e das chamadas à API"""
+        with self._trava:
+            total = self.cache_hits + self.cache_misses
+            idade = time.monotonic() - self._snapshot_em if self._snapshot is not None else None
+            chamadas = {}
+            for operacao, n in self.chamadas_api.items():
+                execucoes = self.operacoes.get(operacao, 0)
+                chamadas[operacao] = {
+                    "execucoes": execucoes,
+                    "chamadas": n,
+                    "media_por_execucao": round(n / execucoes, 2) if execucoes else None
+                }
+            return {
+                "chamadas_api": chamadas,
+                "cache": {
+                    "hits": self.cache_hits,
+                    "misses": self.cache_misses,
+                    "taxa_acerto": round(self.cache_hits / total, 3) if total else 0.0,
+                    "ttl_segundos": self.cache_ttl,
+                    "idade_snapshot": round(idade, 1) if idade is not None else None,
+                    "linhas": len(self._snapshot) if self._snapshot is not None else 0
+                }
+            }
+    
     def carregar_dados(self):
         """Carrega todos os dados da planilha"""
         if not self.conectado:
             return None
         
         try:
-            # Pegar todos os dados como lista de dicionários
-            dados = self.worksheet.get_all_records()
-            return dados
+            with self._trava:
+                return [h.para_dict(self._cabecalho) for h in self._obter_dados()]
         except Exception as e:
             print(f"❌ Erro ao carregar dados: {e}")
             return None
     
-    def buscar_vaga(self, exame):
-        """Busca primeira vaga disponível para um exame"""
+    def buscar_vaga(self, exame, clinica=None):
+        """Busca a vaga disponível mais cedo (data, horário) para um exame
+        
+        Consulta o índice de vagas livres em vez de varrer a planilha.
+        Horários em datas já passadas são ignorados.
+        """
         if not self.conectado:
             return None, None
         
         try:
-            dados = self.worksheet.get_all_records()
-            
-            for idx, row in enumerate(dados):
-                if row.get('exame') == exame and str(row.get('disponivel', '')).upper() == 'SIM':
-                    return idx + 2, row  # +2 porque linha 1 é cabeçalho e índice começa em 0
-            
-            return None, None
+            with self._trava:
+                dados = self._obter_dados()
+                linha = self._vagas.proxima(exame, clinica, a_partir_de=date.today())
+                if linha is None:
+                    return None, None
+                return linha, dados[linha - 2].para_dict(self._cabecalho)  # linha 1 é cabeçalho
         except Exception as e:
             print(f"❌ Erro ao buscar vaga: {e}")
             return None, None
@@ -88,57 +469,137 @@ class GoogleSheetsClient:
             return False
         
         try:
-            # Encontrar colunas
-            cabecalho = self.worksheet.row_values(1)
-            
-            col_disponivel = cabecalho.index('disponivel') + 1
-            col_paciente = cabecalho.index('paciente') + 1 if 'paciente' in cabecalho else None
-            col_telefone = cabecalho.index('telefone') + 1 if 'telefone' in cabecalho else None
-            col_status = cabecalho.index('status_confirmacao') + 1 if 'status_confirmacao' in cabecalho else None
-            
-            # Atualizar células
-            self.worksheet.update_cell(linha, col_disponivel, 'NAO')
-            
-            if col_paciente:
-                self.worksheet.update_cell(linha, col_paciente, nome)
-            if col_telefone:
-                self.worksheet.update_cell(linha, col_telefone, telefone)
-            if col_status:
-                self.worksheet.update_cell(linha, col_status, 'PENDENTE')
-            
+            self._iniciar_operacao('reservar_vaga')
+            self.atualizar_linha(linha, {
+                'disponivel': 'NAO', 'paciente': nome, 'telefone': telefone, 'status_confirmacao': 'PENDENTE'
+            }, operacao='reservar_vaga')
             print(f"✅ Vaga reservada: linha {linha} para {nome}")
+            self._registrar_mudanca('reserva', linha=linha)
             return True
             
         except Exception as e:
             print(f"❌ Erro ao reservar vaga: {e}")
             return False
     
+    @contextmanager
+    def linhas_fixas(self):
+        with self._linhas:
+            self._linhas.wait_for(lambda: not self._limpando)
+            self._usando_linhas += 1
+        try:
+            yield
+        finally:
+            with self._linhas:
+                self._usando_linhas -= 1
+                self._linhas.notify_all()
+    
+    @contextmanager
+    def _trava_reserva(self, exames):
+        # A planilha não tem escrita condicional: entre workers a disputa
+        # do exame também passa por uma trava de arquivo
+        with super()._trava_reserva(exames), travas_por_chaves('reserva', exames):
+            yield
+    
+    def _reservar_se_livre(self, linha, nome, telefone):
+        """Relê a linha na planilha antes de gravar (o snapshot pode estar velho)
+        
+        Se a linha mudou de horário (linhas inseridas ou apagadas à mão), o
+        snapshot é descartado; se o horário já tem paciente, o snapshot é
+        corrigido. Nos dois casos a vaga não é reservada.
+        """
+        if not self.conectado:
+            return None
+        
+        try:
+            self._iniciar_operacao('reservar_vaga')
+            self._contar_chamada('reservar_vaga')
+            atual = Horario.de_valores(self._cabecalho, self.worksheet.row_values(linha))
+            with self._trava:
+                esperado = self._snapshot[linha - 2] if self._snapshot and 0 <= linha - 2 < len(self._snapshot) else None
+            if esperado is None or atual.chave() != esperado.chave():
+                self.invalidar_cache()
+                return False
+            if not atual.disponivel or atual.paciente:
+                self._atualizar_snapshot(linha, {coluna: atual.texto(coluna) for coluna in (
+                    'disponivel', 'paciente', 'telefone', 'status_confirmacao')})
+                return False
+            
+            self.atualizar_linha(linha, {
+                'disponivel': 'NAO', 'paciente': nome, 'telefone': telefone, 'status_confirmacao': 'PENDENTE'
+            }, operacao='reservar_vaga')
+            return True
+        except Exception as e:
+            print(f"❌ Erro ao reservar vaga: {e}")
+            return None
+    
+    def reservar_em_lote(self, pedidos):
+        """Reserva o lote com uma leitura e uma escrita na planilha
+        
+        Com as travas dos exames do lote, baixa a planilha de novo (é a
+        conferência: o que outro processo reservou antes já aparece),
+        escolhe as vagas pelo índice em uma passada e grava todas numa
+        requisição batch.
+        """
+        if not self.conectado:
+            return [(None, 'erro')] * len(pedidos)
+        
+        resultados, alteracoes = [], []
+        with self._trava_reserva({p['exame'] for p in pedidos}):
+            try:
+                self._iniciar_operacao('reservar_em_lote')
+                hoje = date.today()
+                with self._trava:
+                    self.invalidar_cache()
+                    dados = self._obter_dados()
+                    for p in pedidos:
+                        linha = self._vagas.proxima(p['exame'], p.get('clinica'), a_partir_de=hoje)
+                        if linha is None:
+                            resultados.append((None, 'sem_vaga'))
+                            continue
+                        self._vagas.remover(linha)  # o próximo do lote já pega a vaga seguinte
+                        resultados.append((linha, dados[linha - 2].para_dict(self._cabecalho)))
+                        alteracoes.append((linha, {
+                            'disponivel': 'NAO', 'paciente': p['nome'], 'telefone': p['telefone'],
+                            'status_confirmacao': 'PENDENTE'
+                        }))
+                if alteracoes:
+                    self.atualizar_linhas(alteracoes, operacao='reservar_em_lote')
+            except Exception as e:
+                print(f"❌ Erro ao reservar lote: {e}")
+                self.invalidar_cache()  # o índice perdeu vagas que não chegaram a ser gravadas
+                return [(None, 'erro')] * len(pedidos)
+        
+        if alteracoes:
+            self._reservas += len(alteracoes)
+            print(f"✅ Lote reservado: {len(alteracoes)} de {len(pedidos)} paciente(s)")
+            self._registrar_mudanca('reserva', linhas=len(alteracoes))
+        return resultados
+    
     def buscar_por_telefone(self, telefone):
-        """Busca paciente PENDENTE por telefone (últimos 8 dígitos)"""
+        """Busca paciente PENDENTE por telefone (últimos 8 dígitos)
+        
+        Usa o índice de telefones: só as linhas daquele número são olhadas,
+        da reserva mais recente para a mais antiga.
+        """
         if not self.conectado:
             return None, None
         
         try:
-            dados = self.worksheet.get_all_records()
-            tel_busca = ''.join(c for c in str(telefone) if c.isdigit())[-8:]
-            
-            # Buscar o ÚLTIMO registro PENDENTE desse telefone
-            resultado = None
-            for idx, row in enumerate(dados):
-                tel_row = ''.join(c for c in str(row.get('telefone', '')) if c.isdigit())
-                status = str(row.get('status_confirmacao', '')).upper()
+            with self._trava:
+                dados = self._obter_dados()
+                linhas = self._telefones.linhas(telefone)
                 
-                if tel_row.endswith(tel_busca) and status == 'PENDENTE':
-                    resultado = (idx + 2, row)  # +2 por cabeçalho
-            
-            # Se não encontrou pendente, busca qualquer um com paciente
-            if resultado is None:
-                for idx, row in enumerate(dados):
-                    tel_row = ''.join(c for c in str(row.get('telefone', '')) if c.isdigit())
-                    if tel_row.endswith(tel_busca) and row.get('paciente'):
-                        resultado = (idx + 2, row)
+                # Reserva PENDENTE mais recente desse telefone
+                for linha in linhas:
+                    row = dados[linha - 2]
+                    if row.status is Status.PENDENTE:
+                        return linha, row.para_dict(self._cabecalho)
+                
+                # Se não encontrou pendente, qualquer uma com paciente
+                if linhas:
+                    return linhas[0], dados[linhas[0] - 2].para_dict(self._cabecalho)
             
-            return resultado if resultado else (None, None)
+            return None, None
         except Exception as e:
             print(f"❌ Erro ao buscar telefone: {e}")
             return None, None
@@ -149,14 +610,11 @@ class GoogleSheetsClient:
             return False
         
         try:
-            cabecalho = self.worksheet.row_values(1)
-            col_status = cabecalho.index('status_confirmacao') + 1 if 'status_confirmacao' in cabecalho else None
-            
-            if col_status:
-                self.worksheet.update_cell(linha, col_status, status)
-                print(f"✅ Status atualizado: linha {linha} -> {status}")
-                return True
-            return False
+            self._iniciar_operacao('atualizar_status')
+            self.atualizar_linha(linha, {'status_confirmacao': status}, operacao='atualizar_status')
+            print(f"✅ Status atualizado: linha {linha} -> {status}")
+            self._registrar_mudanca('status', linha=linha, status=status)
+            return True
         except Exception as e:
             print(f"❌ Erro ao atualizar status: {e}")
             return False
@@ -167,22 +625,12 @@ class GoogleSheetsClient:
             return False
         
         try:
-            cabecalho = self.worksheet.row_values(1)
-            
-            col_disponivel = cabecalho.index('disponivel') + 1
-            col_paciente = cabecalho.index('paciente') + 1 if 'paciente' in cabecalho else None
-            col_telefone = cabecalho.index('telefone') + 1 if 'telefone' in cabecalho else None
-            col_status = cabecalho.index('status_confirmacao') + 1 if 'status_confirmacao' in cabecalho else None
-            
-            self.worksheet.update_cell(linha, col_disponivel, 'SIM')
-            if col_paciente:
-                self.worksheet.update_cell(linha, col_paciente, '')
-            if col_telefone:
-                self.worksheet.update_cell(linha, col_telefone, '')
-            if col_status:
-                self.worksheet.update_cell(linha, col_status, 'CANCELADO')
-            
+            self._iniciar_operacao('liberar_vaga')
+            self.atualizar_linha(linha, {
+                'disponivel': 'SIM', 'paciente': '', 'telefone': '', 'status_confirmacao': 'CANCELADO'
+            }, operacao='liberar_vaga')
             print(f"✅ Vaga liberada: linha {linha}")
+            self._registrar_mudanca('cancelamento', linha=linha)
             return True
         except Exception as e:
             print(f"❌ Erro ao liberar vaga: {e}")
@@ -194,18 +642,12 @@ class GoogleSheetsClient:
             return {"agendados": 0, "confirmados": 0, "cancelados": 0, "lembretes": 0}
         
         try:
-            dados = self.worksheet.get_all_records()
-            
-            agendados = sum(1 for r in dados if r.get('paciente') and str(r.get('paciente')).strip())
-            confirmados = sum(1 for r in dados if str(r.get('status_confirmacao', '')).upper() == 'CONFIRMADO')
-            cancelados = sum(1 for r in dados if str(r.get('status_confirmacao', '')).upper() == 'CANCELADO')
-            lembretes = sum(1 for r in dados if r.get('lembretes_enviados') and str(r.get('lembretes_enviados')).strip())
-            
+            m = self._metricas_atuais()
             return {
-                "agendados": agendados,
-                "confirmados": confirmados,
-                "cancelados": cancelados,
-                "lembretes": lembretes
+                "agendados": m['agendados'],
+                "confirmados": m['confirmados'],
+                "cancelados": m['cancelados'],
+                "lembretes": m['lembretes']
             }
         except Exception as e:
             print(f"❌ Erro ao contar métricas: {e}")
@@ -217,37 +659,83 @@ class GoogleSheetsClient:
             return []
         
         try:
-            dados = self.worksheet.get_all_records()
-            
-            agendamentos = []
-            for idx, row in enumerate(dados):
-                paciente = row.get('paciente', '')
-                if paciente and str(paciente).strip():
-                    agendamentos.append({
-                        "id": idx + 1,
-                        "paciente": str(paciente),
-                        "telefone": str(row.get('telefone', '')),
-                        "exame": str(row.get('exame', '')),
-                        "clinica": str(row.get('clinica', '')),
-                        "data": str(row.get('data', '')),
-                        "horario": str(row.get('horario', '')),
-                        "status": str(row.get('status_confirmacao', 'PENDENTE')).lower()
-                    })
-            
-            return agendamentos
+            dados = self._obter_dados()
+            return [self._item_agendamento(idx + 2, h) for idx, h in enumerate(dados) if h.paciente]
         except Exception as e:
             print(f"❌ Erro ao listar agendamentos: {e}")
             return []
     
+    @staticmethod
+    def _item_agendamento(linha, h):
+        return {
+            "id": linha - 1,
+            "paciente": h.texto('paciente'),
+            "telefone": h.texto('telefone'),
+            "exame": h.exame,
+            "clinica": h.clinica,
+            "data": h.texto('data'),
+            "horario": h.texto('horario'),
+            "status": (h.texto('status_confirmacao') or 'PENDENTE').lower()  # vazio = pendente, como no SQLite
+        }
+    
+    def buscar_agendamentos(self, filtros=None, limite=20, cursor=None):
+        """Página de agendamentos pelo índice de agendados (mais novos primeiro)"""
+        if not self.conectado:
+            return [], None
+        
+        filtros = filtros or {}
+        status = Status.de_texto(filtros['status']) if filtros.get('status') else None
+        exame = filtros.get('exame')
+        clinica = filtros.get('clinica')
+        sufixo = sufixo_telefone(filtros['telefone']) if filtros.get('telefone') else None
+        inicio = filtros.get('data_inicio')
+        fim = filtros.get('data_fim')
+        
+        chaves = []
+        if status is not None:
+            chaves.append(('status', status))
+        if exame:
+            chaves.append(('exame', exame))
+        if clinica:
+            chaves.append(('clinica', clinica))
+        if sufixo:
+            chaves.append(('telefone', sufixo))
+        
+        try:
+            with self._trava:
+                dados = self._obter_dados()
+                itens = []
+                # Percorre a lista mais curta; os outros filtros são conferidos linha a linha
+                lista = self._agendados.lista(chaves)
+                for linha in self._agendados.antes_de(lista, None if cursor is None else cursor + 1):
+                    h = dados[linha - 2]
+                    if ((status is not None and (h.status or Status.PENDENTE) is not status)
+                            or (exame and h.exame != exame)
+                            or (clinica and h.clinica != clinica)
+                            or (sufixo and h.sufixo != sufixo)
+                            or ((inicio or fim) and h.data is None)
+                            or (inicio and h.data < inicio)
+                            or (fim and h.data > fim)):
+                        continue
+                    itens.append(self._item_agendamento(linha, h))
+                    if len(itens) > limite:
+                        break
+            
+            if len(itens) > limite:
+                return itens[:limite], itens[limite - 1]["id"]
+            return itens, None
+        except Exception as e:
+            print(f"❌ Erro ao buscar agendamentos: {e}")
+            return [], None
+    
     def status_planilha(self):
         """Retorna status da planilha"""
         if not self.conectado:
             return {"carregado": False}
         
         try:
-            dados = self.worksheet.get_all_records()
-            total = len(dados)
-            disponiveis = sum(1 for r in dados if str(r.get('disponivel', '')).upper() == 'SIM')
+            m = self._metricas_atuais()
+            total, disponiveis = m['total'], m['disponiveis']
             
             return {
                 "carregado": True,
@@ -259,65 +747,52 @@ class GoogleSheetsClient:
             print(f"❌ Erro ao verificar status: {e}")
             return {"carregado": False}
     
-    def buscar_agendamentos_para_lembrete(self, dias_antecedencia):
-        """Busca agendamentos que precisam de lembrete (X dias antes)"""
+    def listar_exames(self):
+        """Especialidades distintas da planilha"""
         if not self.conectado:
             return []
+        dados = self._obter_dados()
+        return sorted({h.exame for h in dados} - {''})
+    
+    def planejar_lembretes(self, dias_lista):
+        """Lembretes devidos de todos os intervalos numa única varredura do snapshot"""
+        plano = {dias: [] for dias in dias_lista}
+        if not self.conectado:
+            return plano
         
         try:
-            from datetime import datetime, timedelta
-            
-            dados = self.worksheet.get_all_records()
-            hoje = datetime.now().date()
-            data_alvo = hoje + timedelta(days=dias_antecedencia)
+            hoje = date.today()
+            por_data = {}  # data alvo -> intervalos que vencem nela
+            for dias in dias_lista:
+                por_data.setdefault(hoje + timedelta(days=dias), []).append(dias)
             
-            agendamentos = []
-            for idx, row in enumerate(dados):
-                # Só envia lembrete se tem paciente e está CONFIRMADO ou PENDENTE
-                paciente = row.get('paciente', '')
-                status = str(row.get('status_confirmacao', '')).upper()
-                
-                if not paciente or status not in ['CONFIRMADO', 'PENDENTE']:
+            dados = self._obter_dados()
+            for idx, h in enumerate(dados):
+                # Data já convertida: sem strptime na varredura
+                intervalos = por_data.get(h.data)
+                if not intervalos:
                     continue
                 
-                # Verificar data do agendamento
-                data_str = str(row.get('data', ''))
-                try:
-                    # Tenta diferentes formatos de data
-                    for fmt in ['%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y']:
-                        try:
-                            data_agendamento = datetime.strptime(data_str, fmt).date()
-                            break
-                        except:
-                            continue
-                    else:
-                        continue
-                    
-                    # Verifica se é a data alvo
-                    if data_agendamento == data_alvo:
-                        # Verifica se já enviou esse lembrete
-                        lembretes = str(row.get('lembretes_enviados', ''))
-                        chave_lembrete = f"{dias_antecedencia}d"
-                        
-                        if chave_lembrete not in lembretes:
-                            agendamentos.append({
-                                "linha": idx + 2,
-                                "paciente": str(paciente),
-                                "telefone": str(row.get('telefone', '')),
-                                "exame": str(row.get('exame', '')),
-                                "clinica": str(row.get('clinica', '')),
-                                "data": data_str,
-                                "horario": str(row.get('horario', '')),
-                                "dias_restantes": dias_antecedencia
-                            })
-                except Exception as e:
-                    print(f"⚠️ Erro ao processar data '{data_str}': {e}")
+                # Só envia lembrete se tem paciente e está CONFIRMADO ou PENDENTE
+                if not h.paciente or h.status not in (Status.CONFIRMADO, Status.PENDENTE):
                     continue
-            
-            return agendamentos
+                
+                for dias in intervalos:
+                    if f"{dias}d" not in h.lembretes:
+                        plano[dias].append({
+                            "linha": idx + 2,
+                            "paciente": h.texto('paciente'),
+                            "telefone": h.texto('telefone'),
+                            "exame": h.exame,
+                            "clinica": h.clinica,
+                            "data": h.texto('data'),
+                            "horario": h.texto('horario'),
+                            "dias_restantes": dias
+                        })
+            return plano
         except Exception as e:
-            print(f"❌ Erro ao buscar lembretes: {e}")
-            return []
+            print(f"❌ Erro ao planejar lembretes: {e}")
+            return {dias: [] for dias in dias_lista}
     
     def marcar_lembrete_enviado(self, linha, dias_antecedencia):
         """Marca que um lembrete foi enviado"""
@@ -325,29 +800,62 @@ class GoogleSheetsClient:
             return False
         
         try:
-            cabecalho = self.worksheet.row_values(1)
-            
-            # Verificar se coluna existe, senão criar
-            if 'lembretes_enviados' not in cabecalho:
-                nova_col = len(cabecalho) + 1
-                self.worksheet.update_cell(1, nova_col, 'lembretes_enviados')
-                col_lembretes = nova_col
-            else:
-                col_lembretes = cabecalho.index('lembretes_enviados') + 1
-            
-            # Ler valor atual e adicionar novo lembrete
-            valor_atual = self.worksheet.cell(linha, col_lembretes).value or ''
-            chave = f"{dias_antecedencia}d"
-            
-            if chave not in valor_atual:
-                novo_valor = f"{valor_atual},{chave}" if valor_atual else chave
-                self.worksheet.update_cell(linha, col_lembretes, novo_valor)
-                print(f"✅ Lembrete {chave} marcado: linha {linha}")
-            
+            if self._marcar_lembretes([(linha, dias_antecedencia)], 'marcar_lembrete_enviado'):
+                print(f"✅ Lembrete {dias_antecedencia}d marcado: linha {linha}")
             return True
         except Exception as e:
             print(f"❌ Erro ao marcar lembrete: {e}")
             return False
+    
+    def marcar_lembretes_enviados(self, enviados):
+        """Marca vários lembretes [(linha, dias), ...] numa única escrita"""
+        if not self.conectado:
+            return False
+        
+        try:
+            marcadas = self._marcar_lembretes(enviados, 'marcar_lembretes_enviados')
+            if marcadas:
+                print(f"✅ Lembretes marcados: {marcadas} linha(s)")
+            return True
+        except Exception as e:
+            print(f"❌ Erro ao marcar lembretes: {e}")
+            return False
+    
+    def _marcar_lembretes(self, enviados, operacao):
+        """Acrescenta as chaves "Xd" em lembretes_enviados; retorna quantas linhas mudaram"""
+        self._iniciar_operacao(operacao)
+        celulas = []
+        
+        # Verificar se coluna existe, senão criar (no mesmo lote da escrita)
+        col_lembretes = self._colunas.get('lembretes_enviados')
+        criar_coluna = col_lembretes is None
+        if criar_coluna:
+            col_lembretes = len(self._cabecalho) + 1
+            celulas.append((1, col_lembretes, 'lembretes_enviados'))
+        
+        # Valor atual vem do snapshot (sem ler a célula na API)
+        dados = self._obter_dados()
+        novos = {}  # linha -> novo valor (uma linha pode ganhar mais de um lembrete)
+        for linha, dias in enviados:
+            idx = linha - 2
+            if linha in novos:
+                valor_atual = novos[linha]
+            else:
+                valor_atual = dados[idx].texto('lembretes_enviados') if 0 <= idx < len(dados) else ''
+            chave = f"{dias}d"
+            if chave not in valor_atual.split(','):
+                novos[linha] = f"{valor_atual},{chave}" if valor_atual else chave
+        
+        celulas.extend((linha, col_lembretes, valor) for linha, valor in novos.items())
+        if celulas:
+            self._gravar_celulas(celulas, operacao)
+            if criar_coluna:
+                self._adicionar_coluna('lembretes_enviados')
+        for linha, valor in novos.items():
+            self._atualizar_snapshot(linha, {'lembretes_enviados': valor})
+        if novos:
+            self._registrar_mudanca('lembretes', linhas=len(novos))
+        return len(novos)
 
 
 # Instância global
@@ -0,0 +1,40 @@
+"""
+🦄 Configuração do gunicorn (produção)
+Sistema SUS - Hackapel 2025
+
+Uso: gunicorn -c gunicorn.conf.py app:app
+
+Um worker por núcleo, cada um com um pool de threads (gthread): os
+streams SSE dos painéis seguram uma thread cada enquanto estão abertos.
+Orçamento de threads por worker: até EVENTOS_MAX_ASSINANTES (padrão,
+metade de GUNICORN_THREADS) ficam com os streams; o resto atende
+agendamentos, leituras e o webhook. Painel recusado recebe 503 e fica
+no polling (eventos.py).
+O estado compartilhado (agenda, fila de jobs, deduplicação do webhook,
+cache de orientações e de áudios) fica em arquivos; lembretes, espelho e
+limpeza rodam só no worker líder (processos.py).
+
+Com AGENDA_BACKEND=sheets o worker é um só: o snapshot da planilha, os
+índices e a versão ficam na memória do processo, e dois workers com
+snapshots diferentes perderiam respostas e gravariam em linha liberada.
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+if os.environ.get('AGENDA_BACKEND', 'sheets').strip().lower() != 'sqlite':
+    workers = 1  # mesmo critério de armazenamento.py: tudo que não é sqlite usa a planilha
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '64'))  # mesmo padrão de eventos.py
+timeout = 120
+graceful_timeout = 30
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    # Cada worker importa o app sozinho (sem preload): as threads de fundo
+    # e as conexões SQLite nascem depois do fork
+    from app import iniciar_servicos
+    iniciar_servicos()
@@ -0,0 +1,136 @@
+"""
+📥 Importação em massa de agendas (.xlsx / .csv)
+Sistema SUS - Hackapel 2025
+
+Lê o arquivo em streaming (openpyxl read-only / csv linha a linha) e
+grava no backend ativo em lotes, então a memória não cresce com o
+tamanho do arquivo.
+"""
+
+import csv
+import io
+import os
+import time
+
+from modelo_agenda import parse_data, parse_horario
+
+TAMANHO_LOTE = int(os.environ.get('IMPORTACAO_TAMANHO_LOTE', '5000'))
+MAX_ERROS_REPORTADOS = 20
+OBRIGATORIAS = ('clinica', 'exame', 'data', 'horario')
+# Livre só com SIM (ou vazio); grafias comuns de ocupado viram NAO, o resto é linha inválida
+DISPONIVEL_OCUPADO = {'NAO', 'NÃO', 'N', 'NO', 'OCUPADO'}
+
+
+def _texto(valor):
+    return '' if valor is None else str(valor).strip()
+
+
+def validar_registro(registro):
+    """Normaliza um horário lido do arquivo; retorna (registro, erro)"""
+    faltando = [c for c in OBRIGATORIAS if not _texto(registro.get(c))]
+    if faltando:
+        return None, f"campos vazios: {', '.join(faltando)}"
+
+    data = parse_data(registro['data'])
+    if data is None:
+        return None, f"data inválida: {registro['data']}"
+    minutos = parse_horario(registro['horario'])
+    if minutos is None:
+        return None, f"horário inválido: {registro['horario']}"
+
+    paciente = _texto(registro.get('paciente'))
+    disponivel = _texto(registro.get('disponivel')).upper() or 'SIM'
+    if disponivel != 'SIM' and disponivel not in DISPONIVEL_OCUPADO:
+        return None, f"disponivel inválido: {registro['disponivel']}"
+    return {
+        'clinica': _texto(registro['clinica']),
+        'exame': _texto(registro['exame']),
+        'data': data.strftime('%d/%m/%Y'),
+        'horario': f"{minutos // 60:02d}:{minutos % 60:02d}",
+        'disponivel': 'SIM' if disponivel == 'SIM' and not paciente else 'NAO',
+        'paciente': paciente,
+        'telefone': _texto(registro.get('telefone')),
+        'status_confirmacao': _texto(registro.get('status_confirmacao')).upper(),
+        'lembretes_enviados': _texto(registro.get('lembretes_enviados')),
+    }, None
+
+
+def ler_xlsx(arquivo):
+    """Gera dicts da primeira aba sem carregar a planilha inteira"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        linhas = wb.active.iter_rows(values_only=True)
+        cabecalho = [_texto(c).lower() for c in next(linhas, ())]
+        for valores in linhas:
+            if valores and any(v is not None and v != '' for v in valores):
+                yield dict(zip(cabecalho, valores))
+    finally:
+        wb.close()
+
+
+def ler_csv(arquivo):
+    """Gera dicts de um CSV (separador , ou ; detectado automaticamente)"""
+    texto = io.TextIOWrapper(arquivo, encoding='utf-8-sig', newline='')
+    amostra = texto.read(4096)
+    texto.seek(0)
+    try:
+        dialeto = csv.Sniffer().sniff(amostra, delimiters=',;\t')
+    except csv.Error:
+        dialeto = csv.excel
+    leitor = csv.reader(texto, dialeto)
+    cabecalho = [c.strip().lower() for c in next(leitor, [])]
+    for valores in leitor:
+        if any(v.strip() for v in valores):
+            yield dict(zip(cabecalho, valores))
+
+
+def ler_arquivo(nome_arquivo, arquivo):
+    """Escolhe o leitor pela extensão"""
+    extensao = os.path.splitext(nome_arquivo or '')[1].lower()
+    if extensao in ('.xlsx', '.xlsm'):
+        return ler_xlsx(arquivo)
+    if extensao == '.csv':
+        return ler_csv(arquivo)
+    raise ValueError(f"Formato não suportado: {extensao or 'sem extensão'} (use .xlsx ou .csv)")
+
+
+def importar(backend, registros, tamanho_lote=TAMANHO_LOTE):
+    """Valida e grava os horários em lotes; retorna o relatório da importação"""
+    inicio = time.perf_counter()
+    lidos = adicionados = duplicados = invalidos = 0
+    erros = []
+    lote = []
+
+    def gravar():
+        nonlocal adicionados, duplicados
+        inseridos, repetidos = backend.importar_registros(lote)
+        adicionados += inseridos
+        duplicados += repetidos
+        lote.clear()
+
+    for registro in registros:
+        lidos += 1
+        valido, erro = validar_registro(registro)
+        if erro:
+            invalidos += 1
+            if len(erros) < MAX_ERROS_REPORTADOS:
+                erros.append(f"linha {lidos + 1}: {erro}")  # +1 por cabeçalho
+            continue
+        lote.append(valido)
+        if len(lote) >= tamanho_lote:
+            gravar()
+    if lote:
+        gravar()
+
+    segundos = time.perf_counter() - inicio
+    return {
+        "linhas_lidas": lidos,
+        "horarios_adicionados": adicionados,
+        "horarios_duplicados": duplicados,
+        "linhas_invalidas": invalidos,
+        "erros": erros,
+        "segundos": round(segundos, 3),
+        "linhas_por_segundo": round(lidos / segundos) if segundos > 0 else lidos
+    }
@@ -0,0 +1,188 @@
+"""
+🗂️ Índices em memória da agenda
+Sistema SUS - Hackapel 2025
+"""
+
+import heapq
+from bisect import bisect_left, insort
+from datetime import date
+
+from modelo_agenda import SEM_HORARIO, Status, sufixo_telefone
+
+
+class IndiceVagas:
+    """Vagas livres por exame (e por exame + clínica), ordenadas por (data, horário)
+
+    Trabalha sobre os Horario do snapshot (modelo_agenda), que já trazem
+    data e horário convertidos.
+
+    Cada chave guarda um heap. A remoção é preguiçosa: a entrada só sai do
+    heap quando chega ao topo e a linha não está mais livre, então reservar
+    e liberar custam O(log n) e achar a próxima vaga custa O(1) amortizado.
+    """
+
+    def __init__(self):
+        self._heaps = {}
+        self._livres = {}  # linha -> entrada (data, minutos, linha)
+
+    def __len__(self):
+        return len(self._livres)
+
+    @staticmethod
+    def _entrada(linha, horario):
+        minutos = horario.minutos
+        return (horario.data or date.max, SEM_HORARIO if minutos is None else minutos, linha)
+
+    @staticmethod
+    def _chaves(horario):
+        return (horario.exame,), (horario.exame, horario.clinica)
+
+    def reconstruir(self, dados):
+        """Monta o índice do zero a partir das linhas da planilha"""
+        self._heaps = {}
+        self._livres = {}
+        for idx, row in enumerate(dados):
+            if not row.disponivel:
+                continue
+            linha = idx + 2  # +2 porque linha 1 é cabeçalho
+            entrada = self._entrada(linha, row)
+            self._livres[linha] = entrada
+            for chave in self._chaves(row):
+                self._heaps.setdefault(chave, []).append(entrada)
+        for heap in self._heaps.values():
+            heapq.heapify(heap)
+
+    def adicionar(self, linha, row):
+        """Marca a linha como livre"""
+        entrada = self._entrada(linha, row)
+        if self._livres.get(linha) == entrada:
+            return
+        self._livres[linha] = entrada
+        for chave in self._chaves(row):
+            heapq.heappush(self._heaps.setdefault(chave, []), entrada)
+
+    def remover(self, linha):
+        """Marca a linha como ocupada"""
+        self._livres.pop(linha, None)
+
+    def proxima(self, exame, clinica=None, a_partir_de=None):
+        """Linha da vaga livre mais cedo (ou None); ignora datas antes de a_partir_de"""
+        chave = (exame,) if clinica is None else (exame, clinica)
+        heap = self._heaps.get(chave)
+        while heap:
+            entrada = heap[0]
+            if self._livres.get(entrada[2]) != entrada:
+                heapq.heappop(heap)  # já reservada (entrada velha)
+                continue
+            if a_partir_de is not None and entrada[0] < a_partir_de:
+                heapq.heappop(heap)  # data passada nunca volta a valer
+                continue
+            return entrada[2]
+        return None
+
+
+class IndiceTelefones:
+    """Linhas com paciente agrupadas pelos últimos 8 dígitos do telefone
+
+    Cada grupo fica na ordem de reserva (a mais recente no fim), então a
+    resposta de um paciente só olha as poucas linhas daquele telefone.
+    """
+
+    def __init__(self):
+        self._grupos = {}  # sufixo -> {linha: None} (dict mantém a ordem)
+        self._sufixos = {}  # linha -> sufixo
+
+    def reconstruir(self, dados):
+        """Monta o índice do zero a partir das linhas da planilha"""
+        self._grupos = {}
+        self._sufixos = {}
+        for idx, row in enumerate(dados):
+            self.atualizar(idx + 2, row)
+
+    def atualizar(self, linha, row):
+        """Reindexa a linha; reservas novas vão para o fim do grupo"""
+        self.remover(linha)
+        sufixo = row.sufixo
+        if not sufixo or not row.paciente:
+            return
+        self._grupos.setdefault(sufixo, {})[linha] = None
+        self._sufixos[linha] = sufixo
+
+    def remover(self, linha):
+        sufixo = self._sufixos.pop(linha, None)
+        if sufixo is None:
+            return
+        grupo = self._grupos[sufixo]
+        grupo.pop(linha, None)
+        if not grupo:
+            del self._grupos[sufixo]
+
+    def linhas(self, telefone):
+        """Linhas do telefone, da reserva mais recente para a mais antiga"""
+        grupo = self._grupos.get(sufixo_telefone(telefone))
+        return list(reversed(grupo)) if grupo else []
+
+
+class IndiceAgendados:
+    """Linhas com paciente em listas ordenadas, no total e por status, exame,
+    clínica e telefone
+
+    A listagem paginada parte da lista mais curta entre os filtros pedidos e
+    anda para trás a partir do cursor (bisect), então o custo acompanha o
+    tamanho da página e não o histórico da agenda.
+    """
+
+    def __init__(self):
+        self._listas = {}  # chave -> [linhas em ordem crescente]
+        self._chaves_linha = {}  # linha -> chaves em que a linha está
+
+    @staticmethod
+    def _chaves(row):
+        # Agendamento sem status conta como PENDENTE (como no SQLite)
+        status = Status.PENDENTE if row.status is Status.VAZIO else row.status
+        chaves = [('todos',), ('status', status), ('exame', row.exame), ('clinica', row.clinica)]
+        if row.sufixo:
+            chaves.append(('telefone', row.sufixo))
+        return chaves
+
+    def reconstruir(self, dados):
+        """Monta o índice do zero a partir das linhas da planilha"""
+        self._listas = {}
+        self._chaves_linha = {}
+        for idx, row in enumerate(dados):
+            if not row.paciente:
+                continue
+            linha = idx + 2  # linhas em ordem: append já deixa as listas ordenadas
+            chaves = self._chaves_linha[linha] = self._chaves(row)
+            for chave in chaves:
+                self._listas.setdefault(chave, []).append(linha)
+
+    def atualizar(self, linha, row):
+        """Reindexa a linha (sai do índice se não tem mais paciente)"""
+        chaves = self._chaves(row) if row.paciente else []
+        if self._chaves_linha.get(linha, []) == chaves:
+            return
+        self.remover(linha)
+        if chaves:
+            self._chaves_linha[linha] = chaves
+            for chave in chaves:
+                insort(self._listas.setdefault(chave, []), linha)
+
+    def remover(self, linha):
+        for chave in self._chaves_linha.pop(linha, ()):
+            lista = self._listas[chave]
+            del lista[bisect_left(lista, linha)]
+            if not lista:
+                del self._listas[chave]
+
+    def lista(self, chaves):
+        """A lista mais curta entre as chaves pedidas (todas filtram o mesmo conjunto)"""
+        listas = [self._listas.get(chave, []) for chave in chaves] or [self._listas.get(('todos',), [])]
+        return min(listas, key=len)
+
+    @staticmethod
+    def antes_de(lista, linha_limite=None):
+        """Linhas da lista, da maior para a menor, abaixo de linha_limite"""
+        fim = len(lista) if linha_limite is None else bisect_left(lista, linha_limite)
+        for i in range(fim - 1, -1, -1):
+            yield lista[i]
@@ -0,0 +1,254 @@
+"""
+🧱 Modelo tipado dos horários da agenda
+Sistema SUS - Hackapel 2025
+
+Cada linha da planilha vira um Horario com __slots__: data e horário já
+convertidos (date / minutos), disponibilidade como bool, status como
+IntEnum e telefone já reduzido ao sufixo de busca. A conversão acontece
+uma vez, quando o snapshot é carregado; as consultas só comparam valores.
+
+Texto que não está no formato canônico (data em ISO, status minúsculo,
+coluna extra criada pelo operador...) fica guardado em `extras`, então o
+registro devolve exatamente o que estava na planilha.
+"""
+
+import sys
+from datetime import datetime, date
+from enum import IntEnum
+from functools import lru_cache
+
+from backend_agenda import COLUNAS_AGENDA
+
+FORMATOS_DATA = ['%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y']
+SEM_HORARIO = 24 * 60  # horários ilegíveis vão para o fim do dia
+
+
+def parse_data(valor):
+    """Converte a data da planilha (vários formatos); None se não reconhecer"""
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return _data_de_texto(str(valor).strip())
+
+
+@lru_cache(maxsize=8192)
+def _data_de_texto(texto):
+    # Datas se repetem muito na agenda: o cache devolve o mesmo objeto date
+    for fmt in FORMATOS_DATA:
+        try:
+            return datetime.strptime(texto, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_horario(valor):
+    """Converte 'HH:MM' em minutos desde 00:00; None se não reconhecer"""
+    if hasattr(valor, 'hour'):  # time/datetime vindo do Excel
+        return valor.hour * 60 + valor.minute
+    try:
+        horas, minutos = str(valor).strip().split(':')[:2]
+        return int(horas) * 60 + int(minutos)
+    except ValueError:
+        return None
+
+
+def normalizar_telefone(valor):
+    """Só os dígitos do telefone"""
+    return ''.join(filter(str.isdigit, str(valor)))
+
+
+def sufixo_telefone(valor):
+    """Últimos 8 dígitos (ignora DDI/DDD e o nono dígito)"""
+    return normalizar_telefone(valor)[-8:]
+
+
+class Status(IntEnum):
+    """status_confirmacao da agenda"""
+
+    VAZIO = 0
+    PENDENTE = 1
+    CONFIRMADO = 2
+    CANCELADO = 3
+    OUTRO = 9  # texto desconhecido (o original fica em extras)
+
+    @classmethod
+    def de_texto(cls, valor):
+        texto = str(valor).strip().upper()
+        if not texto:
+            return cls.VAZIO
+        status = cls.__members__.get(texto)
+        return status if status not in (None, cls.VAZIO, cls.OUTRO) else cls.OUTRO
+
+    @property
+    def texto(self):
+        return '' if self is Status.VAZIO else self.name
+
+
+# ==================== CONVERSÕES POR COLUNA ====================
+
+def _texto(valor):
+    return str(valor).strip()
+
+
+def _texto_repetido(valor):
+    # clínica e exame se repetem em milhares de linhas: uma string só na memória
+    return sys.intern(str(valor).strip())
+
+
+def _data(valor):
+    return parse_data(valor) if valor != '' else None
+
+
+def _data_texto(data):
+    return f"{data.day:02d}/{data.month:02d}/{data.year:04d}" if data else ''
+
+
+def _minutos(valor):
+    return parse_horario(valor) if valor != '' else None
+
+
+def _minutos_texto(minutos):
+    return f"{minutos // 60:02d}:{minutos % 60:02d}" if minutos is not None else ''
+
+
+def _lembretes(valor):
+    return tuple(sys.intern(p.strip()) for p in str(valor).split(',') if p.strip())
+
+
+def _repetido(converter, formatar):
+    """Conversão memorizada para colunas de poucos valores distintos
+
+    Devolve (valor, canônico?): datas, horários, clínicas e status se
+    repetem em milhares de linhas, então cada texto é convertido uma vez.
+    """
+    @lru_cache(maxsize=8192)
+    def converter_texto(valor):
+        convertido = converter(valor)
+        return convertido, formatar(convertido) == str(valor)
+    return converter_texto
+
+
+def _livre(valor):
+    """Conversão de texto livre (paciente, telefone): só tira espaços"""
+    texto = str(valor).strip()
+    return texto, texto == valor
+
+
+# coluna -> (atributo, texto -> valor, valor -> texto canônico)
+CAMPOS = {
+    'clinica': ('clinica', _texto_repetido, str),
+    'exame': ('exame', _texto_repetido, str),
+    'data': ('data', _data, _data_texto),
+    'horario': ('minutos', _minutos, _minutos_texto),
+    'disponivel': ('disponivel', lambda v: str(v).strip().upper() == 'SIM', lambda d: 'SIM' if d else 'NAO'),
+    'paciente': ('paciente', _texto, str),
+    'telefone': ('telefone', _texto, str),
+    'status_confirmacao': ('status', Status.de_texto, lambda s: s.texto),
+    'lembretes_enviados': ('lembretes', _lembretes, ','.join),
+}
+
+# coluna -> (atributo, valor -> (convertido, canônico?))
+CONVERSORES = {
+    coluna: (atributo, _livre if coluna in ('paciente', 'telefone') else _repetido(converter, formatar))
+    for coluna, (atributo, converter, formatar) in CAMPOS.items()
+}
+
+
+class Horario:
+    """Uma linha da agenda, com os campos já convertidos"""
+
+    __slots__ = ('clinica', 'exame', 'data', 'minutos', 'disponivel', 'paciente',
+                 'telefone', 'sufixo', 'status', 'lembretes', 'extras')
+
+    def __init__(self):
+        self.clinica = self.exame = self.paciente = self.telefone = self.sufixo = ''
+        self.data = None
+        self.minutos = None
+        self.disponivel = False
+        self.status = Status.VAZIO
+        self.lembretes = ()
+        self.extras = None  # {coluna: texto original} só quando necessário
+
+    @classmethod
+    def de_valores(cls, colunas, valores):
+        """Horario a partir de uma linha crua da planilha (valores na ordem de `colunas`)"""
+        # Mesmo que definir() em cada coluna, com o laço enxuto: roda por célula
+        horario = cls()
+        for coluna, valor in zip(colunas, valores):
+            conversor = CONVERSORES.get(coluna)
+            if conversor is None:
+                if coluna and valor != '':
+                    horario._extra(coluna, valor)
+                continue
+            convertido, canonico = conversor[1](valor)
+            setattr(horario, conversor[0], convertido)
+            if not canonico:
+                horario._extra(coluna, valor)
+        if horario.telefone:
+            horario.sufixo = sufixo_telefone(horario.telefone)
+        return horario
+
+    @classmethod
+    def de_dict(cls, registro):
+        horario = cls()
+        for coluna, valor in registro.items():
+            horario.definir(coluna, valor)
+        return horario
+
+    def definir(self, coluna, valor):
+        """Converte e grava uma coluna"""
+        valor = '' if valor is None else valor
+        conversor = CONVERSORES.get(coluna)
+        if conversor is None:
+            self._extra(coluna, valor if valor != '' else None)
+            return
+
+        atributo, converter = conversor
+        convertido, canonico = converter(valor)
+        setattr(self, atributo, convertido)
+        if coluna == 'telefone':
+            self.sufixo = sufixo_telefone(convertido)
+        # Guarda o original só se o texto canônico não o reproduz
+        if not canonico:
+            self._extra(coluna, valor)
+        elif self.extras is not None:
+            self._extra(coluna, None)
+
+    def _extra(self, coluna, valor):
+        if valor is not None:
+            if self.extras is None:
+                self.extras = {}
+            self.extras[coluna] = valor
+        elif self.extras and coluna in self.extras:
+            del self.extras[coluna]
+            if not self.extras:
+                self.extras = None
+
+    def atualizar(self, valores):
+        """Aplica uma escrita {coluna: valor}"""
+        for coluna, valor in valores.items():
+            self.definir(coluna, valor)
+
+    def texto(self, coluna):
+        """Valor da coluna como aparece na planilha"""
+        if self.extras and coluna in self.extras:
+            return self.extras[coluna]
+        campo = CAMPOS.get(coluna)
+        if campo is None:
+            return ''
+        atributo, _, formatar = campo
+        return formatar(getattr(self, atributo))
+
+    def chave(self):
+        """Identidade do horário (repetidos na importação)"""
+        return (self.clinica, self.exame,
+                self.data or self.texto('data'),
+                self.minutos if self.minutos is not None else self.texto('horario'))
+
+    def para_dict(self, colunas=None):
+        """Registro no formato da planilha (só as `colunas` pedidas, se informadas)"""
+        if colunas is None:
+            colunas = COLUNAS_AGENDA + [c for c in (self.extras or ()) if c not in CAMPOS]
+        return {coluna: self.texto(coluna) for coluna in colunas if coluna}
@@ -0,0 +1,141 @@
+"""
+👑 Coordenação entre os processos do servidor
+Sistema SUS - Hackapel 2025
+
+Com vários workers (gunicorn), o que não pode rodar em dobro fica com um
+único processo líder: scheduler de lembretes, espelho da planilha e
+limpeza de áudios. A liderança é um flock num arquivo: o sistema
+operacional solta a trava quando o processo morre e os outros tentam
+pegá-la a cada LIDERANCA_INTERVALO segundos, então um deles assume.
+
+As mesmas travas de arquivo servem para seções que não podem rodar ao
+mesmo tempo em dois processos (um disparo de lembretes, as respostas de
+um mesmo telefone).
+"""
+
+import os
+import threading
+import time
+import zlib
+from contextlib import ExitStack, contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem flock, o processo se considera o único
+    fcntl = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TRAVAS_DIR = os.environ.get('TRAVAS_DIR', os.path.join(BASE_DIR, 'travas'))
+LIDERANCA_INTERVALO = float(os.environ.get('LIDERANCA_INTERVALO', '10'))
+TRAVAS_LISTRAS = 64  # arquivos de trava por grupo (chaves diferentes dividem listras)
+
+
+def _abrir_trava(nome):
+    os.makedirs(TRAVAS_DIR, exist_ok=True)
+    return open(os.path.join(TRAVAS_DIR, f"{nome}.lock"), 'a+')
+
+
+@contextmanager
+def trava_entre_processos(nome, bloquear=True):
+    """Seção exclusiva entre processos; devolve False se `bloquear=False` e estava ocupada"""
+    if fcntl is None:
+        yield True
+        return
+    arquivo = _abrir_trava(nome)
+    try:
+        try:
+            fcntl.flock(arquivo, fcntl.LOCK_EX | (0 if bloquear else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(arquivo, fcntl.LOCK_UN)
+    finally:
+        arquivo.close()
+
+
+def _listra(chave):
+    return zlib.crc32(str(chave).encode('utf-8')) % TRAVAS_LISTRAS  # hash() muda entre processos
+
+
+def trava_por_chave(grupo, chave):
+    """Trava entre processos de uma chave (ex.: telefone), espalhada em TRAVAS_LISTRAS arquivos"""
+    return trava_entre_processos(f"{grupo}-{_listra(chave):02d}")
+
+
+@contextmanager
+def travas_por_chaves(grupo, chaves):
+    """Trava várias chaves de uma vez; as listras são pegas em ordem (sem deadlock entre processos)"""
+    with ExitStack() as pilha:
+        for listra in sorted({_listra(chave) for chave in chaves}):
+            pilha.enter_context(trava_entre_processos(f"{grupo}-{listra:02d}"))
+        yield
+
+
+class Lideranca:
+    """Eleição de um processo líder por flock, com troca automática se ele morrer"""
+
+    def __init__(self, nome='lider', intervalo=LIDERANCA_INTERVALO):
+        self.nome = nome
+        self.intervalo = intervalo
+        self.lider = False
+        self.assumiu_em = None
+        self.tentativas = 0
+        self._arquivo = None  # aberto enquanto for líder: fechar solta a liderança
+        self._thread = None
+
+    def _tentar(self):
+        if fcntl is None:
+            return True
+        arquivo = _abrir_trava(self.nome)
+        try:
+            fcntl.flock(arquivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            arquivo.close()
+            return False
+        arquivo.seek(0)
+        arquivo.truncate()
+        arquivo.write(f"{os.getpid()}\n")  # só informativo: quem é o líder agora
+        arquivo.flush()
+        self._arquivo = arquivo
+        return True
+
+    def iniciar(self, ao_assumir):
+        """Disputa a liderança em segundo plano; ao_assumir() roda no processo que ganhar"""
+        if self._thread:
+            return self._thread
+
+        def loop_lideranca():
+            while True:
+                self.tentativas += 1
+                try:
+                    ganhou = self._tentar()
+                except OSError as e:
+                    print(f"❌ Erro ao disputar liderança: {e}")
+                    ganhou = False
+                if ganhou:
+                    self.lider = True
+                    self.assumiu_em = time.time()
+                    print(f"👑 Processo {os.getpid()} é o líder (lembretes, espelho, limpeza)")
+                    try:
+                        ao_assumir()
+                    except Exception as e:
+                        print(f"❌ Erro ao iniciar tarefas do líder: {e}")
+                    return
+                time.sleep(self.intervalo)
+
+        self._thread = threading.Thread(target=loop_lideranca, name='lideranca', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def estatisticas(self):
+        return {
+            "pid": os.getpid(),
+            "lider": self.lider,
+            "assumiu_em": self.assumiu_em,
+            "tentativas": self.tentativas,
+            "flock": fcntl is not None
+        }
@@ -0,0 +1,109 @@
+"""
+🏷️ Respostas de leitura com ETag pela versão dos dados
+Sistema SUS - Hackapel 2025
+
+Cada escrita na agenda aumenta um número de versão. As rotas de leitura
+decoradas com @respostas.versionada() usam essa versão como ETag: se o
+navegador já tem a versão atual (If-None-Match), a resposta é um 304 sem
+consultar o armazenamento. Quando precisa montar o JSON, o corpo (e a
+versão gzip) fica guardado para os próximos pedidos da mesma versão.
+"""
+
+import gzip
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, request
+
+RESPOSTAS_CACHE_MAX = 128  # corpos guardados (rota + parâmetros + versão)
+RESPOSTAS_GZIP_MINIMO = 512  # bytes; abaixo disso comprimir não compensa
+
+
+class RespostasVersionadas:
+    """Decorador de rotas JSON com ETag, 304 e cache do corpo comprimido
+
+    `versao()` devolve a versão atual dos dados. A rota decorada devolve
+    os dados (dict/list); um Response ou tupla (erro de parâmetro, por
+    exemplo) passa direto, sem ETag nem cache.
+    """
+
+    def __init__(self, versao, origem=None, max_entradas=RESPOSTAS_CACHE_MAX, gzip_minimo=RESPOSTAS_GZIP_MINIMO):
+        self.versao = versao
+        self.max_entradas = max_entradas
+        self.gzip_minimo = gzip_minimo
+        # `origem` identifica uma versão compartilhada entre processos (ETag vale em qualquer
+        # worker); sem ela a versão recomeça a cada boot e um id aleatório evita ETag antiga
+        self.instancia = origem or uuid.uuid4().hex[:8]
+        self._cache = OrderedDict()  # (rota, query, etag) -> (corpo, corpo_gzip)
+        self._trava = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.nao_modificados = 0
+
+    def _montar(self, dados):
+        corpo = json.dumps(dados, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        comprimido = gzip.compress(corpo, compresslevel=6) if len(corpo) >= self.gzip_minimo else None
+        return corpo, comprimido
+
+    def versionada(self, extra=None):
+        """Decora uma rota de leitura; `extra()` entra na ETag (ex.: a data, para o que depende de hoje)"""
+        def decorador(rota):
+            @wraps(rota)
+            def envoltorio(*args, **kwargs):
+                etag = f"{self.instancia}-{self.versao()}"
+                if extra is not None:
+                    etag = f"{etag}-{extra()}"
+
+                if etag in request.if_none_match:
+                    with self._trava:
+                        self.nao_modificados += 1
+                    resposta = Response(status=304)
+                    resposta.set_etag(etag)
+                    resposta.headers['Cache-Control'] = 'no-cache'
+                    return resposta
+
+                chave = (request.endpoint, request.query_string, etag)
+                with self._trava:
+                    entrada = self._cache.get(chave)
+                    if entrada is not None:
+                        self._cache.move_to_end(chave)
+                        self.hits += 1
+                if entrada is None:
+                    dados = rota(*args, **kwargs)
+                    if isinstance(dados, (Response, tuple)):
+                        return dados
+                    # A versão foi lida antes: no pior caso o corpo é mais novo que a ETag
+                    entrada = self._montar(dados)
+                    with self._trava:
+                        self.misses += 1
+                        self._cache[chave] = entrada
+                        while len(self._cache) > self.max_entradas:
+                            self._cache.popitem(last=False)
+
+                corpo, comprimido = entrada
+                resposta = Response(mimetype='application/json')
+                if comprimido is not None and 'gzip' in request.accept_encodings:
+                    resposta.set_data(comprimido)
+                    resposta.headers['Content-Encoding'] = 'gzip'
+                else:
+                    resposta.set_data(corpo)
+                resposta.vary.add('Accept-Encoding')
+                resposta.set_etag(etag)
+                resposta.headers['Cache-Control'] = 'no-cache'  # sempre revalida (barato: 304)
+                return resposta
+            return envoltorio
+        return decorador
+
+    def estatisticas(self):
+        versao = self.versao()
+        with self._trava:
+            return {
+                "versao": versao,
+                "entradas": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "nao_modificados": self.nao_modificados
+            }
@@ -0,0 +1,136 @@
+"""
+🧹 Retenção dos áudios gerados (static/audios)
+Sistema SUS - Hackapel 2025
+
+O diretório tem um orçamento de bytes e uma idade máxima. A "idade" de um
+arquivo é o mtime, que o cache de TTS renova a cada reuso, então a
+remoção segue LRU. Arquivos usados há menos que a carência nunca são
+apagados: a Evolution API pode ainda estar baixando a URL.
+"""
+
+import os
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+AUDIO_DIR = os.path.join(BASE_DIR, 'static', 'audios')
+
+AUDIO_ORCAMENTO_MB = float(os.environ.get('AUDIO_ORCAMENTO_MB', '500'))
+AUDIO_IDADE_MAXIMA_HORAS = float(os.environ.get('AUDIO_IDADE_MAXIMA_HORAS', '168'))
+AUDIO_CARENCIA_MINUTOS = float(os.environ.get('AUDIO_CARENCIA_MINUTOS', '30'))
+AUDIO_INTERVALO_LIMPEZA = int(os.environ.get('AUDIO_INTERVALO_LIMPEZA', '600'))
+
+EXTENSOES = ('.mp3', '.tmp')
+
+
+class GerenciadorRetencao:
+    """Remove áudios velhos e, acima do orçamento, os menos usados primeiro"""
+
+    def __init__(self, diretorio=AUDIO_DIR,
+                 orcamento_bytes=int(AUDIO_ORCAMENTO_MB * 1024 * 1024),
+                 idade_maxima=AUDIO_IDADE_MAXIMA_HORAS * 3600,
+                 carencia=AUDIO_CARENCIA_MINUTOS * 60,
+                 intervalo=AUDIO_INTERVALO_LIMPEZA):
+        self.diretorio = diretorio
+        self.orcamento_bytes = orcamento_bytes
+        self.idade_maxima = idade_maxima
+        self.carencia = carencia
+        self.intervalo = intervalo
+        self._trava = threading.Lock()
+        self._thread = None
+        self.execucoes = 0
+        self.arquivos_removidos = 0
+        self.bytes_removidos = 0
+        self.arquivos_atuais = 0
+        self.bytes_atuais = 0
+        self.ultima_execucao = None
+
+    def _listar(self):
+        arquivos = []
+        with os.scandir(self.diretorio) as entradas:
+            for entrada in entradas:
+                if entrada.is_file() and entrada.name.endswith(EXTENSOES):
+                    info = entrada.stat()
+                    arquivos.append((info.st_mtime, info.st_size, entrada.path))
+        return arquivos
+
+    def _remover(self, path, limite_uso):
+        """Apaga o arquivo se ele não foi usado desde limite_uso; retorna bytes liberados"""
+        try:
+            info = os.stat(path)
+            if info.st_mtime > limite_uso:
+                return 0  # reusado enquanto a limpeza rodava
+            os.remove(path)
+            return info.st_size
+        except FileNotFoundError:
+            return 0
+
+    def executar(self):
+        """Uma passada de limpeza; retorna (arquivos, bytes) removidos"""
+        with self._trava:
+            agora = time.time()
+            limite_carencia = agora - self.carencia
+            limite_idade = agora - self.idade_maxima
+
+            arquivos = sorted(self._listar())  # mais antigo (menos usado) primeiro
+            total = sum(tamanho for _, tamanho, _ in arquivos)
+            removidos = liberados = 0
+
+            for mtime, tamanho, path in arquivos:
+                if mtime > limite_carencia:
+                    break  # daqui pra frente tudo foi usado há pouco
+                if mtime > limite_idade and total <= self.orcamento_bytes:
+                    break  # nem velho nem acima do orçamento
+                bytes_arquivo = self._remover(path, limite_carencia)
+                if bytes_arquivo:
+                    removidos += 1
+                    liberados += bytes_arquivo
+                    total -= bytes_arquivo
+
+            self.execucoes += 1
+            self.arquivos_removidos += removidos
+            self.bytes_removidos += liberados
+            self.arquivos_atuais = len(arquivos) - removidos
+            self.bytes_atuais = total
+            self.ultima_execucao = agora
+
+        if removidos:
+            print(f"🧹 Áudios: {removidos} arquivos removidos ({liberados / 1024 / 1024:.1f} MB)")
+        if total > self.orcamento_bytes:
+            print(f"⚠️ Áudios acima do orçamento ({total / 1024 / 1024:.1f} MB), todos ainda em carência")
+        return removidos, liberados
+
+    def iniciar(self):
+        """Roda a limpeza periodicamente numa thread daemon"""
+        if self._thread:
+            return self._thread
+
+        def loop_retencao():
+            while True:
+                try:
+                    self.executar()
+                except Exception as e:
+                    print(f"❌ Erro na limpeza de áudios: {e}")
+                time.sleep(self.intervalo)
+
+        self._thread = threading.Thread(target=loop_retencao, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def estatisticas(self):
+        with self._trava:
+            return {
+                "orcamento_bytes": self.orcamento_bytes,
+                "idade_maxima_horas": round(self.idade_maxima / 3600, 1),
+                "carencia_minutos": round(self.carencia / 60, 1),
+                "arquivos_atuais": self.arquivos_atuais,
+                "bytes_atuais": self.bytes_atuais,
+                "arquivos_removidos": self.arquivos_removidos,
+                "bytes_removidos": self.bytes_removidos,
+                "execucoes": self.execucoes,
+                "ultima_execucao": self.ultima_execucao
+            }
+
+
+# Instância global
+retencao = GerenciadorRetencao()
@@ -0,0 +1,662 @@
+"""
+🗃️ Backend SQLite da agenda
+Sistema SUS - Hackapel 2025
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from backend_agenda import BackendAgenda
+from modelo_agenda import parse_data, parse_horario, sufixo_telefone
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS horarios (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    clinica TEXT NOT NULL,
+    exame TEXT NOT NULL,
+    data TEXT NOT NULL,                 -- aaaa-mm-dd (ordena como texto)
+    horario TEXT NOT NULL,              -- HH:MM
+    disponivel INTEGER NOT NULL DEFAULT 1,
+    paciente TEXT NOT NULL DEFAULT '',
+    telefone TEXT NOT NULL DEFAULT '',
+    telefone_sufixo TEXT NOT NULL DEFAULT '',
+    status_confirmacao TEXT NOT NULL DEFAULT '',
+    lembretes_enviados TEXT NOT NULL DEFAULT '',
+    reservado_em REAL,
+    UNIQUE (clinica, exame, data, horario)
+);
+CREATE INDEX IF NOT EXISTS idx_vagas ON horarios (exame, disponivel, data, horario);
+CREATE INDEX IF NOT EXISTS idx_vagas_clinica ON horarios (exame, clinica, disponivel, data, horario);
+CREATE INDEX IF NOT EXISTS idx_telefone ON horarios (telefone_sufixo, reservado_em);
+CREATE INDEX IF NOT EXISTS idx_data ON horarios (data);
+
+-- Listagem paginada de agendamentos: índices parciais, só com as linhas que têm paciente
+CREATE INDEX IF NOT EXISTS idx_agendados ON horarios (id) WHERE paciente != '';
+CREATE INDEX IF NOT EXISTS idx_agendados_status ON horarios (status_confirmacao, id) WHERE paciente != '';
+CREATE INDEX IF NOT EXISTS idx_agendados_exame ON horarios (exame, id) WHERE paciente != '';
+CREATE INDEX IF NOT EXISTS idx_agendados_clinica ON horarios (clinica, id) WHERE paciente != '';
+CREATE INDEX IF NOT EXISTS idx_agendados_telefone ON horarios (telefone_sufixo, id) WHERE paciente != '';
+
+-- Contadores do painel, mantidos por trigger a cada escrita em horarios
+CREATE TABLE IF NOT EXISTS metricas (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total INTEGER NOT NULL DEFAULT 0,
+    disponiveis INTEGER NOT NULL DEFAULT 0,
+    agendados INTEGER NOT NULL DEFAULT 0,
+    confirmados INTEGER NOT NULL DEFAULT 0,
+    cancelados INTEGER NOT NULL DEFAULT 0,
+    lembretes INTEGER NOT NULL DEFAULT 0,
+    versao INTEGER NOT NULL DEFAULT 0,  -- +1 a cada escrita, visto por todos os processos
+    origem TEXT NOT NULL DEFAULT ''     -- id do arquivo (a versão recomeça se ele for recriado)
+);
+INSERT OR IGNORE INTO metricas (id) VALUES (1);
+UPDATE metricas SET origem = lower(hex(randomblob(4))) WHERE origem = '';
+CREATE TRIGGER IF NOT EXISTS metricas_insert AFTER INSERT ON horarios BEGIN
+    UPDATE metricas SET
+        total = total + 1,
+        disponiveis = disponiveis + NEW.disponivel,
+        agendados = agendados + (NEW.paciente != ''),
+        confirmados = confirmados + (NEW.status_confirmacao = 'CONFIRMADO'),
+        cancelados = cancelados + (NEW.status_confirmacao = 'CANCELADO'),
+        lembretes = lembretes + (NEW.lembretes_enviados != ''),
+        versao = versao + 1
+    WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS metricas_delete AFTER DELETE ON horarios BEGIN
+    UPDATE metricas SET
+        total = total - 1,
+        disponiveis = disponiveis - OLD.disponivel,
+        agendados = agendados - (OLD.paciente != ''),
+        confirmados = confirmados - (OLD.status_confirmacao = 'CONFIRMADO'),
+        cancelados = cancelados - (OLD.status_confirmacao = 'CANCELADO'),
+        lembretes = lembretes - (OLD.lembretes_enviados != ''),
+        versao = versao + 1
+    WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS metricas_update
+AFTER UPDATE OF disponivel, paciente, status_confirmacao, lembretes_enviados ON horarios BEGIN
+    UPDATE metricas SET
+        disponiveis = disponiveis - OLD.disponivel + NEW.disponivel,
+        agendados = agendados - (OLD.paciente != '') + (NEW.paciente != ''),
+        confirmados = confirmados - (OLD.status_confirmacao = 'CONFIRMADO') + (NEW.status_confirmacao = 'CONFIRMADO'),
+        cancelados = cancelados - (OLD.status_confirmacao = 'CANCELADO') + (NEW.status_confirmacao = 'CANCELADO'),
+        lembretes = lembretes - (OLD.lembretes_enviados != '') + (NEW.lembretes_enviados != ''),
+        versao = versao + 1
+    WHERE id = 1;
+END;
+"""
+
+
+def _data_iso(valor):
+    """dd/mm/aaaa (ou outro formato aceito) -> aaaa-mm-dd"""
+    data = valor if isinstance(valor, date) else parse_data(valor)
+    return data.isoformat() if data else str(valor).strip()
+
+
+def _data_br(valor):
+    """aaaa-mm-dd -> dd/mm/aaaa (como na planilha)"""
+    try:
+        return date.fromisoformat(valor).strftime('%d/%m/%Y')
+    except ValueError:
+        return valor
+
+
+def _horario(valor):
+    """Normaliza para HH:MM com zero à esquerda"""
+    minutos = parse_horario(valor)
+    if minutos is None:
+        return str(valor).strip()
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+
+class SQLiteAgenda(BackendAgenda):
+    """Agenda em um arquivo SQLite local (sem rede)
+
+    Usa WAL e índices por exame/data/disponibilidade/telefone, então as
+    consultas do dia a dia não dependem do tamanho da agenda.
+    """
+
+    nome = 'sqlite'
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._pool = queue.LifoQueue()
+        # O SQLite tem um escritor por vez: neste processo a fila é uma trava (a vez passa
+        # na hora); o busy timeout, que espera dormindo, fica só para outros processos
+        self._trava_escrita = threading.Lock()
+        self.conectado = False
+        try:
+            pasta = os.path.dirname(os.path.abspath(caminho))
+            os.makedirs(pasta, exist_ok=True)
+            with self._conexao() as con:
+                self._migrar(con)
+                con.executescript(ESQUEMA)
+                self.origem_versao = f"sqlite-{con.execute('SELECT origem FROM metricas WHERE id = 1').fetchone()[0]}"
+            self._reconciliar_metricas()
+            self.conectado = True
+            print(f"✅ SQLite conectado: {caminho}")
+        except Exception as e:
+            print(f"❌ Erro ao abrir SQLite: {e}")
+
+    # ==================== CONEXÕES ====================
+
+    def _nova_conexao(self):
+        con = sqlite3.connect(self.caminho, timeout=30, isolation_level=None, check_same_thread=False)
+        con.row_factory = sqlite3.Row
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('PRAGMA synchronous=NORMAL')
+        return con
+
+    @contextmanager
+    def _conexao(self):
+        """Empresta uma conexão do pool (cada thread do Flask usa uma por vez)"""
+        try:
+            con = self._pool.get_nowait()
+        except queue.Empty:
+            con = self._nova_conexao()
+        try:
+            yield con
+        finally:
+            self._pool.put(con)
+
+    @contextmanager
+    def _escrita(self):
+        """Conexão para uma escrita, com a vez de escrever neste processo"""
+        with self._trava_escrita, self._conexao() as con:
+            yield con
+
+    @contextmanager
+    def _transacao(self):
+        """Transação de escrita (BEGIN IMMEDIATE evita deadlock entre escritores)"""
+        with self._escrita() as con:
+            con.execute('BEGIN IMMEDIATE')
+            try:
+                yield con
+                con.execute('COMMIT')
+            except Exception:
+                con.execute('ROLLBACK')
+                raise
+
+    @staticmethod
+    def _migrar(con):
+        """Arquivos criados antes da coluna versao: recria os triggers de métricas"""
+        colunas = [r[1] for r in con.execute('PRAGMA table_info(metricas)')]
+        if colunas and 'versao' not in colunas:
+            con.executescript("""
+                ALTER TABLE metricas ADD COLUMN versao INTEGER NOT NULL DEFAULT 0;
+                ALTER TABLE metricas ADD COLUMN origem TEXT NOT NULL DEFAULT '';
+                DROP TRIGGER IF EXISTS metricas_insert;
+                DROP TRIGGER IF EXISTS metricas_delete;
+                DROP TRIGGER IF EXISTS metricas_update;
+            """)
+
+    def versao_dados(self):
+        """Versão mantida pelos triggers: inclui escritas de outros processos"""
+        try:
+            with self._conexao() as con:
+                return con.execute('SELECT versao FROM metricas WHERE id = 1').fetchone()[0]
+        except Exception as e:
+            print(f"❌ Erro ao ler versão da agenda: {e}")
+            return self._versao
+
+    def _reconciliar_metricas(self):
+        """Recalcula os contadores do zero (na abertura; os triggers mantêm depois)"""
+        with self._transacao() as con:
+            con.execute(
+                """UPDATE metricas SET
+                     (total, disponiveis, agendados, confirmados, cancelados, lembretes) = (
+                       SELECT COUNT(*),
+                              COALESCE(SUM(disponivel), 0),
+                              COALESCE(SUM(paciente != ''), 0),
+                              COALESCE(SUM(status_confirmacao = 'CONFIRMADO'), 0),
+                              COALESCE(SUM(status_confirmacao = 'CANCELADO'), 0),
+                              COALESCE(SUM(lembretes_enviados != ''), 0)
+                       FROM horarios)
+                   WHERE id = 1"""
+            )
+
+    def _metricas(self):
+        with self._conexao() as con:
+            return con.execute('SELECT * FROM metricas WHERE id = 1').fetchone()
+
+    @staticmethod
+    def _registro(row):
+        """Linha do SQLite -> dict no formato da planilha"""
+        return {
+            'clinica': row['clinica'],
+            'exame': row['exame'],
+            'data': _data_br(row['data']),
+            'horario': row['horario'],
+            'disponivel': 'SIM' if row['disponivel'] else 'NAO',
+            'paciente': row['paciente'],
+            'telefone': row['telefone'],
+            'status_confirmacao': row['status_confirmacao'],
+            'lembretes_enviados': row['lembretes_enviados'],
+        }
+
+    # ==================== CARGA ====================
+
+    def importar_registros(self, registros):
+        """Insere horários (dicts no formato da planilha); repetidos são ignorados
+
+        Retorna (inseridos, duplicados).
+        """
+        valores = []
+        for r in registros:
+            telefone = str(r.get('telefone', '') or '')
+            paciente = str(r.get('paciente', '') or '')
+            valores.append((
+                str(r.get('clinica', '')).strip(),
+                str(r.get('exame', '')).strip(),
+                _data_iso(r.get('data', '')),
+                _horario(r.get('horario', '')),
+                # Livre só com 'SIM', como no modelo_agenda (vazio, 'N', 'NÃO' = ocupado)
+                1 if str(r.get('disponivel', '')).strip().upper() == 'SIM' else 0,
+                paciente,
+                telefone,
+                sufixo_telefone(telefone) if paciente else '',
+                str(r.get('status_confirmacao', '') or '').upper(),
+                str(r.get('lembretes_enviados', '') or ''),
+                time.time() if paciente else None,
+            ))
+
+        with self._transacao() as con:
+            # total_changes contaria também os triggers de métricas
+            antes = con.execute('SELECT total FROM metricas WHERE id = 1').fetchone()[0]
+            con.executemany(
+                """INSERT OR IGNORE INTO horarios
+                   (clinica, exame, data, horario, disponivel, paciente, telefone,
+                    telefone_sufixo, status_confirmacao, lembretes_enviados, reservado_em)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                valores
+            )
+            inseridos = con.execute('SELECT total FROM metricas WHERE id = 1').fetchone()[0] - antes
+        if inseridos:
+            self._registrar_mudanca('importacao', inseridos=inseridos)
+        return inseridos, len(valores) - inseridos
+
+    def limpar_horarios(self):
+        """Remove os horários livres (agendamentos são mantidos)"""
+        with self._transacao() as con:
+            removidos = con.execute('DELETE FROM horarios WHERE disponivel = 1').rowcount
+        print(f"🧹 {removidos} horários livres removidos")
+        if removidos:
+            self._registrar_mudanca('limpeza', removidos=removidos)
+        return removidos
+
+    def total_horarios(self):
+        return self._metricas()['total']
+
+    # ==================== CONSULTAS ====================
+
+    def carregar_dados(self):
+        """Carrega todos os horários"""
+        if not self.conectado:
+            return None
+        with self._conexao() as con:
+            return [self._registro(r) for r in con.execute('SELECT * FROM horarios ORDER BY id')]
+
+    @staticmethod
+    def _consulta_vagas(exame, clinica, limite):
+        """SQL das `limite` vagas livres mais cedo de um exame (a partir de hoje)"""
+        sql = 'SELECT * FROM horarios WHERE exame = ? AND disponivel = 1 AND data >= ?'
+        params = [exame, date.today().isoformat()]
+        if clinica is not None:
+            sql += ' AND clinica = ?'
+            params.append(clinica)
+        return sql + ' ORDER BY data, horario LIMIT ?', params + [limite]
+
+    def buscar_vaga(self, exame, clinica=None):
+        """Busca a vaga disponível mais cedo (data, horário) para um exame"""
+        if not self.conectado:
+            return None, None
+        try:
+            with self._conexao() as con:
+                row = con.execute(*self._consulta_vagas(exame, clinica, 1)).fetchone()
+            return (row['id'], self._registro(row)) if row else (None, None)
+        except Exception as e:
+            print(f"❌ Erro ao buscar vaga: {e}")
+            return None, None
+
+    def buscar_por_telefone(self, telefone):
+        """Busca a reserva PENDENTE mais recente do telefone (últimos 8 dígitos)"""
+        if not self.conectado:
+            return None, None
+        sufixo = sufixo_telefone(telefone)
+        if not sufixo:
+            return None, None
+        try:
+            with self._conexao() as con:
+                row = con.execute(
+                    """SELECT * FROM horarios WHERE telefone_sufixo = ? AND paciente != ''
+                       ORDER BY status_confirmacao = 'PENDENTE' DESC, reservado_em DESC, id DESC
+                       LIMIT 1""",
+                    (sufixo,)
+                ).fetchone()
+            return (row['id'], self._registro(row)) if row else (None, None)
+        except Exception as e:
+            print(f"❌ Erro ao buscar telefone: {e}")
+            return None, None
+
+    def contar_metricas(self):
+        """Conta métricas da agenda"""
+        vazio = {"agendados": 0, "confirmados": 0, "cancelados": 0, "lembretes": 0}
+        if not self.conectado:
+            return vazio
+        try:
+            m = self._metricas()
+            return {
+                "agendados": m['agendados'],
+                "confirmados": m['confirmados'],
+                "cancelados": m['cancelados'],
+                "lembretes": m['lembretes']
+            }
+        except Exception as e:
+            print(f"❌ Erro ao contar métricas: {e}")
+            return vazio
+
+    def listar_agendamentos(self):
+        """Lista agendamentos com paciente"""
+        if not self.conectado:
+            return []
+        try:
+            with self._conexao() as con:
+                rows = con.execute("SELECT * FROM horarios WHERE paciente != '' ORDER BY id").fetchall()
+            return [self._item_agendamento(r) for r in rows]
+        except Exception as e:
+            print(f"❌ Erro ao listar agendamentos: {e}")
+            return []
+
+    @staticmethod
+    def _item_agendamento(r):
+        return {
+            "id": r['id'],
+            "paciente": r['paciente'],
+            "telefone": r['telefone'],
+            "exame": r['exame'],
+            "clinica": r['clinica'],
+            "data": _data_br(r['data']),
+            "horario": r['horario'],
+            "status": (r['status_confirmacao'] or 'PENDENTE').lower()
+        }
+
+    def buscar_agendamentos(self, filtros=None, limite=20, cursor=None):
+        """Página de agendamentos por keyset (id < cursor) nos índices parciais"""
+        if not self.conectado:
+            return [], None
+
+        filtros = filtros or {}
+        condicoes = ["paciente != ''"]  # literal: é o que habilita os índices parciais
+        params = []
+        if cursor is not None:
+            condicoes.append('id < ?')
+            params.append(cursor)
+        status = str(filtros.get('status') or '').upper()
+        if status:
+            # status vazio aparece como pendente na listagem
+            condicoes.append("status_confirmacao IN (?, '')" if status == 'PENDENTE' else 'status_confirmacao = ?')
+            params.append(status)
+        for coluna in ('exame', 'clinica'):
+            if filtros.get(coluna):
+                condicoes.append(f'{coluna} = ?')
+                params.append(filtros[coluna])
+        if filtros.get('telefone'):
+            condicoes.append('telefone_sufixo = ?')
+            params.append(sufixo_telefone(filtros['telefone']))
+        if filtros.get('data_inicio'):
+            condicoes.append('data >= ?')
+            params.append(filtros['data_inicio'].isoformat())
+        if filtros.get('data_fim'):
+            condicoes.append('data <= ?')
+            params.append(filtros['data_fim'].isoformat())
+
+        try:
+            with self._conexao() as con:
+                rows = con.execute(
+                    f"SELECT * FROM horarios WHERE {' AND '.join(condicoes)} ORDER BY id DESC LIMIT ?",
+                    (*params, limite + 1)
+                ).fetchall()
+            itens = [self._item_agendamento(r) for r in rows[:limite]]
+            return itens, (itens[-1]["id"] if len(rows) > limite else None)
+        except Exception as e:
+            print(f"❌ Erro ao buscar agendamentos: {e}")
+            return [], None
+
+    def status_planilha(self):
+        """Retorna status da agenda"""
+        if not self.conectado:
+            return {"carregado": False}
+        try:
+            m = self._metricas()
+            total, disponiveis = m['total'], m['disponiveis']
+            return {
+                "carregado": True,
+                "total_horarios": total,
+                "vagas_disponiveis": disponiveis,
+                "vagas_ocupadas": total - disponiveis
+            }
+        except Exception as e:
+            print(f"❌ Erro ao verificar status: {e}")
+            return {"carregado": False}
+
+    def listar_exames(self):
+        """Especialidades distintas da agenda"""
+        if not self.conectado:
+            return []
+        with self._conexao() as con:
+            return [r[0] for r in con.execute("SELECT DISTINCT exame FROM horarios WHERE exame != '' ORDER BY exame")]
+
+    def planejar_lembretes(self, dias_lista):
+        """Lembretes devidos de todos os intervalos numa única consulta"""
+        plano = {dias: [] for dias in dias_lista}
+        if not self.conectado or not dias_lista:
+            return plano
+        try:
+            hoje = date.today()
+            por_data = {}
+            for dias in dias_lista:
+                por_data.setdefault((hoje + timedelta(days=dias)).isoformat(), []).append(dias)
+            marcadores = ','.join('?' * len(por_data))
+            with self._conexao() as con:
+                rows = con.execute(
+                    f"""SELECT * FROM horarios
+                        WHERE data IN ({marcadores}) AND paciente != ''
+                          AND status_confirmacao IN ('CONFIRMADO', 'PENDENTE')
+                        ORDER BY data, horario""",
+                    list(por_data)
+                ).fetchall()
+            for r in rows:
+                enviados = r['lembretes_enviados'].split(',')
+                for dias in por_data[r['data']]:
+                    if f"{dias}d" not in enviados:
+                        plano[dias].append({
+                            "linha": r['id'],
+                            "paciente": r['paciente'],
+                            "telefone": r['telefone'],
+                            "exame": r['exame'],
+                            "clinica": r['clinica'],
+                            "data": _data_br(r['data']),
+                            "horario": r['horario'],
+                            "dias_restantes": dias
+                        })
+            return plano
+        except Exception as e:
+            print(f"❌ Erro ao planejar lembretes: {e}")
+            return {dias: [] for dias in dias_lista}
+
+    # ==================== ESCRITAS ====================
+
+    def _atualizar(self, linha, sql, params, operacao):
+        if not self.conectado:
+            return False
+        try:
+            with self._escrita() as con:
+                cur = con.execute(sql, (*params, linha))
+            return cur.rowcount > 0
+        except Exception as e:
+            print(f"❌ Erro ao {operacao}: {e}")
+            return False
+
+    def reservar_vaga(self, linha, nome, telefone):
+        """Reserva uma vaga para um paciente"""
+        ok = self._atualizar(
+            linha,
+            """UPDATE horarios SET disponivel = 0, paciente = ?, telefone = ?, telefone_sufixo = ?,
+                      status_confirmacao = 'PENDENTE', reservado_em = ?
+               WHERE id = ?""",
+            (nome, telefone, sufixo_telefone(telefone), time.time()),
+            'reservar vaga'
+        )
+        if ok:
+            print(f"✅ Vaga reservada: linha {linha} para {nome}")
+            self._registrar_mudanca('reserva', linha=linha)
+        return ok
+
+    def _reservar_se_livre(self, linha, nome, telefone):
+        """UPDATE condicional: só pega a linha se ela ainda estiver livre (vale entre processos)"""
+        if not self.conectado:
+            return None
+        try:
+            with self._escrita() as con:
+                cur = con.execute(
+                    """UPDATE horarios SET disponivel = 0, paciente = ?, telefone = ?, telefone_sufixo = ?,
+                              status_confirmacao = 'PENDENTE', reservado_em = ?
+                       WHERE id = ? AND disponivel = 1 AND paciente = ''""",
+                    (nome, telefone, sufixo_telefone(telefone), time.time(), linha)
+                )
+            return cur.rowcount > 0
+        except Exception as e:
+            print(f"❌ Erro ao reservar vaga: {e}")
+            return None
+
+    def reservar_em_lote(self, pedidos):
+        """Reserva o lote numa transação: uma consulta por exame/clínica e um executemany
+
+        O BEGIN IMMEDIATE segura as escritas de todos os processos até o
+        COMMIT, então as vagas escolhidas não mudam antes da gravação.
+        """
+        if not self.conectado:
+            return [(None, 'erro')] * len(pedidos)
+        por_exame = Counter(p['exame'] for p in pedidos)
+        agora = time.time()
+        resultados, reservas = [], []
+        try:
+            with self._transacao() as con:
+                candidatas = {}  # (exame, clinica) -> vagas livres em ordem, consumidas pelo lote
+                tomadas = set()
+                for p in pedidos:
+                    grupo = (p['exame'], p.get('clinica'))
+                    if grupo not in candidatas:
+                        # Pedidos do mesmo exame em outro grupo (outra clínica, sem clínica)
+                        # tiram no máximo as outras reservas do exame: o LIMIT cobre
+                        consulta = self._consulta_vagas(grupo[0], grupo[1], por_exame[grupo[0]])
+                        candidatas[grupo] = iter(con.execute(*consulta).fetchall())
+                    row = next((r for r in candidatas[grupo] if r['id'] not in tomadas), None)
+                    if row is None:
+                        resultados.append((None, 'sem_vaga'))
+                        continue
+                    tomadas.add(row['id'])
+                    resultados.append((row['id'], self._registro(row)))
+                    reservas.append((p['nome'], p['telefone'], sufixo_telefone(p['telefone']), agora, row['id']))
+                con.executemany(
+                    """UPDATE horarios SET disponivel = 0, paciente = ?, telefone = ?, telefone_sufixo = ?,
+                              status_confirmacao = 'PENDENTE', reservado_em = ?
+                       WHERE id = ? AND disponivel = 1""",
+                    reservas
+                )
+        except Exception as e:
+            print(f"❌ Erro ao reservar lote: {e}")
+            return [(None, 'erro')] * len(pedidos)
+
+        if reservas:
+            self._reservas += len(reservas)
+            print(f"✅ Lote reservado: {len(reservas)} de {len(pedidos)} paciente(s)")
+            self._registrar_mudanca('reserva', linhas=len(reservas))
+        return resultados
+
+    def atualizar_status(self, linha, status):
+        """Atualiza status de confirmação"""
+        ok = self._atualizar(
+            linha, 'UPDATE horarios SET status_confirmacao = ? WHERE id = ?', (status,), 'atualizar status'
+        )
+        if ok:
+            print(f"✅ Status atualizado: linha {linha} -> {status}")
+            self._registrar_mudanca('status', linha=linha, status=status)
+        return ok
+
+    def liberar_vaga(self, linha):
+        """Libera uma vaga (cancelamento)"""
+        ok = self._atualizar(
+            linha,
+            """UPDATE horarios SET disponivel = 1, paciente = '', telefone = '', telefone_sufixo = '',
+                      status_confirmacao = 'CANCELADO', reservado_em = NULL
+               WHERE id = ?""",
+            (),
+            'liberar vaga'
+        )
+        if ok:
+            print(f"✅ Vaga liberada: linha {linha}")
+            self._registrar_mudanca('cancelamento', linha=linha)
+        return ok
+
+    def marcar_lembrete_enviado(self, linha, dias_antecedencia):
+        """Marca que um lembrete foi enviado"""
+        if not self.conectado:
+            return False
+        chave = f"{dias_antecedencia}d"
+        try:
+            with self._transacao() as con:
+                row = con.execute('SELECT lembretes_enviados FROM horarios WHERE id = ?', (linha,)).fetchone()
+                if row is None:
+                    return False
+                valor_atual = row[0]
+                marcou = chave not in valor_atual.split(',')
+                if marcou:
+                    novo_valor = f"{valor_atual},{chave}" if valor_atual else chave
+                    con.execute('UPDATE horarios SET lembretes_enviados = ? WHERE id = ?', (novo_valor, linha))
+                    print(f"✅ Lembrete {chave} marcado: linha {linha}")
+            if marcou:
+                self._registrar_mudanca('lembretes', linhas=1)
+            return True
+        except Exception as e:
+            print(f"❌ Erro ao marcar lembrete: {e}")
+            return False
+
+    def marcar_lembretes_enviados(self, enviados):
+        """Marca vários lembretes [(linha, dias), ...] numa única transação"""
+        if not self.conectado:
+            return False
+        try:
+            with self._transacao() as con:
+                novos = {}
+                alteradas = set()  # só estas são gravadas: UPDATE sem mudança ainda sobe a versão
+                for linha, dias in enviados:
+                    if linha not in novos:
+                        row = con.execute('SELECT lembretes_enviados FROM horarios WHERE id = ?', (linha,)).fetchone()
+                        if row is None:
+                            continue
+                        novos[linha] = row[0]
+                    chave = f"{dias}d"
+                    if chave not in novos[linha].split(','):
+                        novos[linha] = f"{novos[linha]},{chave}" if novos[linha] else chave
+                        alteradas.add(linha)
+                con.executemany(
+                    'UPDATE horarios SET lembretes_enviados = ? WHERE id = ?',
+                    [(novos[linha], linha) for linha in alteradas]
+                )
+            print(f"✅ Lembretes marcados: {len(alteradas)} linha(s)")
+            if alteradas:
+                self._registrar_mudanca('lembretes', linhas=len(alteradas))
+            return True
+        except Exception as e:
+            print(f"❌ Erro ao marcar lembretes: {e}")
+            return False
+
+    def estatisticas(self):
+        return {"caminho": self.caminho, "conexoes_no_pool": self._pool.qsize()}
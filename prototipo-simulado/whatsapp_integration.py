@@ -4,8 +4,16 @@ Sistema SUS Hackapel 2025
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import uuid
+import hashlib
+import shutil
+import string
+import time
+import random
+import threading
+from collections import deque
 from gtts import gTTS
 
 # ==================== CONFIGURAÇÃO ====================
@@ -14,6 +22,12 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 AUDIO_DIR = os.path.join(BASE_DIR, 'static', 'audios')
 os.makedirs(AUDIO_DIR, exist_ok=True)
 
+# Transporte HTTP da Evolution API
+WHATSAPP_POOL_SIZE = int(os.environ.get('WHATSAPP_POOL_SIZE', '10'))
+WHATSAPP_MAX_TENTATIVAS = int(os.environ.get('WHATSAPP_MAX_TENTATIVAS', '3'))
+WHATSAPP_BACKOFF_BASE = float(os.environ.get('WHATSAPP_BACKOFF_BASE', '0.5'))
+STATUS_RETENTAVEIS = {429, 500, 502, 503, 504}
+
 def get_public_url():
     """Retorna URL pública para áudios"""
     domain = os.environ.get('RAILWAY_PUBLIC_DOMAIN', '')
@@ -24,26 +38,157 @@ def get_public_url():
 # ==================== TEXT-TO-SPEECH ====================
 
 class TTS:
-    """Gerador de áudio"""
+    """Gerador de áudio com cache por conteúdo
+    
+    O arquivo se chama tts_<hash do texto normalizado + idioma>.mp3, então
+    a mesma mensagem reaproveita o mesmo arquivo e a mesma URL. Pedidos
+    simultâneos do mesmo texto esperam uma única síntese.
+    
+    Mensagens de template podem ser compostas por segmentos (gerar_composto):
+    cada trecho fixo ou campo é sintetizado uma vez em seg_<hash>.mp3 e o
+    áudio final é a concatenação dos MP3 (o próprio gTTS junta assim os
+    pedaços de textos longos).
+    """
+    
+    EMOJIS = ['✅', '❌', '📅', '⏰', '🏥', '👨‍⚕️', '👴', '👵', '📲', '1️⃣', '2️⃣', '🔔', '⚠️', '📞', '💡', '📋']
+    
+    _trava = threading.Lock()
+    _em_andamento = {}  # arquivo -> Event da síntese em curso
+    _contadores = {
+        "mensagens": {"hits": 0, "misses": 0, "coalescidos": 0},
+        "segmentos": {"hits": 0, "misses": 0, "coalescidos": 0}
+    }
+    sinteses = 0  # chamadas ao gTTS
+    
+    @classmethod
+    def normalizar(cls, texto):
+        """Remove emojis, troca quebras de linha por pausa e junta espaços"""
+        for emoji in cls.EMOJIS:
+            texto = texto.replace(emoji, '')
+        texto = texto.replace('\n', '. ')
+        return ' '.join(texto.split())
+    
+    @staticmethod
+    def chave(texto, lang):
+        return hashlib.sha256(f"{lang}\0{texto}".encode('utf-8')).hexdigest()[:24]
+    
+    @staticmethod
+    def _tocar(path):
+        """Renova o mtime do arquivo (a retenção de áudios apaga por LRU de mtime)
+        
+        Retorna False se o arquivo não existe (nunca gerado ou já removido).
+        """
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
     
     @staticmethod
-    def gerar(texto):
-        """Gera MP3 a partir de texto"""
+    def _url(filename):
+        return f"{get_public_url()}/static/audios/{filename}"
+    
+    @classmethod
+    def _obter(cls, filename, produzir, grupo):
+        """Reaproveita o arquivo do cache ou o produz uma única vez
+        
+        `produzir(destino)` escreve o áudio em `destino`; quem pedir o
+        mesmo arquivo enquanto isso espera essa produção. Retorna True
+        se o arquivo já existia.
+        """
+        path = os.path.join(AUDIO_DIR, filename)
+        contadores = cls._contadores[grupo]
+        
+        with cls._trava:
+            if cls._tocar(path):
+                contadores["hits"] += 1
+                return True
+            evento = cls._em_andamento.get(filename)
+            dono = evento is None
+            if dono:
+                evento = cls._em_andamento[filename] = threading.Event()
+                contadores["misses"] += 1
+            else:
+                contadores["coalescidos"] += 1
+        
+        if not dono:
+            # Mesmo áudio já está sendo produzido: espera o resultado
+            evento.wait(timeout=60)
+            if os.path.exists(path):
+                return True
+            raise RuntimeError("síntese concorrente falhou")
+        
+        try:
+            temporario = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            produzir(temporario)
+            os.replace(temporario, path)  # atômico: ninguém vê arquivo pela metade
+        finally:
+            with cls._trava:
+                cls._em_andamento.pop(filename, None)
+            evento.set()
+        return False
+    
+    @classmethod
+    def _sintetizar(cls, texto, lang, destino):
+        gTTS(text=texto, lang=lang, slow=False).save(destino)
+        with cls._trava:
+            cls.sinteses += 1
+    
+    @classmethod
+    def gerar(cls, texto, lang='pt-br'):
+        """Gera MP3 a partir de texto (ou reaproveita o já gerado)"""
         try:
-            # Limpar emojis
-            for emoji in ['✅', '❌', '📅', '⏰', '🏥', '👨‍⚕️', '👴', '👵', '📲', '1️⃣', '2️⃣', '🔔', '⚠️', '📞', '💡', '📋']:
-                texto = texto.replace(emoji, '')
-            texto = texto.replace('\n', '. ')
+            texto = cls.normalizar(texto)
+            filename = f"tts_{cls.chave(texto, lang)}.mp3"
+            cache = cls._obter(filename, lambda destino: cls._sintetizar(texto, lang, destino), "mensagens")
+            return {"sucesso": True, "url": cls._url(filename), "cache": cache}
+        except Exception as e:
+            return {"sucesso": False, "erro": str(e)}
+    
+    @classmethod
+    def gerar_composto(cls, segmentos, lang='pt-br'):
+        """Gera o MP3 de uma mensagem juntando o áudio de cada segmento
+        
+        `segmentos` é a mensagem quebrada em trechos (ver MensagensSUS.montar).
+        Só os trechos ainda fora do cache chamam o gTTS; trechos sem nada
+        pronunciável (pontuação, quebras de linha) são pulados.
+        """
+        try:
+            partes = []
+            for texto in segmentos:
+                texto = cls.normalizar(texto)
+                if any(c.isalnum() for c in texto):
+                    partes.append((texto, f"seg_{cls.chave(texto, lang)}.mp3"))
+            if not partes:
+                return {"sucesso": False, "erro": "mensagem sem texto"}
             
-            filename = f"tts_{uuid.uuid4().hex[:8]}.mp3"
-            path = os.path.join(AUDIO_DIR, filename)
+            filename = f"tts_{cls.chave(' '.join(nome for _, nome in partes), lang)}.mp3"
             
-            tts = gTTS(text=texto, lang='pt-br', slow=False)
-            tts.save(path)
+            def concatenar(destino):
+                for texto, nome in partes:
+                    cls._obter(nome, lambda d, t=texto: cls._sintetizar(t, lang, d), "segmentos")
+                with open(destino, 'wb') as saida:
+                    for _, nome in partes:
+                        with open(os.path.join(AUDIO_DIR, nome), 'rb') as entrada:
+                            shutil.copyfileobj(entrada, saida)
             
-            return {"sucesso": True, "url": f"{get_public_url()}/static/audios/{filename}"}
+            cache = cls._obter(filename, concatenar, "mensagens")
+            return {"sucesso": True, "url": cls._url(filename), "cache": cache}
         except Exception as e:
             return {"sucesso": False, "erro": str(e)}
+    
+    @classmethod
+    def estatisticas(cls):
+        """Acertos do cache de áudio (mensagens inteiras e segmentos)"""
+        with cls._trava:
+            resumo = {}
+            for grupo, c in cls._contadores.items():
+                total = c["hits"] + c["misses"] + c["coalescidos"]
+                resumo[grupo] = dict(
+                    c, taxa_acerto=round((c["hits"] + c["coalescidos"]) / total, 3) if total else 0.0
+                )
+            resumo["sinteses_gtts"] = cls.sinteses
+            return resumo
 
 # ==================== CLIENTE WHATSAPP ====================
 
@@ -61,12 +206,97 @@ class WhatsAppClient:
         self.headers = {'Content-Type': 'application/json', 'apikey': self.api_key}
         self.modo_simulacao = not self.api_key or not self.base_url
         
+        # Sessão com pool keep-alive: evita um handshake TCP+TLS por mensagem
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=WHATSAPP_POOL_SIZE)
+        self.session.mount('https://', adaptador)
+        self.session.mount('http://', adaptador)
+        
+        # Métricas por operação (latência das últimas chamadas)
+        self._trava = threading.Lock()
+        self._metricas = {}
+        
         print(f"🔧 WhatsApp Config:")
         print(f"   URL: {self.base_url}")
         print(f"   Instance: {self.instance}")
         print(f"   API Key: {'✅ Configurada' if self.api_key else '❌ Não configurada'}")
         print(f"   Modo: {'⚠️ SIMULAÇÃO' if self.modo_simulacao else '✅ PRODUÇÃO'}")
     
+    # ==================== TRANSPORTE HTTP ====================
+    
+    def _registrar(self, operacao, inicio, erro=False, retentativa=False):
+        with self._trava:
+            m = self._metricas.setdefault(operacao, {
+                "chamadas": 0, "retentativas": 0, "erros": 0, "latencias": deque(maxlen=500)
+            })
+            m["chamadas"] += 1
+            m["latencias"].append(time.perf_counter() - inicio)
+            if erro:
+                m["erros"] += 1
+            if retentativa:
+                m["retentativas"] += 1
+    
+    @staticmethod
+    def _espera(tentativa, retry_after=None):
+        """Backoff exponencial com jitter (ou o Retry-After do servidor)"""
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), 30.0)
+        except ValueError:
+            pass
+        teto = WHATSAPP_BACKOFF_BASE * 2 ** (tentativa - 1)
+        return random.uniform(teto / 2, teto)
+    
+    def _requisitar(self, metodo, caminho, operacao, **kwargs):
+        """Faz a chamada pela sessão compartilhada, repetindo em 429/5xx
+        
+        Só falhas de conexão (a requisição nem chegou) e respostas 429/5xx
+        são repetidas; timeout de leitura não, para não duplicar mensagem.
+        """
+        url = f"{self.base_url}{caminho}"
+        for tentativa in range(1, WHATSAPP_MAX_TENTATIVAS + 1):
+            ultima = tentativa == WHATSAPP_MAX_TENTATIVAS
+            inicio = time.perf_counter()
+            try:
+                resp = self.session.request(metodo, url, **kwargs)
+            except requests.ConnectionError:
+                self._registrar(operacao, inicio, erro=True, retentativa=not ultima)
+                if ultima:
+                    raise
+                time.sleep(self._espera(tentativa))
+                continue
+            except requests.RequestException:
+                self._registrar(operacao, inicio, erro=True)
+                raise
+            
+            if resp.status_code in STATUS_RETENTAVEIS and not ultima:
+                self._registrar(operacao, inicio, erro=True, retentativa=True)
+                espera = self._espera(tentativa, resp.headers.get('Retry-After'))
+                print(f"🔁 {operacao}: HTTP {resp.status_code}, nova tentativa em {espera:.1f}s")
+                time.sleep(espera)
+                continue
+            
+            self._registrar(operacao, inicio, erro=resp.status_code >= 400)
+            return resp
+    
+    def estatisticas(self):
+        """Chamadas, retentativas, erros e latência (ms) por operação"""
+        with self._trava:
+            resumo = {}
+            for operacao, m in self._metricas.items():
+                latencias = sorted(m["latencias"])
+                n = len(latencias)
+                resumo[operacao] = {
+                    "chamadas": m["chamadas"],
+                    "retentativas": m["retentativas"],
+                    "erros": m["erros"],
+                    "latencia_media_ms": round(sum(latencias) / n * 1000, 1) if n else None,
+                    "latencia_p50_ms": round(latencias[n // 2] * 1000, 1) if n else None,
+                    "latencia_p95_ms": round(latencias[min(n - 1, int(n * 0.95))] * 1000, 1) if n else None
+                }
+            return {"pool_conexoes": WHATSAPP_POOL_SIZE, "operacoes": resumo}
+    
     def _formatar(self, tel):
         """Formata telefone para Evolution API (com código 55 do Brasil)"""
         num = ''.join(c for c in str(tel) if c.isdigit())
@@ -86,13 +316,13 @@ class WhatsAppClient:
         
         try:
             numero = self._formatar(telefone)
-            url = f"{self.base_url}/message/sendText/{self.instance}"
+            caminho = f"/message/sendText/{self.instance}"
             payload = {"number": numero, "textMessage": {"text": msg}}
             
-            print(f"📤 Enviando para: {url}")
+            print(f"📤 Enviando para: {self.base_url}{caminho}")
             print(f"📦 Payload: number={numero}, msg={msg[:50]}...")
             
-            resp = requests.post(url, headers=self.headers, json=payload, timeout=15)
+            resp = self._requisitar('POST', caminho, 'enviar_texto', json=payload, timeout=15)
             
             print(f"📡 Status: {resp.status_code}")
             print(f"📡 Resposta: {resp.text[:200] if resp.text else 'vazio'}")
@@ -109,9 +339,8 @@ class WhatsAppClient:
             return {"sucesso": True}
         
         try:
-            resp = requests.post(
-                f"{self.base_url}/message/sendMedia/{self.instance}",
-                headers=self.headers,
+            resp = self._requisitar(
+                'POST', f"/message/sendMedia/{self.instance}", 'enviar_audio',
                 json={"number": self._formatar(telefone), "mediaMessage": {"mediatype": "audio", "media": url}},
                 timeout=15
             )
@@ -119,8 +348,12 @@ class WhatsAppClient:
         except:
             return {"sucesso": False}
     
-    def enviar_mensagem_completa(self, telefone, msg, com_audio=True):
-        """Envia texto + áudio TTS"""
+    def enviar_mensagem_completa(self, telefone, msg, com_audio=True, segmentos=None):
+        """Envia texto + áudio TTS
+        
+        Com `segmentos` (MensagensSUS.montar), o áudio é composto a partir
+        dos trechos em cache em vez de sintetizar a mensagem inteira.
+        """
         resultado = {"sucesso": False, "texto_enviado": False, "audio_enviado": False}
         
         # Texto
@@ -130,7 +363,7 @@ class WhatsAppClient:
         
         # Áudio TTS
         if com_audio:
-            audio = TTS.gerar(msg)
+            audio = TTS.gerar_composto(segmentos) if segmentos else TTS.gerar(msg)
             if audio.get("sucesso"):
                 res = self.enviar_audio(telefone, audio["url"])
                 resultado["audio_enviado"] = res.get("sucesso", False)
@@ -143,9 +376,8 @@ class WhatsAppClient:
             return {"conectado": False, "simulacao": True}
         
         try:
-            resp = requests.get(
-                f"{self.base_url}/instance/connectionState/{self.instance}",
-                headers=self.headers, timeout=10
+            resp = self._requisitar(
+                'GET', f"/instance/connectionState/{self.instance}", 'verificar_conexao', timeout=10
             )
             if resp.status_code == 200:
                 data = resp.json()
@@ -161,18 +393,14 @@ class WhatsAppClient:
             return {"sucesso": False, "erro": "API não configurada"}
         
         try:
-            resp = requests.get(
-                f"{self.base_url}/instance/connect/{self.instance}",
-                headers=self.headers, timeout=10
-            )
+            resp = self._requisitar('GET', f"/instance/connect/{self.instance}", 'obter_qrcode', timeout=10)
             if resp.status_code == 200:
                 data = resp.json()
                 return {"sucesso": True, "qrcode": data.get('base64')}
             elif resp.status_code == 404:
                 # Criar instância
-                resp = requests.post(
-                    f"{self.base_url}/instance/create",
-                    headers=self.headers,
+                resp = self._requisitar(
+                    'POST', "/instance/create", 'criar_instancia',
                     json={"instanceName": self.instance, "qrcode": True},
                     timeout=10
                 )
@@ -192,12 +420,15 @@ class WhatsAppClient:
 # ==================== TEMPLATES DE MENSAGENS ====================
 
 class MensagensSUS:
-    """Templates de mensagens"""
+    """Templates de mensagens
     
-    @staticmethod
-    def agendamento_confirmado(nome, exame, data, horario, clinica, idade=None):
-        prioridade = f"\n👴 Idade: {idade} anos - ATENDIMENTO PRIORITÁRIO" if idade else ""
-        return f"""✅ AGENDAMENTO CONFIRMADO
+    Os textos ficam em TEMPLATES como format strings. `montar` devolve,
+    além do texto, a mensagem quebrada em trechos fixos e campos, que o
+    TTS sintetiza e guarda separadamente (TTS.gerar_composto).
+    """
+    
+    TEMPLATES = {
+        "agendamento_confirmado": """✅ AGENDAMENTO CONFIRMADO
 
 Olá, {nome}!
 
@@ -210,11 +441,9 @@ Olá, {nome}!
 1️⃣ - CONFIRMAR presença
 2️⃣ - CANCELAR consulta
 
-Sistema SUS - Hackapel 2025"""
-    
-    @staticmethod
-    def consulta_confirmada(nome):
-        return f"""✅ CONSULTA CONFIRMADA!
+Sistema SUS - Hackapel 2025""",
+
+        "consulta_confirmada": """✅ CONSULTA CONFIRMADA!
 
 Olá, {nome}!
 
@@ -223,11 +452,9 @@ Compareça no dia e horário agendados.
 
 Leve: RG, Cartão SUS, exames anteriores.
 
-Sistema SUS - Hackapel 2025"""
-    
-    @staticmethod
-    def consulta_cancelada(nome):
-        return f"""❌ CONSULTA CANCELADA
+Sistema SUS - Hackapel 2025""",
+
+        "consulta_cancelada": """❌ CONSULTA CANCELADA
 
 Olá, {nome}!
 
@@ -236,11 +463,9 @@ O horário foi liberado.
 
 Para reagendar: (53) 3000-0000
 
-Sistema SUS - Hackapel 2025"""
-    
-    @staticmethod
-    def lembrete_7_dias(nome, exame, data, horario, clinica):
-        return f"""🔔 LEMBRETE - 7 DIAS
+Sistema SUS - Hackapel 2025""",
+
+        "lembrete_7_dias": """🔔 LEMBRETE - 7 DIAS
 
 Olá, {nome}!
 
@@ -256,11 +481,9 @@ Faltam 7 dias para sua consulta.
 📲 Responda:
 2️⃣ - Para CANCELAR
 
-Sistema SUS - Hackapel 2025"""
-    
-    @staticmethod
-    def lembrete_5_dias(nome, exame, data, horario, clinica):
-        return f"""🔔 LEMBRETE - 5 DIAS
+Sistema SUS - Hackapel 2025""",
+
+        "lembrete_5_dias": """🔔 LEMBRETE - 5 DIAS
 
 Olá, {nome}!
 
@@ -277,11 +500,9 @@ Separe seus documentos: RG e Cartão SUS.
 📲 Responda:
 2️⃣ - Para CANCELAR
 
-Sistema SUS - Hackapel 2025"""
-    
-    @staticmethod
-    def lembrete_3_dias(nome, exame, data, horario, clinica):
-        return f"""🔔 LEMBRETE - 3 DIAS
+Sistema SUS - Hackapel 2025""",
+
+        "lembrete_3_dias": """🔔 LEMBRETE - 3 DIAS
 
 Olá, {nome}!
 
@@ -300,11 +521,9 @@ Sua consulta é em 3 dias!
 📲 Responda:
 2️⃣ - Para CANCELAR
 
-Sistema SUS - Hackapel 2025"""
-    
-    @staticmethod
-    def lembrete_24h(nome, exame, data, horario, clinica):
-        return f"""🔔 LEMBRETE URGENTE - AMANHÃ!
+Sistema SUS - Hackapel 2025""",
+
+        "lembrete_24h": """🔔 LEMBRETE URGENTE - AMANHÃ!
 
 Olá, {nome}!
 
@@ -324,6 +543,48 @@ Sua consulta é AMANHÃ!
 2️⃣ - Para CANCELAR (urgente)
 
 Sistema SUS - Hackapel 2025"""
+    }
+    
+    @classmethod
+    def montar(cls, template, **campos):
+        """(texto, segmentos) do template preenchido"""
+        segmentos = []
+        for fixo, campo, _, _ in string.Formatter().parse(cls.TEMPLATES[template]):
+            if fixo:
+                segmentos.append(fixo)
+            if campo is not None:
+                segmentos.append(str(campos[campo]))
+        return ''.join(segmentos), segmentos
+    
+    @classmethod
+    def agendamento_confirmado(cls, nome, exame, data, horario, clinica, idade=None):
+        prioridade = f"\n👴 Idade: {idade} anos - ATENDIMENTO PRIORITÁRIO" if idade else ""
+        return cls.montar('agendamento_confirmado', nome=nome, exame=exame, data=data,
+                          horario=horario, clinica=clinica, prioridade=prioridade)[0]
+    
+    @classmethod
+    def consulta_confirmada(cls, nome):
+        return cls.montar('consulta_confirmada', nome=nome)[0]
+    
+    @classmethod
+    def consulta_cancelada(cls, nome):
+        return cls.montar('consulta_cancelada', nome=nome)[0]
+    
+    @classmethod
+    def lembrete_7_dias(cls, nome, exame, data, horario, clinica):
+        return cls.montar('lembrete_7_dias', nome=nome, exame=exame, data=data, horario=horario, clinica=clinica)[0]
+    
+    @classmethod
+    def lembrete_5_dias(cls, nome, exame, data, horario, clinica):
+        return cls.montar('lembrete_5_dias', nome=nome, exame=exame, data=data, horario=horario, clinica=clinica)[0]
+    
+    @classmethod
+    def lembrete_3_dias(cls, nome, exame, data, horario, clinica):
+        return cls.montar('lembrete_3_dias', nome=nome, exame=exame, data=data, horario=horario, clinica=clinica)[0]
+    
+    @classmethod
+    def lembrete_24h(cls, nome, exame, data, horario, clinica):
+        return cls.montar('lembrete_24h', nome=nome, exame=exame, data=data, horario=horario, clinica=clinica)[0]
 
 # ==================== INSTÂNCIA GLOBAL ====================
 